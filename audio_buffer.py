@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# audio_buffer.py — 合成音声をメモリ上に1つだけ持ち、再生と口パク解析で共有する
+
+import io
+import os
+import numpy as np
+import soundfile as sf
+
+try:
+    import simpleaudio as sa
+except Exception:  # 未インストール（音声デバイスの無い環境）。play() だけ使えない
+    sa = None
+
+SAVE_WAV = os.environ.get("SORA_SAVE_WAV", "0") == "1"  # 1 ならデバッグ/保存用にWAVも書き出す
+
+class AudioClip:
+    """
+    1発話ぶんの音声。WAVバイト列は一度だけデコードし、int16 PCM（フレーム数×ch、C連続）で保持する。
+    再生（simpleaudio.play_buffer）と解析（compute_lipsync_track）は同じ配列をコピーせずに使う。
+    """
+    def __init__(self, pcm: np.ndarray, sample_rate: int, wav_bytes: bytes = b""):
+        if pcm.ndim == 1:
+            pcm = pcm[:, None]
+        self.pcm = np.ascontiguousarray(pcm, dtype=np.int16)
+        self.sample_rate = int(sample_rate)
+        self.wav_bytes = wav_bytes
+
+    @classmethod
+    def from_wav_bytes(cls, wav_bytes: bytes) -> "AudioClip":
+        pcm, sr = sf.read(io.BytesIO(wav_bytes), dtype="int16", always_2d=True)
+        return cls(pcm, sr, wav_bytes)
+
+    @property
+    def channels(self) -> int:
+        return self.pcm.shape[1]
+
+    @property
+    def frames(self) -> int:
+        return self.pcm.shape[0]
+
+    @property
+    def duration(self) -> float:
+        return self.frames / float(self.sample_rate or 1)
+
+    def play(self) -> "sa.PlayObject":
+        return sa.play_buffer(self.pcm, self.channels, 2, self.sample_rate)
+
+    def save(self, path: str):
+        """アーカイブ/デバッグ用。元のWAVバイト列をそのまま書く"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            if self.wav_bytes:
+                f.write(self.wav_bytes)
+            else:
+                sf.write(f, self.pcm, self.sample_rate, format="WAV", subtype="PCM_16")
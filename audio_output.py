@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+# audio_output.py — 再生中でもPCMを追加できるリングバッファ式の出力エンジン（継ぎ目なし再生）
+#   sounddevice があればコールバック出力、無ければ simpleaudio で1区間ずつ鳴らす代替版を使う。
+#   SORA_AUDIO_BACKEND=null なら音を出さずに実時間だけ進める（音声デバイスの無いCI・計測用）。
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Callable, List, Optional
+
+import numpy as np
+
+try:
+    import simpleaudio as sa
+except Exception:  # 未インストール（null 出力だけ使う環境）
+    sa = None
+
+try:
+    import sounddevice as sd
+except Exception:  # 未インストール / PortAudio 無し
+    sd = None
+
+AUDIO_BACKEND = os.environ.get("SORA_AUDIO_BACKEND", "auto").lower()  # auto / sounddevice / simpleaudio / null
+RING_SECONDS = 30.0  # リングバッファの長さ（秒）
+BLOCKSIZE    = 256   # コールバック1回のフレーム数（24kHzで約10ms）
+
+class Segment:
+    """
+    enqueue() で積んだ1区間。started/done は再生の開始・終了（取り消し時も done が立つ）。
+    start_time は先頭サンプルが実際に鳴る時刻（time.perf_counter 基準）。
+    取り消された場合、played_frames にそれまでに鳴ったフレーム数が入る（割り込み時の発話の切り詰め用）。
+    """
+    def __init__(self, start_frame: int, end_frame: int, sample_rate: int):
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.sample_rate = sample_rate
+        self.start_time: Optional[float] = None
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.cancelled = False
+        self.played_frames = 0
+        self._on_cancel: List[Callable[[], None]] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end_frame - self.start_frame) / float(self.sample_rate)
+
+    @property
+    def played_fraction(self) -> float:
+        """鳴った割合（0..1）。最後まで鳴れば 1、取り消されたらそこまでの割合"""
+        if not self.cancelled:
+            return 1.0 if self.done.is_set() else 0.0
+        total = self.end_frame - self.start_frame
+        return min(1.0, self.played_frames / total) if total > 0 else 1.0
+
+    def on_cancel(self, fn: Callable[[], None]):
+        self._on_cancel.append(fn)
+
+    def _cancel(self, played_frames: int = 0):
+        self.cancelled = True
+        self.played_frames = max(0, int(played_frames))
+        self.started.set()
+        self.done.set()
+        for fn in self._on_cancel:
+            try:
+                fn()
+            except Exception:
+                pass
+
+class AudioOutput:
+    """
+    int16 PCM のリングバッファ。enqueue() は再生中でも積めて、前の区間の直後から隙間なく鳴る。
+    位置は出力デバイスの DAC 時刻から求めるので、口パク/モーションの原点合わせに使える。
+    flush() は未再生分を捨て、cancel() はそれに加えて鳴っている区間も即座に止める。
+    """
+    def __init__(self, sample_rate: int = 24000, channels: int = 1,
+                 ring_seconds: float = RING_SECONDS, blocksize: int = BLOCKSIZE):
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self._ring = np.zeros((int(ring_seconds * sample_rate), channels), dtype=np.int16)
+        self._read = 0    # 再生済みフレーム（通算）
+        self._write = 0   # 書き込み済みフレーム（通算）
+        self._segments = deque()
+        self._cond = threading.Condition()
+        # 直近のコールバック：(先頭フレーム, そのフレームが鳴る perf_counter 時刻)
+        self._last_block = (0, None)
+        self._stream = sd.OutputStream(
+            samplerate=self.sample_rate, channels=self.channels, dtype="int16",
+            blocksize=blocksize, callback=self._callback,
+        )
+        self._stream.start()
+
+    # --- オーディオスレッド ---
+    def _callback(self, outdata, frames, time_info, status):
+        dac_delay = max(0.0, time_info.outputBufferDacTime - time_info.currentTime)
+        block_time = time.perf_counter() + dac_delay
+        with self._cond:
+            first = self._read
+            n = min(frames, self._write - self._read)
+            cap = len(self._ring)
+            pos = self._read % cap
+            head = min(n, cap - pos)
+            outdata[:head] = self._ring[pos:pos + head]
+            outdata[head:n] = self._ring[:n - head]
+            outdata[n:] = 0
+            self._read += n
+            self._last_block = (first, block_time)
+            while self._segments:
+                seg = self._segments[0]
+                if seg.start_time is None and seg.start_frame < self._read:
+                    seg.start_time = block_time + (seg.start_frame - first) / self.sample_rate
+                    seg.started.set()
+                if seg.end_frame <= self._read:
+                    self._segments.popleft()
+                    seg.done.set()
+                    continue
+                break
+            self._cond.notify_all()
+
+    # --- 呼び出し側 ---
+    def enqueue(self, pcm: np.ndarray, block: bool = True) -> Segment:
+        if pcm.ndim == 1:
+            pcm = pcm[:, None]
+        cap = len(self._ring)
+        with self._cond:
+            # 再生が途切れていたら無音区間を詰めずに今の位置から始める
+            start = max(self._write, self._read)
+            self._write = start
+            seg = Segment(start, start + len(pcm), self.sample_rate)
+            self._segments.append(seg)
+            offset = 0
+            # 待っている間に取り消されたら（cancel/flush）、残りは書かない
+            while offset < len(pcm) and not seg.cancelled:
+                space = cap - (self._write - self._read)
+                if space <= 0:
+                    if not block:
+                        break
+                    self._cond.wait(timeout=0.1)
+                    continue
+                n = min(space, len(pcm) - offset)
+                pos = self._write % cap
+                head = min(n, cap - pos)
+                self._ring[pos:pos + head] = pcm[offset:offset + head]
+                self._ring[:n - head] = pcm[offset + head:offset + n]
+                self._write += n
+                offset += n
+            if seg.cancelled:
+                return seg
+            seg.end_frame = seg.start_frame + offset
+        return seg
+
+    def position(self) -> float:
+        """出力デバイスで今鳴っている位置（通算秒）"""
+        with self._cond:
+            first, block_time = self._last_block
+            read = self._read
+        if block_time is None:
+            return 0.0
+        pos = first / self.sample_rate + (time.perf_counter() - block_time)
+        return max(0.0, min(pos, read / self.sample_rate))
+
+    def flush(self):
+        """未再生の区間を捨てる（今鳴っている区間は最後まで鳴らす）"""
+        with self._cond:
+            playing = [s for s in self._segments if s.started.is_set()]
+            dropped = [s for s in self._segments if not s.started.is_set()]
+            self._segments = deque(playing)
+            self._write = max(self._read, playing[-1].end_frame if playing else self._read)
+            self._cond.notify_all()
+        for seg in dropped:
+            seg._cancel()
+
+    def cancel(self):
+        """鳴っている区間も含めて即座に止める"""
+        with self._cond:
+            dropped = [(s, self._read - s.start_frame) for s in self._segments]
+            self._segments.clear()
+            self._write = self._read
+            self._cond.notify_all()
+        for seg, played in dropped:
+            seg._cancel(played)
+
+    def idle(self) -> bool:
+        with self._cond:
+            return self._write <= self._read
+
+    def close(self):
+        self.cancel()
+        try:
+            self._stream.stop()
+            self._stream.close()
+        except Exception:
+            pass
+
+class SimpleAudioOutput:
+    """
+    sounddevice が無い環境向けの代替版（同じインターフェース）。
+    区間は1本のスレッドで順に simpleaudio で鳴らすので、区間の間にわずかな隙間が残る。
+    """
+    def __init__(self, sample_rate: int = 24000, channels: int = 1, **_):
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._current = None  # (Segment, PlayObject)
+        self._frames = 0
+        self._closed = False
+        self._th = threading.Thread(target=self._run, name="AudioOutput", daemon=True)
+        self._th.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                seg, pcm = self._queue.popleft()
+                play = self._play(seg, pcm)
+                seg.start_time = time.perf_counter()
+                self._current = (seg, play)
+            seg.started.set()
+            play.wait_done()
+            with self._cond:
+                self._current = None
+            seg.done.set()
+
+    def _play(self, seg: Segment, pcm: np.ndarray):
+        return sa.play_buffer(pcm, self.channels, 2, self.sample_rate)
+
+    def enqueue(self, pcm: np.ndarray, block: bool = True) -> Segment:
+        pcm = np.ascontiguousarray(pcm if pcm.ndim == 2 else pcm[:, None], dtype=np.int16)
+        with self._cond:
+            seg = Segment(self._frames, self._frames + len(pcm), self.sample_rate)
+            self._frames += len(pcm)
+            self._queue.append((seg, pcm))
+            self._cond.notify()
+        return seg
+
+    def position(self) -> float:
+        with self._cond:
+            if self._current is None:
+                return self._frames / self.sample_rate
+            seg, _ = self._current
+        return seg.start_frame / self.sample_rate + (time.perf_counter() - seg.start_time)
+
+    def flush(self):
+        with self._cond:
+            dropped = [seg for seg, _ in self._queue]
+            self._queue.clear()
+        for seg in dropped:
+            seg._cancel()
+
+    def cancel(self):
+        self.flush()
+        with self._cond:
+            current, self._current = self._current, None
+        if current:
+            seg, play = current
+            play.stop()
+            seg._cancel((time.perf_counter() - seg.start_time) * self.sample_rate)
+
+    def idle(self) -> bool:
+        with self._cond:
+            return self._current is None and not self._queue
+
+    def close(self):
+        self.cancel()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+class _SilentPlay:
+    """simpleaudio の PlayObject と同じ形で、鳴らさずに再生時間だけ待つ"""
+    def __init__(self, duration: float):
+        self._duration = duration
+        self._stopped = threading.Event()
+
+    def wait_done(self):
+        self._stopped.wait(self._duration)
+
+    def stop(self):
+        self._stopped.set()
+
+class NullAudioOutput(SimpleAudioOutput):
+    """
+    音を出さない出力（同じインターフェース・実時間で進む）。音声デバイスの無いCIや遅延計測用。
+    history に鳴らした（ことにした）区間を古い順に最大 HISTORY 件残す（start_time/duration で計測できる）。
+    """
+    HISTORY = 1000
+
+    def __init__(self, sample_rate: int = 24000, channels: int = 1, **_):
+        self.history = deque(maxlen=self.HISTORY)
+        super().__init__(sample_rate, channels)
+
+    def _play(self, seg: Segment, pcm: np.ndarray):
+        self.history.append(seg)
+        return _SilentPlay(len(pcm) / float(self.sample_rate))
+
+_output = None
+_output_lock = threading.Lock()
+
+def _output_class():
+    if AUDIO_BACKEND == "null":
+        return NullAudioOutput
+    if AUDIO_BACKEND == "simpleaudio" or sd is None:
+        if sa is None:
+            print("ℹ️ 音声出力ライブラリが無いため、音を出さずに進めます")
+            return NullAudioOutput
+        return SimpleAudioOutput
+    return AudioOutput
+
+def get_audio_output(sample_rate: int = 24000, channels: int = 1):
+    """
+    プロセス共有の出力エンジン。形式が変わった場合は鳴り終わるのを待って作り直す。
+    待つ間はロックを持たない（cancel_audio_output で割り込めるように）。
+    """
+    global _output
+    while True:
+        with _output_lock:
+            old = _output
+            if old is None:
+                _output = _output_class()(sample_rate, channels)
+                return _output
+            if (old.sample_rate, old.channels) == (sample_rate, channels):
+                return old
+        while not old.idle():
+            time.sleep(0.01)
+        with _output_lock:
+            if _output is not old:
+                continue  # 待っている間に別のスレッドが作り直した
+            _output = None
+        old.close()
+
+def cancel_audio_output():
+    """鳴っている音声と積まれている音声をすべて止める（割り込み用）。エンジン未作成なら何もしない"""
+    with _output_lock:
+        out = _output
+    if out is not None:
+        out.cancel()
+
+def shutdown_audio_output():
+    global _output
+    with _output_lock:
+        out, _output = _output, None
+    if out is not None:
+        out.close()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# auto_talk.py — 自動発話の先読み（無言の間に次の一言を生成・合成しておき、タイマーが来たら即再生）
+
+import os
+import time
+import threading
+from typing import Optional, Tuple
+
+# 自動発話の何秒前から先読みを始めるか（0 で先読みしない）
+PREFETCH_LEAD = float(os.environ.get("SORA_AUTOTALK_PREFETCH_LEAD", "60"))
+# 先読みに失敗した版をやり直すまでの秒数（会話が進めばすぐ先読みする）
+RETRY_SEC = float(os.environ.get("SORA_AUTOTALK_RETRY_SEC", "60"))
+
+class PreparedTalk:
+    """
+    先読み済みの自動発話：応答・感情・声色・音声・audio_query・口パク/モーション（prepare_performance の結果）。
+    version は生成時点の会話の版。会話が進んだら使わない。
+    """
+    def __init__(self, version: int, reply: str, emotion: str, style_id: int, clip, aq_json: str, performance):
+        self.version = version
+        self.reply = reply
+        self.emotion = emotion
+        self.style_id = style_id
+        self.clip = clip
+        self.aq_json = aq_json
+        self.performance = performance
+
+class AutoTalkPrefetcher:
+    """
+    start() で agent.prepare_auto_talk() を別スレッドで走らせ、結果を1件だけ持っておく。
+    会話が変わる（agent.conv_version が進む）と古い結果は take() で返さない。
+    失敗した版は retry 秒たつまで先読みし直さない。
+    """
+    def __init__(self, agent, lead: float = PREFETCH_LEAD, retry: float = RETRY_SEC):
+        self.agent = agent
+        self.lead = lead
+        self.retry = retry
+        self._lock = threading.Lock()
+        self._ready: Optional[PreparedTalk] = None
+        self._building: Optional[int] = None  # 生成中の版
+        self._failed: Optional[Tuple[int, float]] = None  # (失敗した版, 失敗した時刻)
+
+    @property
+    def enabled(self) -> bool:
+        return self.lead > 0
+
+    def start(self):
+        """まだ今の会話の版で先読みしていなければ始める（多重には走らせない）"""
+        if not self.enabled:
+            return
+        version = self.agent.conv_version
+        with self._lock:
+            if self._ready is not None and self._ready.version == version:
+                return
+            if self._building is not None:
+                return
+            if self._failed is not None and self._failed[0] == version \
+                    and time.monotonic() - self._failed[1] < self.retry:
+                return
+            self._building = version
+        threading.Thread(target=self._build, args=(version,), name="AutoTalkPrefetch", daemon=True).start()
+
+    def _build(self, version: int):
+        try:
+            talk = self.agent.prepare_auto_talk(version)
+        except Exception as e:
+            print(f"🛑 自動発話の先読みに失敗: {e}")
+            talk = None
+        with self._lock:
+            self._building = None
+            self._failed = (version, time.monotonic()) if talk is None else None
+            if talk is not None and talk.version == self.agent.conv_version:
+                self._ready = talk
+
+    def take(self) -> Optional[PreparedTalk]:
+        """今の会話の版で使える先読みを取り出す（無ければ None）"""
+        with self._lock:
+            talk, self._ready = self._ready, None
+        if talk is not None and talk.version == self.agent.conv_version:
+            return talk
+        return None
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# context_window.py — トークン予算に収めた会話ウィンドウ＋あふれた古い発言のローリング要約
+#   トークン数はメッセージ本文ごとにキャッシュ（tiktoken があれば正確に、無ければ概算）。
+#   予算からあふれた発言は要約待ちに回し、別スレッドで要約に畳み込む（応答生成は待たせない）。
+
+import os, json, threading
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+PROMPT_BUDGET   = int(os.environ.get("SORA_PROMPT_BUDGET", "3000"))    # 送信する会話の上限（トークン）
+SUMMARY_TOKENS  = int(os.environ.get("SORA_SUMMARY_TOKENS", "300"))    # 要約の長さの目安
+SUMMARY_MODEL   = os.environ.get("SORA_SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MIN_PENDING = int(os.environ.get("SORA_SUMMARY_MIN_PENDING", "4"))  # この件数たまったら要約を更新
+MESSAGE_OVERHEAD = 4  # 1メッセージあたりの役割・区切りぶん
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    # 初回だけ tiktoken を読む（未インストール/取得失敗なら False を覚えて概算に切り替える）
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4o 系
+            except Exception:
+                _encoding = False
+        return _encoding
+
+@lru_cache(maxsize=4096)
+def count_text_tokens(text: str) -> int:
+    enc = _get_encoding()
+    if enc:
+        return len(enc.encode(text))
+    # 概算：日本語など非ASCIIは1文字≒1トークン、ASCIIは4文字≒1トークン
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+def count_message_tokens(message: dict) -> int:
+    return count_text_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
+
+def openai_summarizer(client, model: str = SUMMARY_MODEL, max_tokens: int = SUMMARY_TOKENS) -> Callable:
+    """
+    ChatGPT で要約する関数を返す。summarize(前回の要約, 畳み込む発言) -> 新しい要約
+    """
+    def summarize(summary: str, messages: List[dict]) -> str:
+        lines = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in messages)
+        prompt = (
+            "以下はメイドAI「ソラ」とご主人様の会話の古い部分です。これまでの要約に新しい発言の内容を畳み込み、"
+            "ご主人様について分かったこと・約束・話題の流れを日本語で簡潔にまとめ直してください。\n\n"
+            f"【これまでの要約】\n{summary or '（なし）'}\n\n【新しい発言】\n{lines}"
+        )
+        resp = client.chat.completions.create(
+            model=model, messages=[{"role": "user", "content": prompt}],
+            temperature=0.2, max_tokens=max_tokens,
+        )
+        return resp.choices[0].message.content.strip()
+    return summarize
+
+class ContextWindow:
+    """
+    fit(messages) でシステムプロンプト（先頭）＋要約＋新しい順に予算内の発言だけを残し、あふれた発言を返す。
+    fold(あふれた発言) で要約待ちに積み、別スレッドで summarize に渡して要約を更新する。
+    prompt(messages, extra) は送信用に要約（と extra）を差し込み、それも含めて予算に収めたリストを返す。
+    要約と要約待ちは summary_path に保存し、次回起動時に引き継ぐ。
+    """
+    def __init__(self, budget: int = PROMPT_BUDGET, summarize: Optional[Callable] = None,
+                 summary_path: Optional[str] = None, min_pending: int = SUMMARY_MIN_PENDING):
+        self.budget = budget
+        self.summarize = summarize
+        self.summary_path = summary_path
+        self.min_pending = min_pending
+        self.summary = ""
+        self._pending: List[dict] = []
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # fold（呼び出し側）と要約スレッドの保存が重ならないように
+        self._refreshing = False
+        self._load()
+        if self._pending:
+            self._maybe_refresh(force=True)
+
+    # --- 永続化 ---
+    def _load(self):
+        if not self.summary_path or not os.path.exists(self.summary_path):
+            return
+        try:
+            with open(self.summary_path, encoding="utf-8") as f:
+                d = json.load(f)
+            self.summary = d.get("summary", "")
+            self._pending = list(d.get("pending", []))
+        except Exception as e:
+            print(f"🛑 要約読み込みエラー: {e}")
+
+    def _save(self):
+        if not self.summary_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                d = {"summary": self.summary, "pending": list(self._pending)}
+            os.makedirs(os.path.dirname(self.summary_path) or ".", exist_ok=True)
+            tmp = self.summary_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(d, f, ensure_ascii=False)
+            os.replace(tmp, self.summary_path)
+
+    # --- ウィンドウ ---
+    def summary_message(self) -> Optional[dict]:
+        summary = self.summary
+        if not summary:
+            return None
+        return {"role": "system", "content": f"これまでの会話の要約：\n{summary}"}
+
+    def prompt(self, messages: List[dict], extra: Optional[List[dict]] = None) -> List[dict]:
+        """
+        送信用：システムプロンプトの直後に要約（と extra のシステムメッセージ）を差し込む。
+        extra のぶん予算を超える場合は古い発言を今回だけ送らない（窓からは外さず、要約にも回さない）。
+        """
+        inserts = [m for m in [self.summary_message()] + list(extra or []) if m]
+        if not inserts or not messages:
+            return list(messages)
+        head, body = messages[0], messages[1:]
+        left = self.budget - sum(count_message_tokens(m) for m in [head] + inserts)
+        keep = self._count_recent(body, left, len(body))
+        return [head] + inserts + body[len(body) - keep:]
+
+    def fit(self, messages: List[dict], max_messages: Optional[int] = None) -> Tuple[List[dict], List[dict]]:
+        """
+        返り値: (残す発言, あふれた発言)。先頭のシステムプロンプトと最新の1件は必ず残す。
+        """
+        if len(messages) <= 1:
+            return list(messages), []
+        head, body = messages[0], messages[1:]
+        summary = self.summary_message()
+        left = self.budget - count_message_tokens(head) - (count_message_tokens(summary) if summary else 0)
+        limit = len(body) if max_messages is None else max(1, max_messages - 1)
+        cut = len(body) - self._count_recent(body, left, limit)
+        return [head] + body[cut:], body[:cut]
+
+    @staticmethod
+    def _count_recent(body: List[dict], left: int, limit: int) -> int:
+        """新しい方から予算 left・件数 limit に収まる件数（最新の1件は必ず数える）"""
+        keep = 0
+        for m in reversed(body):
+            cost = count_message_tokens(m)
+            if keep >= limit or (keep > 0 and cost > left):
+                break
+            left -= cost
+            keep += 1
+        return keep
+
+    # --- 要約 ---
+    def fold(self, evicted: List[dict]):
+        if not evicted:
+            return
+        with self._lock:
+            self._pending.extend(evicted)
+        self._save()
+        self._maybe_refresh()
+
+    def _maybe_refresh(self, force: bool = False):
+        with self._lock:
+            if self.summarize is None or self._refreshing or not self._pending:
+                return
+            if not force and len(self._pending) < self.min_pending:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name="ContextSummary", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            while True:
+                with self._lock:
+                    batch = list(self._pending)
+                    summary = self.summary
+                if not batch:
+                    return
+                try:
+                    new_summary = self.summarize(summary, batch)
+                except Exception as e:
+                    print(f"🛑 要約エラー: {e}")
+                    return  # 要約待ちは残しておき、次にあふれたときに再試行する
+                with self._lock:
+                    self.summary = new_summary
+                    del self._pending[:len(batch)]
+                    more = len(self._pending) >= self.min_pending
+                self._save()
+                if not more:
+                    return
+        finally:
+            with self._lock:
+                self._refreshing = False
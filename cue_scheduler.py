@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# cue_scheduler.py — 再生開始を原点にした単一時計のイベントスケジューラ（ヒープ）
+#   口パクフレーム・モーションHotkey・表情/字幕などを同じ時計で発火し、遅延を記録する。
+
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from typing import Callable, Optional
+
+import sora_trace as trace
+
+LATE_TOLERANCE = 0.02  # これ以上遅れた発火を「取りこぼし」として数える（秒）
+
+class CueScheduler:
+    """
+    schedule(t, fn, *args, key=...) で「再生開始から t 秒後」のイベントを登録する。
+    anchor() で原点（実際の再生開始時刻）を決め、run()（スレッド）か arun()（asyncio）で発火する。
+    遅れて同時に期限が来たイベントのうち同じ key のものは最後の1件だけ発火する（古い口パクフレームを捨てる）。
+    key=None のイベントは間引かない。
+    """
+    def __init__(self, clock: Callable[[], float] = time.perf_counter, late_tolerance: float = LATE_TOLERANCE):
+        self.clock = clock
+        self.late_tolerance = late_tolerance
+        self.origin: Optional[float] = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._async_wake = None  # arun 中の (ループ, asyncio.Event)。別スレッドからの変更で起こす
+        self.stats = {"fired": 0, "missed": 0, "coalesced": 0, "max_late_ms": 0.0}
+
+    def _notify(self):
+        # self._cond を持って呼ぶ。run（スレッド）と arun（asyncio）の両方の待ちを起こす
+        self._cond.notify()
+        if self._async_wake is not None:
+            loop, event = self._async_wake
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # ループが閉じている
+
+    def schedule(self, t: float, fn: Callable, *args, key: Optional[str] = None):
+        with self._cond:
+            heapq.heappush(self._heap, (float(t), next(self._seq), key, fn, args))
+            self._notify()
+
+    def replace(self, key: str, events):
+        """
+        key のまだ発火していないイベントを events [(t, fn, args)] に差し替える（見積もり→解析結果の差し替え用）。
+        発火済みの時刻より前のものは積まない。
+        """
+        with self._cond:
+            now = None if self.origin is None else self.clock() - self.origin
+            self._heap = [ev for ev in self._heap if ev[2] != key]
+            for t, fn, args in events:
+                if now is None or t >= now:
+                    self._heap.append((float(t), next(self._seq), key, fn, tuple(args)))
+            heapq.heapify(self._heap)
+            self._notify()
+
+    def anchor(self, origin: Optional[float] = None):
+        """原点を決める（既定は今）。再生を開始した直後に呼ぶ"""
+        with self._cond:
+            self.origin = self.clock() if origin is None else origin
+            self._notify()
+
+    def now(self) -> float:
+        """原点からの経過秒（原点未設定なら 0）"""
+        return 0.0 if self.origin is None else self.clock() - self.origin
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._notify()
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def _take_due(self):
+        """
+        期限の来たイベントを取り出す。返り値: (発火するイベント, 次の期限までの秒 or None)
+        """
+        with self._cond:
+            if self.origin is None:
+                return [], None
+            now = self.clock() - self.origin
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+            wait = (self._heap[0][0] - now) if self._heap else None
+        if len(due) > 1:
+            last = {}
+            for i, ev in enumerate(due):
+                if ev[2] is not None:
+                    last[ev[2]] = i
+            kept = [ev for i, ev in enumerate(due) if ev[2] is None or last[ev[2]] == i]
+            self.stats["coalesced"] += len(due) - len(kept)
+            trace.count("cue_coalesced", len(due) - len(kept))
+            due = kept
+        for t, _, key, _, _ in due:
+            late = now - t
+            if late > self.late_tolerance:
+                self.stats["missed"] += 1
+                trace.count("cue_missed", key=key or "cue")
+            self.stats["max_late_ms"] = max(self.stats["max_late_ms"], late * 1000.0)
+            trace.observe("cue_late", late, key=key or "cue")
+        return due, wait
+
+    def _fire(self, due):
+        for _, _, _, fn, args in due:
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"🛑 キュー実行エラー: {e}")
+            self.stats["fired"] += 1
+
+    def run(self, until_empty: bool = True):
+        """スレッドで回す。stop() か（until_empty なら）キューが空になるまで"""
+        while True:
+            due, wait = self._take_due()
+            self._fire(due)
+            with self._cond:
+                if self._stopped or (until_empty and not self._heap and self.origin is not None):
+                    return
+                if not due:
+                    self._cond.wait(timeout=wait)
+
+    async def arun(self, until_empty: bool = True):
+        """
+        asyncio で回す（発火はループ上で行う）。次の期限まで待つ間も schedule/replace/anchor/stop で起きる
+        """
+        wake = asyncio.Event()
+        with self._cond:
+            self._async_wake = (asyncio.get_running_loop(), wake)
+        try:
+            while True:
+                wake.clear()  # 取り出しより前に下ろす（取り出し後の変更を取りこぼさない）
+                due, wait = self._take_due()
+                self._fire(due)
+                if self._stopped or (until_empty and not self._heap and self.origin is not None):
+                    return
+                if not due:
+                    try:
+                        await asyncio.wait_for(wake.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self._cond:
+                self._async_wake = None
+
+    def report(self, label: str = "cue"):
+        s = self.stats
+        if s["missed"] or s["coalesced"]:
+            print(f"ℹ️ [{label}] 遅延 {s['missed']}件 / 間引き {s['coalesced']}件 / 最大遅れ {s['max_late_ms']:.1f}ms")
@@ -1,18 +1,190 @@
-﻿from transformers import pipeline
+﻿import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import sora_trace as trace
+
+CACHE_SIZE = int(os.environ.get("SORA_EMOTION_CACHE", "1024"))  # 分類結果LRUの件数
+MAX_BATCH  = int(os.environ.get("SORA_EMOTION_BATCH", "16"))     # 1回の推論にまとめる最大件数
+MAX_WAIT   = float(os.environ.get("SORA_EMOTION_WAIT_MS", "10")) / 1000.0  # バッチを待つ時間
 
 # 感情分類モデル（Hugging Faceの日本語モデル）
-classifier = pipeline(
-    "text-classification",
-    model="jarvisx17/japanese-sentiment-analysis",
-    framework="pt"
-)
+MODEL_NAME = "jarvisx17/japanese-sentiment-analysis"
+# pt: 通常 / int8: 動的量子化（CPU向け） / onnx: ONNX Runtime（optimum が必要）
+BACKEND = os.environ.get("SORA_EMOTION_BACKEND", "pt").lower()
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+def _build_pt():
+    from transformers import pipeline
+    return pipeline("text-classification", model=MODEL_NAME, framework="pt")
+
+def _build_int8():
+    import torch
+    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME).eval()
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("text-classification", model=model, tokenizer=tokenizer, framework="pt")
+
+def _build_onnx():
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import pipeline, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True)
+    return pipeline("text-classification", model=model, tokenizer=tokenizer)
+
+def get_classifier():
+    """
+    初回呼び出し時にモデルを構築する（torch の読み込みもここまで遅延）。
+    量子化/ONNX の構築に失敗した場合は通常版に戻す。ラベルは同じ id2label を使う。
+    """
+    global _classifier
+    if _classifier is not None:
+        return _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            builder = {"int8": _build_int8, "onnx": _build_onnx}.get(BACKEND, _build_pt)
+            try:
+                _classifier = builder()
+            except Exception as e:
+                if builder is _build_pt:
+                    raise
+                print(f"🛑 感情モデル（{BACKEND}）の構築に失敗、通常版を使います: {e}")
+                _classifier = _build_pt()
+        return _classifier
+
+def warmup(background=True):
+    """
+    モデル構築＋ダミー推論を先に済ませる。background=True なら別スレッドで行う
+    """
+    def _w():
+        try:
+            get_classifier()("こんにちは")
+        except Exception as e:
+            print(f"🛑 感情モデルのウォームアップ失敗: {e}")
+    if not background:
+        _w()
+        return None
+    th = threading.Thread(target=_w, name="EmotionWarmup", daemon=True)
+    th.start()
+    return th
+
+def __getattr__(name):
+    # 旧来の emotion_model.classifier 参照にも遅延構築で応える
+    if name == "classifier":
+        return get_classifier()
+    raise AttributeError(name)
 
 def classify_emotion(text):
     """
     テキストを分類し、positive / neutral / negative を返す
     """
-    result = classifier(text)
+    result = get_classifier()(text)
     if result and isinstance(result, list):
         label = result[0]['label'].lower()
         return label
     return "neutral"
+
+def classify_emotions(texts):
+    """
+    複数テキストを1回の推論でまとめて分類する
+    """
+    if not texts:
+        return []
+    with trace.span("classify", batch=len(texts)):
+        results = get_classifier()(list(texts), batch_size=min(len(texts), MAX_BATCH))
+    labels = []
+    for r in results:
+        if isinstance(r, list):  # top_k 指定時などは入れ子で返る
+            r = r[0] if r else {}
+        labels.append(str(r.get("label", "neutral")).lower() if isinstance(r, dict) else "neutral")
+    return labels
+
+class EmotionService:
+    """
+    分類結果のLRUキャッシュ＋マイクロバッチ（スレッド安全）。
+    同時に来た classify() は MAX_WAIT だけ待って1回の推論にまとめる。
+    """
+    def __init__(self, cache_size=CACHE_SIZE, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._q = queue.Queue()
+        self._worker = None
+
+    def _cached(self, text):
+        with self._lock:
+            label = self._cache.get(text)
+            if label is not None:
+                self._cache.move_to_end(text)
+            return label
+
+    def _remember(self, text, label):
+        with self._lock:
+            self._cache[text] = label
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def classify(self, text):
+        label = self._cached(text)
+        if label is not None:
+            return label
+        self._ensure_worker()
+        fut = Future()
+        self._q.put((text, fut))
+        return fut.result()
+
+    def classify_many(self, texts):
+        """
+        キャッシュに無いものだけ1回の推論で分類し、入力順で返す
+        """
+        labels = [self._cached(t) for t in texts]
+        todo = list(dict.fromkeys(t for t, l in zip(texts, labels) if l is None))
+        for i in range(0, len(todo), self.max_batch):
+            chunk = todo[i:i + self.max_batch]
+            for t, l in zip(chunk, classify_emotions(chunk)):
+                self._remember(t, l)
+        return [l if l is not None else self._cached(t) or "neutral" for t, l in zip(texts, labels)]
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="EmotionBatcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._q.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self._q.get(timeout=self.max_wait))
+            except queue.Empty:
+                pass
+            texts = list(dict.fromkeys(t for t, _ in batch))
+            try:
+                labels = dict(zip(texts, classify_emotions(texts)))
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for t, l in labels.items():
+                self._remember(t, l)
+            for t, fut in batch:
+                fut.set_result(labels.get(t, "neutral"))
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_emotion_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmotionService()
+        return _service
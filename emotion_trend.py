@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# emotion_trend.py — 感情ログの直近傾向インデックス（リングバッファ＋累計）/ 末尾シーク復元
+
+import os, io, re, csv, json, threading
+from collections import deque
+from typing import Optional
+
+EMOTION_SCORE = {"positive": 1, "neutral": 0, "negative": -1}
+WINDOW = 20          # 直近平均の件数
+TAIL_BLOCK = 8192    # 末尾読み込みの単位（バイト）
+# save_log（QUOTE_ALL）の行頭。フィールド内の " は "" になるので、複数行テキストの途中の行はこれに一致しない
+_RECORD_START = re.compile(rb'\n"\d{4}-\d{2}-\d{2}","\d{2}:\d{2}:\d{2}",')
+
+def _index_path(log_path: str) -> str:
+    return os.path.splitext(log_path)[0] + ".trend.json"
+
+def _log_size(log_path: str) -> int:
+    try:
+        return os.path.getsize(log_path)
+    except OSError:
+        return 0
+
+def _parse_emotions(chunk: bytes, partial: bool):
+    if partial:
+        # 途中から読んだときは次の本物の行頭まで捨てる（複数行テキストの途中の改行では切らない）
+        m = _RECORD_START.search(chunk)
+        chunk = chunk[m.start() + 1:] if m else b""
+    text = chunk.decode("utf-8", errors="replace").lstrip("﻿")
+    return [row[3].strip() for row in csv.reader(io.StringIO(text))
+            if len(row) == 4 and row[3].strip() in EMOTION_SCORE]
+
+def read_tail_emotions(log_path: str, n: int = WINDOW):
+    """
+    CSVの末尾だけを読み、最後の n 行の感情ラベルを古い順で返す（QUOTE_ALL行も正しく解釈）
+    """
+    size = _log_size(log_path)
+    if size == 0:
+        return []
+    with open(log_path, "rb") as f:
+        pos = size
+        chunk = b""
+        need = n
+        while True:
+            while pos > 0 and chunk.count(b"\n") <= need:
+                step = min(TAIL_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step) + chunk
+            emotions = _parse_emotions(chunk, partial=pos > 0)
+            if len(emotions) >= n or pos == 0:
+                return emotions[-n:]
+            # 複数行のテキストがあると改行数より行が少ない。足りない分だけさらに遡る
+            need = chunk.count(b"\n") + n - len(emotions)
+
+class EmotionTrendIndex:
+    """
+    <ログ名>.trend.json に直近スコアと累計（件数・合計・ラベル別件数）を保持する。
+    save_log の追記ごとに add() で更新し、平均は O(1) で返す。
+    インデックスが無い・ログと食い違う場合はログ末尾だけを読んで作り直す。
+    """
+    def __init__(self, log_path: str, window: int = WINDOW):
+        self.log_path = log_path
+        self.path = _index_path(log_path)
+        self.window = window
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0
+        self.counts = {k: 0 for k in EMOTION_SCORE}
+        self.log_size = 0  # 反映済みのログのバイト数
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                d = json.load(f)
+            if d.get("log_size") == _log_size(self.log_path):
+                self.log_size = d["log_size"]
+                self.recent.extend(d.get("recent", [])[-self.window:])
+                self.count = int(d.get("count", 0))
+                self.total = int(d.get("sum", 0))
+                self.counts.update(d.get("counts", {}))
+                return
+        except (OSError, ValueError):
+            pass
+        self._rebuild_from_tail()
+
+    def _rebuild_from_tail(self):
+        # 累計は全走査しないと分からないので、末尾から読めた分だけで始め直す
+        self.recent.clear()
+        self.count = self.total = 0
+        self.counts = {k: 0 for k in EMOTION_SCORE}
+        self.log_size = _log_size(self.log_path)
+        for emotion in read_tail_emotions(self.log_path, self.window):
+            self._push(emotion)
+        if self.log_size:
+            self._save()
+
+    def _push(self, emotion: str):
+        score = EMOTION_SCORE.get(emotion, 0)
+        self.recent.append(score)
+        self.count += 1
+        self.total += score
+        if emotion in self.counts:
+            self.counts[emotion] += 1
+
+    def _save(self):
+        d = {
+            "log_size": self.log_size,
+            "recent": list(self.recent),
+            "count": self.count, "sum": self.total, "counts": self.counts,
+        }
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(d, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"🛑 感情トレンド保存エラー: {e}")
+
+    def add(self, emotion: str):
+        """ログに1行追記した直後に呼ぶ（作り直しで既に読んだ行なら数えない）"""
+        with self._lock:
+            size = _log_size(self.log_path)
+            if size == self.log_size:
+                return
+            self.log_size = size
+            self._push(emotion)
+            self._save()
+
+    def recent_average(self) -> Optional[float]:
+        with self._lock:
+            if not self.recent:
+                return None
+            return sum(self.recent) / len(self.recent)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_trend_index(log_path: str) -> EmotionTrendIndex:
+    with _indexes_lock:
+        idx = _indexes.get(log_path)
+        if idx is None:
+            idx = _indexes[log_path] = EmotionTrendIndex(log_path)
+        return idx
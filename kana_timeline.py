@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# kana_timeline.py — テキストだけから母音タイムラインを見積もる（audio_query を待たない／VOICEVOX が遅い・落ちているとき用）
+#   かな→母音は表引き、漢字は読み辞書（pykakasi があれば使い、無ければ同梱の小辞書＋ユーザー辞書）で読みに直す。
+#   返り値は build_vowel_timeline と同じ [(start_sec, end_sec, tag)]。
+
+import os, json, re, threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+READING_DICT_PATH = os.environ.get("SORA_READING_DICT", "reading_dict.json")  # {"表記": "よみ"} を追加できる
+CONSONANT_SEC = 0.05  # 子音（口を閉じ気味にする区間）
+VOWEL_SEC     = 0.08  # 母音
+SOKUON_SEC    = 0.10  # っ
+HATSUON_SEC   = 0.09  # ん
+PAUSE_SEC     = 0.30  # 句読点の間
+PAUSE_CHARS = set("、，,。.！!？?…‥\n")
+UNKNOWN_KANJI = ("a", "i")  # 読めない漢字は2モーラとして見積もる
+
+# ===== かな→母音表（ひらがなで持ち、カタカナは変換して引く） =====
+_ROWS = {
+    "a": "あかさたなはまやらわがざだばぱ",
+    "i": "いきしちにひみりぎじぢびぴゐ",
+    "u": "うくすつぬふむゆるぐずづぶぷゔ",
+    "e": "えけせてねへめれげぜでべぺゑ",
+    "o": "おこそとのほもよろをごぞどぼぽ",
+}
+KANA_VOWEL: Dict[str, str] = {k: v for v, row in _ROWS.items() for k in row}
+SMALL_VOWEL = {"ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o", "ゃ": "a", "ゅ": "u", "ょ": "o", "ゎ": "a"}
+NO_CONSONANT = set("あいうえお")
+LATIN_VOWEL = {"a": "a", "i": "i", "u": "u", "e": "e", "o": "o", "y": "i"}
+VOWELS = ("a", "i", "u", "e", "o")
+
+# 同梱の小辞書（会話でよく出る語）。読み辞書ファイルで追加・上書きできる
+BUILTIN_READINGS = {
+    "ご主人様": "ごしゅじんさま", "主人": "しゅじん", "様": "さま", "私": "わたし", "僕": "ぼく",
+    "今日": "きょう", "明日": "あした", "昨日": "きのう", "今": "いま", "毎日": "まいにち",
+    "天気": "てんき", "時間": "じかん", "何": "なに", "本当": "ほんとう", "大丈夫": "だいじょうぶ",
+    "元気": "げんき", "一緒": "いっしょ", "少し": "すこし", "好き": "すき", "嬉しい": "うれしい",
+    "楽しい": "たのしい", "悲しい": "かなしい", "お疲れ": "おつかれ", "疲れ": "つかれ", "休憩": "きゅうけい",
+    "仕事": "しごと", "勉強": "べんきょう", "気": "き", "良い": "よい", "お茶": "おちゃ",
+    "準備": "じゅんび", "音楽": "おんがく", "映画": "えいが", "食事": "しょくじ", "料理": "りょうり",
+    "朝": "あさ", "夜": "よる", "一": "いち", "二": "に", "三": "さん", "目": "め", "人": "ひと",
+    "話": "はなし", "思": "おも", "言": "い", "見": "み", "行": "い", "来": "き", "待": "ま",
+    "教": "おし", "手伝": "てつだ", "分": "わ", "聞": "き", "感": "かん", "心": "こころ",
+}
+
+_KANJI = re.compile(r"[㐀-䶿一-鿿々〆]")
+_kakasi = None
+_readings: Optional[Dict[str, str]] = None
+_dict_lock = threading.Lock()
+
+def _get_kakasi():
+    # 初回だけ pykakasi を読む（未インストールなら False を覚えて辞書だけで読む）
+    global _kakasi
+    with _dict_lock:
+        if _kakasi is None:
+            try:
+                import pykakasi
+                _kakasi = pykakasi.kakasi()
+            except Exception:
+                _kakasi = False
+        return _kakasi
+
+def _get_readings() -> Tuple[Dict[str, str], int]:
+    """返り値: (読み辞書, 最長の見出し文字数)"""
+    global _readings
+    with _dict_lock:
+        if _readings is None:
+            _readings = dict(BUILTIN_READINGS)
+            if os.path.exists(READING_DICT_PATH):
+                try:
+                    with open(READING_DICT_PATH, encoding="utf-8") as f:
+                        _readings.update(json.load(f))
+                except Exception as e:
+                    print(f"🛑 読み辞書読み込みエラー: {e}")
+        return _readings, max(map(len, _readings), default=1)
+
+def _katakana_to_hiragana(text: str) -> str:
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+
+def to_reading(text: str) -> str:
+    """漢字をかなに開いた文字列を返す（読めない漢字はそのまま残す）"""
+    kks = _get_kakasi()
+    if kks and _KANJI.search(text):
+        try:
+            return "".join(item["hira"] for item in kks.convert(text))
+        except Exception:
+            pass
+    readings, longest = _get_readings()
+    out, i = [], 0
+    while i < len(text):
+        if _KANJI.match(text[i]):
+            for n in range(min(longest, len(text) - i), 0, -1):
+                reading = readings.get(text[i:i + n])
+                if reading:
+                    out.append(reading)
+                    i += n
+                    break
+            else:
+                out.append(text[i])
+                i += 1
+        else:
+            out.append(text[i])
+            i += 1
+    return "".join(out)
+
+def text_to_morae(text: str) -> List[Tuple[bool, str]]:
+    """
+    テキスト→モーラ列。返り値: [(子音あり, tag)]  tag: 'a'|'i'|'u'|'e'|'o'|'cl'|'N'|'pau'
+    拗音（きゃ）や小さい母音（ファ）は前のモーラの母音を置き換え、ー は直前の母音を伸ばす。
+    """
+    morae: List[Tuple[bool, str]] = []
+    for c in _katakana_to_hiragana(to_reading(text)):
+        low = c.lower()
+        if c in KANA_VOWEL:
+            morae.append((c not in NO_CONSONANT, KANA_VOWEL[c]))
+        elif c in SMALL_VOWEL:
+            if morae and morae[-1][1] in VOWELS:
+                morae[-1] = (morae[-1][0], SMALL_VOWEL[c])
+            else:
+                morae.append((False, SMALL_VOWEL[c]))
+        elif c == "ー":
+            if morae and morae[-1][1] in VOWELS:
+                morae.append((False, morae[-1][1]))
+        elif c == "っ":
+            morae.append((False, "cl"))
+        elif c == "ん":
+            morae.append((False, "N"))
+        elif c in PAUSE_CHARS:
+            if morae and morae[-1][1] != "pau":
+                morae.append((False, "pau"))
+        elif _KANJI.match(c):
+            morae += [(True, v) for v in UNKNOWN_KANJI]
+        elif low in LATIN_VOWEL:
+            morae.append((False, LATIN_VOWEL[low]))
+        elif c.isdigit():
+            morae += [(True, "i"), (False, "u")]
+    while morae and morae[-1][1] == "pau":  # 文末の句読点は無音を足さない
+        morae.pop()
+    return morae
+
+def estimate_vowel_timeline(text: str, total_duration: Optional[float] = None):
+    """
+    返り値: [(start_sec, end_sec, tag)]（build_vowel_timeline と同じ形）。
+    total_duration（実際の音声長など）を渡すと全体をその長さに伸縮する。
+    """
+    morae = text_to_morae(text)
+    if not morae:
+        return []
+    # 子音区間（cl）と本体をまとめて1本の配列にし、累積和で時刻を出す
+    tags, durs = [], []
+    for has_consonant, tag in morae:
+        if tag == "pau":
+            tags.append("pau"); durs.append(PAUSE_SEC)
+        elif tag == "cl":
+            tags.append("cl"); durs.append(SOKUON_SEC)
+        elif tag == "N":
+            tags.append("cl"); durs.append(HATSUON_SEC)  # build_vowel_timeline と同じく閉口扱い
+        else:
+            if has_consonant:
+                tags.append("cl"); durs.append(CONSONANT_SEC)
+            tags.append(tag); durs.append(VOWEL_SEC)
+    d = np.asarray(durs, dtype=np.float64)
+    if total_duration and total_duration > 0:
+        d *= total_duration / d.sum()
+    ends = np.cumsum(d)
+    starts = np.concatenate(([0.0], ends[:-1]))
+    return list(zip(starts.tolist(), ends.tolist(), tags))
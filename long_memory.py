@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# long_memory.py — 過去のやり取りのベクトル索引（長期記憶）
+#   1往復（ご主人様の発言＋ソラの返答）を1行として埋め込み、float32 行列ファイル（mmapで読む）に追記する。
+#   毎ターン、直近の発言に近い過去の往復を総当たり top-k で引き、プロンプトに少しだけ添える。
+
+import os, json, zlib, queue, threading
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+MEMORY_DIR  = os.environ.get("SORA_MEMORY_DIR", "log/memory")
+EMBEDDER    = os.environ.get("SORA_MEMORY_EMBEDDER", "e5").lower()  # e5: 多言語E5（CPU） / hash: 文字n-gramハッシュ
+TOP_K       = int(os.environ.get("SORA_MEMORY_TOP_K", "3"))
+MIN_SCORE   = os.environ.get("SORA_MEMORY_MIN_SCORE")  # 未指定なら埋め込みごとの既定値
+E5_MODEL    = "intfloat/multilingual-e5-small"
+HASH_DIM    = 512
+ITEM_CHARS  = 120  # プロンプトに添える1発言の最大文字数
+
+# ===== 埋め込み =====
+def _is_content_char(c: str) -> bool:
+    # ひらがな・記号・空白は1文字では意味を持たないので 1-gram から外す
+    return not ("\u3040" <= c <= "\u309f" or c.isspace() or not c.isalnum())
+
+class HashEmbedder:
+    """
+    文字2-gram（＋かな・記号以外の1-gram）を crc32 で HASH_DIM 次元に畳み込む軽量な埋め込み
+    （モデル不要・プロセス間で安定）。頻度は log(1+tf) で抑える。
+    """
+    name = f"hash{HASH_DIM}-v2"
+    dim = HASH_DIM
+    min_score = 0.22
+
+    def embed(self, texts: List[str], kind: str = "passage") -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            grams = [c for c in text if _is_content_char(c)] + [text[j:j + 2] for j in range(len(text) - 1)]
+            if not grams:
+                continue
+            idx = [zlib.crc32(g.encode("utf-8")) % self.dim for g in grams]
+            np.add.at(out[i], idx, 1.0)
+        np.log1p(out, out=out)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-8)
+
+class E5Embedder:
+    """multilingual-e5-small（平均プーリング＋正規化）。E5 は類似度が高めに出るので閾値も高め"""
+    name = "e5-small"
+    dim = 384
+    min_score = 0.82
+
+    def __init__(self):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(E5_MODEL)
+        self.model = AutoModel.from_pretrained(E5_MODEL).eval()
+
+    def embed(self, texts: List[str], kind: str = "passage") -> np.ndarray:
+        batch = self.tokenizer([f"{kind}: {t}" for t in texts], padding=True, truncation=True,
+                               max_length=256, return_tensors="pt")
+        with self._torch.no_grad():
+            hidden = self.model(**batch).last_hidden_state
+        mask = batch["attention_mask"].unsqueeze(-1).type_as(hidden)
+        vec = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+        vec = self._torch.nn.functional.normalize(vec, dim=-1)
+        return vec.numpy().astype(np.float32)
+
+def build_embedder(kind: str = EMBEDDER):
+    if kind == "hash":
+        return HashEmbedder()
+    try:
+        return E5Embedder()
+    except Exception as e:
+        print(f"🛑 埋め込みモデル（{kind}）の読み込みに失敗、文字ハッシュで代用します: {e}")
+        return HashEmbedder()
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+def get_embedder(kind: str = EMBEDDER):
+    """種類ごとのプロセス共有の埋め込み（複数セッションでモデルを1つだけ読む）"""
+    with _embedders_lock:
+        emb = _embedders.get(kind)
+        if emb is None:
+            emb = _embedders[kind] = build_embedder(kind)
+        return emb
+
+# ===== 索引 =====
+class LongTermMemory:
+    """
+    memory_vectors.f32（行＝往復、float32×dim）と memory_items.jsonl（同じ順の本文）を追記していく。
+    検索は行列を np.memmap で開いて内積の総当たり（数万件でも数ms）。
+    埋め込みモデルの読み込みと追記は専用スレッドで行い、モデルが未準備の間の search() は空を返す。
+    埋め込みの種類が変わった場合は作り直し（backfill でジャーナルから入れ直す）。
+    """
+    def __init__(self, root: str = MEMORY_DIR, embedder_kind: str = EMBEDDER):
+        self.root = root
+        self.vec_path = os.path.join(root, "memory_vectors.f32")
+        self.items_path = os.path.join(root, "memory_items.jsonl")
+        self.meta_path = os.path.join(root, "memory_meta.json")
+        self.embedder_kind = embedder_kind
+        self.embedder = None
+        self.items: List[dict] = []
+        self._mm = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._q = queue.Queue()
+        os.makedirs(root, exist_ok=True)
+        self._worker = threading.Thread(target=self._run, name="LongTermMemory", daemon=True)
+        self._worker.start()
+
+    @property
+    def count(self) -> int:
+        return len(self.items)
+
+    # --- 専用スレッド ---
+    def _run(self):
+        try:
+            self.embedder = get_embedder(self.embedder_kind)
+            self._open()
+        finally:
+            self._ready.set()
+        while True:
+            op, arg = self._q.get()
+            if op == "stop":
+                return
+            if op == "flush":
+                arg.set()
+                continue
+            try:
+                batch = [arg]
+                while op == "add" and len(batch) < 32:
+                    try:
+                        nxt = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt[0] != "add":
+                        self._q.put(nxt)  # 順序は前後するが add 以外は flush/stop だけなので問題ない
+                        break
+                    batch.append(nxt[1])
+                self._append(batch)
+            except Exception as e:
+                print(f"🛑 長期記憶の追記エラー: {e}")
+
+    def _open(self):
+        meta = {}
+        if os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+            except ValueError:
+                meta = {}
+        if meta.get("embedder") != self.embedder.name:
+            # 初回 or 埋め込みが変わった：空から作り直す
+            for p in (self.vec_path, self.items_path):
+                if os.path.exists(p):
+                    os.remove(p)
+            self._write_meta()
+            return
+        items = []
+        if os.path.exists(self.items_path):
+            with open(self.items_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        break  # 書き込み途中で落ちた末尾行
+        rows = os.path.getsize(self.vec_path) // (4 * self.embedder.dim) if os.path.exists(self.vec_path) else 0
+        n = min(len(items), rows)
+        # 本文と行列の行数を揃える（片方だけ書けた末尾を捨てる）
+        with open(self.vec_path, "ab") as f:
+            f.truncate(n * 4 * self.embedder.dim)
+        with open(self.items_path, "w", encoding="utf-8") as f:
+            for it in items[:n]:
+                f.write(json.dumps(it, ensure_ascii=False) + "\n")
+        self.items = items[:n]
+
+    def _write_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder.name, "dim": self.embedder.dim}, f)
+        os.replace(tmp, self.meta_path)
+
+    def _append(self, batch: List[dict]):
+        vecs = self.embedder.embed([_item_text(it) for it in batch], kind="passage")
+        with self._lock:
+            with open(self.vec_path, "ab") as f:
+                f.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+            with open(self.items_path, "a", encoding="utf-8") as f:
+                for it in batch:
+                    f.write(json.dumps(it, ensure_ascii=False) + "\n")
+            self.items.extend(batch)
+            self._mm = None  # 次の検索で開き直す
+
+    # --- 呼び出し側 ---
+    def add(self, user: str, assistant: str):
+        """1往復を追記する（埋め込みは専用スレッドで行うので待たない）"""
+        if user or assistant:
+            self._q.put(("add", {"user": user, "assistant": assistant}))
+
+    def backfill(self, history: Iterable[dict]):
+        """空の索引をジャーナル全履歴から作る（起動時に別スレッドで呼ぶ想定）"""
+        self._ready.wait()
+        if self.count:
+            return
+        for user, assistant in pair_exchanges(history):
+            self.add(user, assistant)
+
+    def flush(self, timeout: Optional[float] = 30.0):
+        done = threading.Event()
+        self._q.put(("flush", done))
+        done.wait(timeout)
+
+    def close(self):
+        self._q.put(("stop", None))
+
+    def _matrix(self):
+        with self._lock:
+            n = len(self.items)
+            if n == 0:
+                return None, 0
+            if self._mm is None or self._mm.shape[0] != n:
+                self._mm = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, self.embedder.dim))
+            return self._mm, n
+
+    def search(self, query: str, k: int = TOP_K, exclude: Iterable[str] = (),
+               min_score: Optional[float] = None) -> List[dict]:
+        """
+        query に近い過去の往復を類似度順に最大 k 件。exclude に含まれる発言（今の窓にあるもの）は除く。
+        """
+        if not query or not self._ready.is_set() or self.embedder is None:
+            return []
+        mm, n = self._matrix()
+        if mm is None:
+            return []
+        if min_score is None:
+            min_score = float(MIN_SCORE) if MIN_SCORE else self.embedder.min_score
+        q = self.embedder.embed([query], kind="query")[0]
+        scores = mm @ q
+        exclude = set(exclude)
+        want = min(n, k + len(exclude))
+        top = np.argpartition(-scores, want - 1)[:want] if want < n else np.arange(n)
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for i in top:
+            if scores[i] < min_score or len(hits) >= k:
+                break
+            it = self.items[i]
+            if it.get("user") in exclude or it.get("assistant") in exclude:
+                continue
+            hits.append(dict(it, score=float(scores[i])))
+        return hits
+
+def _item_text(item: dict) -> str:
+    return f"{item.get('user', '')}\n{item.get('assistant', '')}"
+
+def pair_exchanges(messages: Iterable[dict]):
+    """メッセージ列から (ご主人様の発言, ソラの返答) の組を古い順に返す"""
+    user = None
+    for m in messages:
+        role = m.get("role")
+        if role == "user":
+            user = m.get("content") or ""
+        elif role == "assistant" and user is not None:
+            yield user, m.get("content") or ""
+            user = None
+
+def recall_message(hits: List[dict]) -> Optional[dict]:
+    """検索結果をプロンプトに添えるシステムメッセージにする"""
+    if not hits:
+        return None
+    lines = [
+        f"- ご主人様：{h['user'][:ITEM_CHARS]}\n  ソラ：{h['assistant'][:ITEM_CHARS]}"
+        for h in hits
+    ]
+    return {"role": "system", "content": "関連する過去の会話（必要なときだけ参考にしてください）：\n" + "\n".join(lines)}
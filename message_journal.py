@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# message_journal.py — 会話履歴の追記専用ジャーナル（JSONL）＋定期スナップショット / 途中書き込みの復旧
+
+import os, json, glob, queue, threading
+from typing import List, Optional
+
+JOURNAL_DIR   = os.environ.get("SORA_JOURNAL_DIR", "log")
+COMPACT_EVERY = int(os.environ.get("SORA_JOURNAL_COMPACT_EVERY", "50"))  # この件数ごとにスナップショット
+ROTATE_BYTES  = int(os.environ.get("SORA_JOURNAL_ROTATE_MB", "8")) * 1024 * 1024  # 世代を切り替えるサイズ
+
+class MessageJournal:
+    """
+    messages_journal.<世代>.jsonl に1メッセージ1行で追記する（行ごとに fsync）。
+    messages_snapshot.json には {世代, オフセット, その時点の会話ウィンドウ} を原子的に書き、
+    起動時はスナップショット＋それ以降のジャーナル行だけを読む。全履歴は各世代ファイルに残る。
+    書き込みは専用スレッドで行うので、append() は呼び出し側を待たせない。
+    """
+    def __init__(self, root: str = JOURNAL_DIR, legacy_path: Optional[str] = None):
+        self.root = root
+        self.snapshot_path = os.path.join(root, "messages_snapshot.json")
+        self.legacy_path = legacy_path
+        self.gen = 0
+        self._since_snapshot = 0
+        self._f = None
+        self._q = queue.Queue()
+        self._writer = None
+        os.makedirs(root, exist_ok=True)
+
+    def _journal_path(self, gen: int) -> str:
+        return os.path.join(self.root, f"messages_journal.{gen:06d}.jsonl")
+
+    # --- 読み込み・復旧 ---
+    def load(self) -> List[dict]:
+        snap = self._read_snapshot()
+        if snap is None:
+            snap = self._import_legacy()
+        self.gen = int(snap.get("gen", 0))
+        messages = list(snap.get("messages", []))
+        path = self._journal_path(self.gen)
+        tail, good_end = self._read_from(path, int(snap.get("offset", 0)))
+        messages += tail
+        self._since_snapshot = len(tail)
+        if os.path.exists(path) and good_end < os.path.getsize(path):
+            # 書き込み途中で落ちた末尾行を切り捨てる
+            print(f"🛑 ジャーナル末尾の壊れた行を切り捨てます: {path}")
+            with open(path, "r+b") as f:
+                f.truncate(good_end)
+        return messages
+
+    def _read_snapshot(self) -> Optional[dict]:
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f"🛑 スナップショット読み込みエラー: {e}")
+            return None
+
+    def _import_legacy(self) -> dict:
+        # 旧 messages_memory.json からの移行（ジャーナルが無い初回のみ）
+        existing = sorted(glob.glob(os.path.join(self.root, "messages_journal.*.jsonl")))
+        if existing:
+            # スナップショットだけ失われた場合は最新世代を頭から読み直す
+            gen = int(os.path.basename(existing[-1]).split(".")[1])
+            return {"gen": gen, "offset": 0, "messages": []}
+        messages = []
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            try:
+                with open(self.legacy_path, encoding="utf-8") as f:
+                    messages = json.load(f)
+            except Exception as e:
+                print(f"🛑 メモリ読み込みエラー: {e}")
+        snap = {"gen": 0, "offset": 0, "messages": messages}
+        if messages:
+            self._write_snapshot(snap)
+        return snap
+
+    @staticmethod
+    def _read_from(path: str, offset: int):
+        messages = []
+        good_end = offset
+        if not os.path.exists(path):
+            return messages, good_end
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    break
+                good_end += len(line)
+        return messages, good_end
+
+    def iter_history(self):
+        """全世代のジャーナルを古い順に辿る（長期記憶の再構築などに使う）"""
+        for path in sorted(glob.glob(os.path.join(self.root, "messages_journal.*.jsonl"))):
+            yield from self._read_from(path, 0)[0]
+
+    # --- 書き込み ---
+    def append(self, message: dict, window: Optional[List[dict]] = None, snapshot: bool = False):
+        """
+        1件追記する。window（現在の会話ウィンドウ）を渡すと COMPACT_EVERY 件ごとにスナップショットを取る。
+        snapshot=True なら件数に関係なく取る（窓から発言を外したとき。次回起動時に外した発言を読み直さない）
+        """
+        self._ensure_writer()
+        self._q.put(("append", message))
+        self._since_snapshot += 1
+        if window is not None and (snapshot or self._since_snapshot >= COMPACT_EVERY):
+            self.snapshot(window)
+
+    def snapshot(self, window: List[dict]):
+        """今の会話ウィンドウでスナップショットを取る（ここまでの追記の後に書かれる）"""
+        self._ensure_writer()
+        self._since_snapshot = 0
+        self._q.put(("compact", [dict(m) for m in window]))
+
+    def flush(self, timeout: Optional[float] = 5.0):
+        if self._writer is None:
+            return
+        done = threading.Event()
+        self._q.put(("flush", done))
+        done.wait(timeout)
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._q.put(("close", None))
+        self._writer.join(timeout=5.0)
+        self._writer = None
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run, name="MessageJournal", daemon=True)
+            self._writer.start()
+
+    def _open(self):
+        if self._f is None:
+            self._f = open(self._journal_path(self.gen), "ab")
+        return self._f
+
+    def _run(self):
+        while True:
+            op, arg = self._q.get()
+            try:
+                if op == "append":
+                    f = self._open()
+                    f.write(json.dumps(arg, ensure_ascii=False).encode("utf-8") + b"\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                elif op == "compact":
+                    self._compact(arg)
+                elif op == "flush":
+                    arg.set()
+                elif op == "close":
+                    if self._f:
+                        self._f.close()
+                        self._f = None
+                    return
+            except Exception as e:
+                print(f"🛑 ジャーナル書き込みエラー: {e}")
+                if op == "flush":
+                    arg.set()
+
+    def _compact(self, window: List[dict]):
+        f = self._open()
+        if f.tell() >= ROTATE_BYTES:
+            # 次の世代へ切り替え（新ファイルを作ってからスナップショットを向け直す）
+            f.close()
+            self.gen += 1
+            self._f = None
+            f = self._open()
+        self._write_snapshot({"gen": self.gen, "offset": f.tell(), "messages": window})
+
+    def _write_snapshot(self, snap: dict):
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# sora_bench.py — 純粋関数のマイクロベンチマーク（合成入力）＋ベースライン保存・比較
+#   対象: build_vowel_timeline / build_motion_cues / 口パク包絡（compute_lipsync_track）/ 母音見積もり /
+#         get_recent_emotion_note / emotion_graph.load_emotion / plot_all
+#   使い方: python sora_bench.py --save        … 計測してベースラインに保存
+#           python sora_bench.py --compare     … ベースラインと比べ、遅くなったケースがあれば終了コード1
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import warnings
+import contextlib
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+BASELINE_PATH = os.environ.get("SORA_BENCH_BASELINE", "bench_baseline.json")
+DATA_DIR = os.path.join(tempfile.gettempdir(), "sora_bench")  # 合成ログの置き場所（行数ごとに使い回す）
+MIN_TIME = 0.2        # 1回の計測でこの秒数に届くまでループ回数を増やす
+REPEAT = 5            # 計測回数（中央値を採る）
+SLOW_CASE_SEC = 2.0   # 1回がこれより遅いケースは計測を1回にする
+THRESHOLD = 1.25      # ベースライン比でこれ以上遅ければ劣化とみなす
+DEFAULT_ROWS = "10000,1000000"  # 感情ログの行数（10M は --rows で指定）
+
+_VOWELS = ("a", "i", "u", "e", "o")
+_CONSONANTS = ("k", "s", "t", "n", "h", "m", "r", "g", "d", "b")
+
+# ===== 合成入力 =====
+def synth_audio_query(n_moras: int, seed: int = 0) -> str:
+    """VOICEVOX の audio_query と同じ形の JSON（4モーラごとにアクセント句、たまにポーズ）"""
+    rng = np.random.default_rng(seed)
+    phrases = []
+    for start in range(0, n_moras, 4):
+        moras = []
+        for _ in range(min(4, n_moras - start)):
+            r = rng.random()
+            vowel = "N" if r < 0.05 else ("cl" if r < 0.08 else _VOWELS[rng.integers(5)])
+            consonant = None if r > 0.7 else _CONSONANTS[rng.integers(len(_CONSONANTS))]
+            moras.append({
+                "text": "ア", "consonant": consonant,
+                "consonant_length": float(rng.uniform(0.03, 0.08)) if consonant else None,
+                "vowel": vowel, "vowel_length": float(rng.uniform(0.05, 0.15)), "pitch": 5.5,
+            })
+        pause = {"text": "、", "vowel": "pau", "vowel_length": 0.3, "pitch": 0.0} if rng.random() < 0.3 else None
+        phrases.append({"moras": moras, "accent": 1, "pause_mora": pause, "is_interrogative": False})
+    return json.dumps({"accent_phrases": phrases, "speedScale": 1.0, "outputSamplingRate": 24000}, ensure_ascii=False)
+
+def synth_reply(n_chars: int, seed: int = 0) -> str:
+    """句読点・感情ワード入りの長い応答文"""
+    rng = np.random.default_rng(seed)
+    pieces = ["かしこまりました", "ご主人様", "今日はとても良い天気ですね", "ありがとうございます",
+              "えっ、本当ですか", "少し休憩しましょう", "お任せください", "申し訳ありません"]
+    marks = ["、", "。", "！", "？"]
+    out, n = [], 0
+    while n < n_chars:
+        s = pieces[rng.integers(len(pieces))] + marks[rng.integers(len(marks))]
+        out.append(s)
+        n += len(s)
+    return "".join(out)[:n_chars]
+
+def synth_speech(seconds: float, sr: int = 24000, seed: int = 0) -> np.ndarray:
+    """音節っぽく振幅が揺れる int16 モノラル音声"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    env = np.clip(np.sin(2 * np.pi * 3.5 * t), 0.0, 1.0) ** 0.7 * (t % 1.3 < 1.0)
+    x = np.sin(2 * np.pi * 180 * t) * env * 0.5 + rng.normal(0, 0.01, len(t))
+    return (np.clip(x, -1, 1) * 32767).astype(np.int16)
+
+def synth_emotion_log(rows: int, data_dir: str = DATA_DIR, seed: int = 0) -> str:
+    """save_log と同じ形式（QUOTE_ALL の date,time,text,emotion）の CSV を作る。同じ行数なら使い回す"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"emotion_{rows}.csv")
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    labels = np.array(["positive", "neutral", "negative"])
+    texts = np.array(["おはよう", "今日は疲れた", "ありがとう", "映画を見た", "少し休憩する"])
+    base = np.datetime64("2024-01-01T00:00:00")
+    chunk = 500_000
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        for start in range(0, rows, chunk):
+            n = min(chunk, rows - start)
+            stamps = base + (np.arange(start, start + n) * 37).astype("timedelta64[s]")
+            s = np.datetime_as_string(stamps, unit="s")
+            date, clock = np.char.partition(s, "T")[:, 0], np.char.partition(s, "T")[:, 2]
+            text = texts[rng.integers(len(texts), size=n)]
+            emo = labels[rng.integers(3, size=n)]
+            lines = ['"' + '","'.join(row) + '"' for row in zip(date, clock, text, emo)]
+            f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+    return path
+
+# ===== 計測 =====
+def measure(fn: Callable[[], object], repeat: int = REPEAT, min_time: float = MIN_TIME) -> Dict[str, float]:
+    """
+    1回あたりの所要時間（ms）の中央値と最小値。速い関数は min_time に届くまでまとめて回す。
+    """
+    t0 = time.perf_counter()
+    fn()
+    first = time.perf_counter() - t0
+    if first >= SLOW_CASE_SEC:
+        return {"median_ms": first * 1000.0, "min_ms": first * 1000.0, "loops": 1, "runs": 1}
+    loops = max(1, int(min_time / max(first, 1e-7)))
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - t0) / loops)
+    return {"median_ms": float(np.median(times)) * 1000.0, "min_ms": min(times) * 1000.0,
+            "loops": loops, "runs": repeat}
+
+# ===== ケース =====
+def _import_sora_main():
+    """sora_main を読み込む。config.py が無い環境（CI など）では計測用の代わりを差し込む"""
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        from sora_latency import harness_config
+        sys.modules["config"] = harness_config(DATA_DIR, int(os.environ.get("VOICEVOX_PORT", "50021")))
+    import sora_main
+    return sora_main
+
+def _pure_cases() -> List[Tuple[str, Callable[[], Callable[[], object]]]]:
+    """(名前, 準備関数)。準備関数は計測する無引数関数を返す（準備の時間は計らない）"""
+    sm = _import_sora_main()
+    from kana_timeline import estimate_vowel_timeline
+    from vts_lipsync import select_keyframes, vowel_amp_form
+
+    def vowel_timeline(n):
+        aq = synth_audio_query(n)
+        return lambda: sm.build_vowel_timeline(aq)
+
+    def motion_cues(n):
+        text = synth_reply(n)
+        return lambda: sm.build_motion_cues(text, "positive", n * 0.12)
+
+    def lipsync_track(sec):
+        pcm = synth_speech(sec)
+        timeline = sm.build_vowel_timeline(synth_audio_query(int(sec / 0.15)))
+        return lambda: sm.compute_lipsync_track(pcm, 24000, timeline)
+
+    def smoothing(sec):
+        x = np.abs(np.sin(np.arange(int(sec * sm.TARGET_FPS)) / 7.0))
+        return lambda: sm._smooth_attack_release(x)
+
+    def keyframes(sec):
+        _, amps, vowels = sm.compute_lipsync_track(synth_speech(sec), 24000, [])
+        frames = [vowel_amp_form(v, a) for v, a in zip(vowels, amps)]
+        times = [n / sm.TARGET_FPS for n in range(len(frames))]
+        a, f = [x for x, _ in frames], [y for _, y in frames]
+        return lambda: select_keyframes(times, a, f)
+
+    def estimate_timeline(n):
+        text = synth_reply(n)
+        return lambda: estimate_vowel_timeline(text, n * 0.12)
+
+    return [
+        ("build_vowel_timeline[moras=200]", lambda: vowel_timeline(200)),
+        ("build_vowel_timeline[moras=20000]", lambda: vowel_timeline(20000)),
+        ("build_motion_cues[chars=200]", lambda: motion_cues(200)),
+        ("build_motion_cues[chars=20000]", lambda: motion_cues(20000)),
+        ("compute_lipsync_track[sec=5]", lambda: lipsync_track(5)),
+        ("compute_lipsync_track[sec=120]", lambda: lipsync_track(120)),
+        ("smooth_attack_release[sec=120]", lambda: smoothing(120)),
+        ("select_keyframes[sec=30]", lambda: keyframes(30)),
+        ("estimate_vowel_timeline[chars=200]", lambda: estimate_timeline(200)),
+    ]
+
+def _log_cases(rows_list: List[int], data_dir: str) -> List[Tuple[str, Callable[[], Callable[[], object]]]]:
+    import matplotlib
+    matplotlib.use("Agg")
+    sm = _import_sora_main()
+    import emotion_trend
+    import emotion_graph as eg
+
+    def note_cold(rows):
+        path = synth_emotion_log(rows, data_dir)
+        index_path = emotion_trend._index_path(path)
+        def run():
+            # インデックス無し（初回起動）：末尾だけ読んで作り直す経路
+            emotion_trend._indexes.pop(path, None)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            return sm.get_recent_emotion_note(path)
+        return run
+
+    def note_warm(rows):
+        path = synth_emotion_log(rows, data_dir)
+        sm.get_recent_emotion_note(path)
+        return lambda: sm.get_recent_emotion_note(path)
+
+    def load(rows):
+        path = synth_emotion_log(rows, data_dir)
+        return lambda: eg.load_emotion(path)
+
+    def plot(rows):
+        df, _ = eg.load_emotion(synth_emotion_log(rows, data_dir))
+        out = os.path.join(data_dir, "plot.png")
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # 日本語フォントが無い環境のグリフ警告
+                eg.plot_all(df, out_path=out, show=False)
+        return run
+
+    cases = []
+    for rows in rows_list:
+        cases += [
+            (f"get_recent_emotion_note[cold,rows={rows}]", lambda r=rows: note_cold(r)),
+            (f"get_recent_emotion_note[warm,rows={rows}]", lambda r=rows: note_warm(r)),
+            (f"load_emotion[rows={rows}]", lambda r=rows: load(r)),
+            (f"plot_all[rows={rows}]", lambda r=rows: plot(r)),
+        ]
+    return cases
+
+def run_cases(cases, pattern: str = "", repeat: int = REPEAT) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, setup in cases:
+        if pattern and pattern not in name:
+            continue
+        try:
+            fn = setup()
+            results[name] = measure(fn, repeat=repeat)
+        except Exception as e:
+            print(f"🛑 {name}: {e}")
+            continue
+        r = results[name]
+        print(f"  {name:<48} {r['median_ms']:>12.3f} ms  (min {r['min_ms']:.3f}, {r['loops']}×{r['runs']})")
+    return results
+
+# ===== ベースライン =====
+def machine_info() -> Dict[str, str]:
+    return {"machine": platform.machine(), "processor": platform.processor() or platform.machine(),
+            "python": platform.python_version(), "numpy": np.__version__, "node": platform.node()}
+
+def load_baseline(path: str = BASELINE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_baseline(results: Dict[str, Dict[str, float]], path: str = BASELINE_PATH):
+    """既存のベースラインに今回計測したケースだけ上書きする"""
+    base = load_baseline(path)
+    cases = base.get("cases", {})
+    cases.update({k: round(v["median_ms"], 4) for k, v in results.items()})
+    base = {"saved_at": datetime.now().isoformat(timespec="seconds"), "env": machine_info(), "cases": cases}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(base, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def compare(results: Dict[str, Dict[str, float]], base: dict, threshold: float = THRESHOLD) -> List[str]:
+    """返り値: 劣化したケース名"""
+    if base.get("env", {}).get("node") not in (None, platform.node()):
+        print(f"ℹ️ ベースラインは別の環境で計測されています（{base['env'].get('node')}）")
+    regressed = []
+    for name, r in results.items():
+        ref = base.get("cases", {}).get(name)
+        if not ref:
+            print(f"  {name:<48} （ベースラインなし）")
+            continue
+        ratio = r["median_ms"] / ref
+        mark = "🛑" if ratio >= threshold else ("🟢" if ratio <= 1 / threshold else "  ")
+        print(f"{mark}{name:<48} {ref:>10.3f} → {r['median_ms']:>10.3f} ms  ×{ratio:.2f}")
+        if ratio >= threshold:
+            regressed.append(name)
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="ソラ 純粋関数のマイクロベンチマーク")
+    parser.add_argument("-k", dest="pattern", default="", help="名前にこの文字列を含むケースだけ実行")
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help="感情ログの行数（カンマ区切り。例: 10000,1000000,10000000）")
+    parser.add_argument("--no-logs", dest="logs", action="store_false", help="感情ログ系（CSV読み込み・描画）を飛ばす")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="計測回数（中央値を採る）")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="合成ログの置き場所")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="ベースラインJSONのパス")
+    parser.add_argument("--save", action="store_true", help="結果をベースラインに保存する")
+    parser.add_argument("--compare", action="store_true", help="ベースラインと比較する（劣化があれば終了コード1）")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="劣化とみなす倍率")
+    args = parser.parse_args()
+
+    cases = _pure_cases()
+    if args.logs:
+        rows_list = [int(r) for r in args.rows.split(",") if r.strip()]
+        cases += _log_cases(rows_list, args.data_dir)
+    print(f"ℹ️ {platform.python_version()} / numpy {np.__version__} / {platform.machine()}")
+    results = run_cases(cases, args.pattern, repeat=max(1, args.repeat))
+    if not results:
+        print("🛑 実行したケースがありません")
+        sys.exit(2)
+
+    code = 0
+    if args.compare:
+        base = load_baseline(args.baseline)
+        if not base:
+            print(f"🛑 ベースラインがありません: {args.baseline}（--save で作成）")
+            code = 2
+        elif compare(results, base, args.threshold):
+            code = 1
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"✅ ベースラインを保存しました: {args.baseline}")
+    sys.exit(code)
+
+if __name__ == "__main__":
+    main()
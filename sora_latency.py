@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+# sora_latency.py — 発話の端から端までの遅延計測（VOICEVOX・VTS・ChatGPT をローカルの代役に差し替え）
+#   既定は出荷どおりの AsyncSoraRuntime.turn、--runtime threaded で従来の generate_and_speak を計測する。
+#   代役: /audio_query・/synthesis を返すHTTPサーバー（遅延を指定可）/ 認証・入力一覧・注入・Hotkey に答え、
+#         届いた時刻を記録するVTS WebSocket / 台本どおりに（ストリーミングでも）返すOpenAI互換チャットサーバー。
+#   音声は SORA_AUDIO_BACKEND=null で鳴らさずに実時間で進めるので、音声デバイスの無いLinuxでも動く。
+#   計測: 最初の音が鳴るまで（TTFA）/ 口パクフレームの遅れ（ジッタ）/ モーションと音声のずれ / スループット
+#   エージェント側の設定は環境変数で代役に向けるので、別プロセス（CLI）として実行する。
+#   config.py（APIキーなど）は使わず、計測用の設定を config モジュールとして差し込む（素のチェックアウトで動く）。
+
+import os
+import io
+import sys
+import json
+import time
+import wave
+import asyncio
+import argparse
+import tempfile
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import websockets
+
+from kana_timeline import text_to_morae
+
+SAMPLE_RATE = 24000
+DEFAULT_SCRIPT = [
+    ("おはよう", "おはようございます、ご主人様。今日もよろしくお願いいたします！"),
+    ("今日の天気は？", "今日はとても良い天気ですね。お散歩日和だと思います。少し休憩しましょうか？"),
+    ("疲れた", "お疲れさまでした。温かいお茶を用意しますね。ゆっくり休んでください。"),
+    ("ありがとう", "どういたしまして！ご主人様のお役に立てて嬉しいです。"),
+]
+
+def _now() -> float:
+    return time.perf_counter()
+
+# ===== VOICEVOX の代役 =====
+def fake_audio_query(text: str, speed: float = 1.0) -> dict:
+    """テキストのモーラ列から VOICEVOX と同じ形の audio_query を作る（長さは固定値）"""
+    phrases, moras = [], []
+    for has_consonant, tag in text_to_morae(text):
+        if tag == "pau":
+            phrases.append({"moras": moras, "accent": 1, "is_interrogative": False,
+                            "pause_mora": {"text": "、", "vowel": "pau", "vowel_length": 0.3, "pitch": 0.0}})
+            moras = []
+            continue
+        vowel = {"cl": "cl", "N": "N"}.get(tag, tag)
+        moras.append({"text": "ア", "consonant": "k" if has_consonant else None,
+                      "consonant_length": 0.05 if has_consonant else None,
+                      "vowel": vowel, "vowel_length": 0.09, "pitch": 5.5 if tag not in ("cl", "N") else 0.0})
+    if moras:
+        phrases.append({"moras": moras, "accent": 1, "is_interrogative": False, "pause_mora": None})
+    return {"accent_phrases": phrases, "speedScale": speed, "pitchScale": 0.0, "intonationScale": 1.0,
+            "volumeScale": 1.0, "prePhonemeLength": 0.0, "postPhonemeLength": 0.0,
+            "outputSamplingRate": SAMPLE_RATE, "outputStereo": False, "kana": ""}
+
+def fake_synthesis(aq: dict) -> bytes:
+    """audio_query の区間どおりに振幅が揺れる音声（母音は大きく、子音は小さく、ポーズは無音）"""
+    parts = []
+    for phrase in aq.get("accent_phrases", []):
+        for mora in phrase.get("moras", []):
+            cl = float(mora.get("consonant_length") or 0.0)
+            vl = float(mora.get("vowel_length") or 0.0)
+            parts.append((cl, 0.08))
+            parts.append((vl, 0.0 if mora.get("vowel") in ("cl", "N") else 0.45))
+        pm = phrase.get("pause_mora")
+        if pm:
+            parts.append((float(pm.get("vowel_length") or 0.0), 0.0))
+    env = np.concatenate([np.full(int(round(d * SAMPLE_RATE)), a) for d, a in parts if d > 0] or [np.zeros(1)])
+    t = np.arange(len(env)) / SAMPLE_RATE
+    pcm = (np.sin(2 * np.pi * 180 * t) * env * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+class FakeVoicevox:
+    """
+    query_ms: audio_query の応答遅延 / synth_ms: 合成の固定遅延 / rtf: 音声1秒あたりの合成時間（秒）
+    log に (時刻, 種類, 秒) を残す。種類: query / synthesis（合成の応答を返した時刻）
+    """
+    def __init__(self, query_ms: float = 30.0, synth_ms: float = 60.0, rtf: float = 0.1):
+        self.query_ms = query_ms
+        self.synth_ms = synth_ms
+        self.rtf = rtf
+        self.log: List[tuple] = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body: bytes, ctype: str):
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/version":
+                    self._reply(b'"0.0.0-harness"', "application/json")
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                q = parse_qs(url.query)
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if url.path == "/audio_query":
+                    time.sleep(fake.query_ms / 1000.0)
+                    aq = fake_audio_query(q.get("text", [""])[0])
+                    fake.log.append((_now(), "query", 0.0))
+                    self._reply(json.dumps(aq, ensure_ascii=False).encode("utf-8"), "application/json")
+                elif url.path == "/synthesis":
+                    wav = fake_synthesis(json.loads(body or b"{}"))
+                    duration = (len(wav) - 44) / 2 / SAMPLE_RATE
+                    time.sleep(fake.synth_ms / 1000.0 + fake.rtf * duration)
+                    fake.log.append((_now(), "synthesis", duration))
+                    self._reply(wav, "audio/wav")
+                else:
+                    self.send_error(404)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="FakeVoicevox", daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+# ===== VTube Studio の代役 =====
+class FakeVTS:
+    """
+    VTS Public API の必要な分だけ答える WebSocket サーバー（専用スレッドのループで動く）。
+    frames に (受信時刻, {入力名: 値})、hotkeys に (受信時刻, Hotkey名) を記録する。
+    """
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.frames: List[tuple] = []
+        self.hotkeys: List[tuple] = []
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="FakeVTS", daemon=True).start()
+        self._server = asyncio.run_coroutine_threadsafe(self._serve(), self._loop).result(timeout=10)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _serve(self):
+        return await websockets.serve(self._handler, "127.0.0.1", 0)
+
+    async def _handler(self, ws):
+        async for raw in ws:
+            t = _now()
+            req = json.loads(raw)
+            mt = req.get("messageType", "")
+            d = req.get("data") or {}
+            data = {}
+            if mt == "AuthenticationTokenRequest":
+                data = {"authenticationToken": "harness"}
+            elif mt == "AuthenticationRequest":
+                data = {"authenticated": True, "reason": ""}
+            elif mt == "APIStateRequest":
+                data = {"active": True, "currentSessionAuthenticated": True}
+            elif mt == "InputParameterListRequest":
+                data = {"defaultParameters": [{"name": "MouthOpen"}, {"name": "MouthForm"}], "customParameters": []}
+            elif mt == "InjectParameterDataRequest":
+                self.frames.append((t, {p["id"]: p["value"] for p in d.get("parameterValues", [])}))
+            elif mt == "HotkeyTriggerRequest":
+                self.hotkeys.append((t, d.get("hotkeyID")))
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000.0)
+            await ws.send(json.dumps({"apiName": "VTubeStudioPublicAPI", "apiVersion": "1.0",
+                                      "requestID": req.get("requestID"),
+                                      "messageType": mt.replace("Request", "Response"), "data": data}))
+
+    def close(self):
+        self._server.close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+# ===== ChatGPT の代役 =====
+class FakeChat:
+    """
+    OpenAI 互換の /v1/chat/completions。台本の返答を順に返す（stream=True なら SSE で少しずつ）。
+    first_ms: 最初の断片までの遅延 / token_ms: 断片ごとの間隔 / chunk_chars: 1断片の文字数
+    要約の依頼（context_window）には短い要約を返す。log に (時刻, 種類) を残す。種類: request / first_token
+    """
+    def __init__(self, replies: List[str], first_ms: float = 300.0, token_ms: float = 25.0, chunk_chars: int = 2):
+        self.replies = list(replies)
+        self.first_ms = first_ms
+        self.token_ms = token_ms
+        self.chunk_chars = max(1, chunk_chars)
+        self.log: List[tuple] = []
+        self._i = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                fake.log.append((_now(), "request"))
+                text = fake._answer(req.get("messages") or [])
+                time.sleep(fake.first_ms / 1000.0)
+                if req.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for i in range(0, len(text), fake.chunk_chars):
+                        if i:
+                            time.sleep(fake.token_ms / 1000.0)
+                        else:
+                            fake.log.append((_now(), "first_token"))
+                        self._event({"delta": {"content": text[i:i + fake.chunk_chars]}, "finish_reason": None},
+                                    "chat.completion.chunk")
+                    self._event({"delta": {}, "finish_reason": "stop"}, "chat.completion.chunk")
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                else:
+                    fake.log.append((_now(), "first_token"))
+                    body = json.dumps(fake._completion(
+                        {"message": {"role": "assistant", "content": text}, "finish_reason": "stop"},
+                        "chat.completion"), ensure_ascii=False).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def _event(self, choice, obj):
+                data = json.dumps(fake._completion(choice, obj), ensure_ascii=False)
+                self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="FakeChat", daemon=True).start()
+
+    def _answer(self, messages: List[dict]) -> str:
+        last = (messages[-1].get("content") or "") if messages else ""
+        if "これまでの要約" in last:
+            return "ご主人様と日常の話をした。"
+        with self._lock:
+            text = self.replies[self._i % len(self.replies)]
+            self._i += 1
+        return text
+
+    @staticmethod
+    def _completion(choice: dict, obj: str) -> dict:
+        return {"id": "chatcmpl-harness", "object": obj, "created": int(time.time()), "model": "gpt-4o",
+                "choices": [dict(index=0, **choice)]}
+
+    def close(self):
+        self.server.shutdown()
+
+def scripted_classifier(texts, **_):
+    """transformers の pipeline と同じ形で返す台本用の感情分類（キーワードだけ）"""
+    def label(text):
+        if any(w in text for w in ("ごめん", "申し訳", "残念", "疲れ")):
+            return "negative"
+        if any(w in text for w in ("！", "嬉し", "ありがと", "良い")):
+            return "positive"
+        return "neutral"
+    if isinstance(texts, str):
+        return [{"label": label(texts), "score": 1.0}]
+    return [{"label": label(t), "score": 1.0} for t in texts]
+
+# ===== 集計 =====
+def summarize(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    a = np.asarray(values, dtype=np.float64)
+    return {"n": int(len(a)), "mean": float(a.mean()), "p50": float(np.percentile(a, 50)),
+            "p95": float(np.percentile(a, 95)), "max": float(a.max())}
+
+def lip_lateness(frames, segments, offset: float, fps: int) -> List[float]:
+    """
+    口パクフレームの遅れ（ms）。各フレームを「区間の鳴り始め＋offset」から 1/fps 刻みの格子に当て、
+    直前の格子点からの遅れを求める（差分送信で間引かれても格子には乗るので測れる）。
+    """
+    late = []
+    period = 1.0 / fps
+    starts = [s.start_time for s in segments]
+    for t, values in frames:
+        k = int(np.searchsorted(starts, t - offset + 0.001, side="right")) - 1
+        if k < 0:
+            continue
+        seg = segments[k]
+        rel = t - seg.start_time - offset
+        if rel < -0.001 or rel > seg.duration + period:
+            continue  # 発話前の閉口・終了後の閉口は格子に乗らない
+        late.append((rel - np.floor(rel / period + 1e-6) * period) * 1000.0)
+    return late
+
+def motion_offsets(hotkeys, segments) -> List[float]:
+    """各区間の鳴り始めに対する、冒頭モーション（0秒のキュー）が届くまでのずれ（ms）"""
+    out = []
+    for seg in segments:
+        near = [t for t, _ in hotkeys if seg.start_time - 0.05 <= t <= seg.start_time + 0.5]
+        if near:
+            out.append((min(near) - seg.start_time) * 1000.0)
+    return out
+
+# ===== 実行 =====
+RUNTIMES = ("async", "threaded")
+
+def harness_config(work_dir: str, voicevox_port: int) -> types.ModuleType:
+    """sora_main が読む config モジュールの代わり（鍵も実ファイルも要らない値だけ）"""
+    config = types.ModuleType("config")
+    config.OPENAI_API_KEY = "harness"
+    config.VOICEVOX_PORT = voicevox_port
+    config.DEFAULT_SPEAKER_ID = 1
+    config.LOG_FILE_PATH = os.path.join(work_dir, "log", "emotion.csv")
+    config.VOICE_OUTPUT_PATH = os.path.join(work_dir, "voice.wav")
+    return config
+
+def run(script=DEFAULT_SCRIPT, turns: int = 8, stream: bool = True, work_dir: Optional[str] = None,
+        vv_query_ms: float = 30.0, vv_synth_ms: float = 60.0, vv_rtf: float = 0.1,
+        chat_first_ms: float = 300.0, chat_token_ms: float = 25.0, vts_latency_ms: float = 0.0,
+        real_emotion: bool = False, runtime: str = "async") -> dict:
+    """
+    代役を立ち上げてエージェントに turns 回話させ、計測結果を返す。
+    runtime: async（AsyncSoraRuntime.turn、既定の実行系）/ threaded（SoraEmotionAgent.generate_and_speak）
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"runtime は {RUNTIMES} のどれか: {runtime}")
+    work_dir = work_dir or tempfile.mkdtemp(prefix="sora_latency_")
+    vv = FakeVoicevox(vv_query_ms, vv_synth_ms, vv_rtf)
+    vts = FakeVTS(vts_latency_ms)
+    chat = FakeChat([reply for _, reply in script], chat_first_ms, chat_token_ms)
+
+    # エージェント側のモジュールは読み込み時に環境変数を見るので、ここで代役に向けてから読み込む
+    if "sora_main" in sys.modules:
+        raise RuntimeError("エージェントのモジュールが先に読み込まれています。別プロセスで実行してください")
+    os.environ.update({
+        "VTS_WS_URL": f"ws://127.0.0.1:{vts.port}",
+        "VTS_TOKEN_PATH": os.path.join(work_dir, "vts_token.txt"),
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{chat.port}/v1",
+        "SORA_AUDIO_BACKEND": "null",
+        "SORA_TTS_CACHE": "0",
+        "SORA_MEMORY_EMBEDDER": "hash",
+        "SORA_AUTOTALK_PREFETCH_LEAD": "0",
+    })
+    sys.modules["config"] = harness_config(work_dir, vv.port)
+    import sora_main
+    import emotion_model
+    from audio_output import get_audio_output, shutdown_audio_output
+    from vts_lipsync import shutdown_vts_session
+    if not real_emotion:
+        emotion_model._classifier = scripted_classifier
+
+    agent = sora_main.SoraEmotionAgent(
+        api_key="harness", speaker_id=sora_main.DEFAULT_SPEAKER_ID,
+        log_path=os.path.join(work_dir, "log", "emotion.csv"),
+        output_path=os.path.join(work_dir, "voice.wav"),
+        port=vv.port, memory_dir=os.path.join(work_dir, "memory"),
+    )
+    agent.stream_reply = stream
+    out = get_audio_output(SAMPLE_RATE, 1)
+
+    loop = rt = None
+    if runtime == "async":
+        # ランタイムは専用スレッドのループで動かし、計測側からは1ターンずつ終わるまで待つ
+        from sora_runtime import AsyncSoraRuntime
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="SoraRuntime", daemon=True).start()
+        rt = AsyncSoraRuntime(agent)
+        asyncio.run_coroutine_threadsafe(rt.start(), loop).result()
+        speak = lambda text: asyncio.run_coroutine_threadsafe(rt.turn(text), loop).result()
+    else:
+        speak = agent.generate_and_speak
+
+    results = []
+    wall0 = _now()
+    try:
+        for n in range(turns):
+            user_input = script[n % len(script)][0]
+            seen = len(out.history)
+            f0, h0, v0, c0 = len(vts.frames), len(vts.hotkeys), len(vv.log), len(chat.log)
+            t0 = _now()
+            speak(user_input)
+            t1 = _now()
+            segments = [s for s in list(out.history)[seen:] if s.start_time is not None]
+            frames, hotkeys = vts.frames[f0:], vts.hotkeys[h0:]
+            synth = [t for t, kind, _ in vv.log[v0:] if kind == "synthesis"]
+            first_token = [t for t, kind in chat.log[c0:] if kind == "first_token"]
+            results.append({
+                "turn": n,
+                "ttfa_ms": (segments[0].start_time - t0) * 1000.0 if segments else None,
+                "first_token_ms": (first_token[0] - t0) * 1000.0 if first_token else None,
+                "first_synthesis_ms": (synth[0] - t0) * 1000.0 if synth else None,
+                "turn_ms": (t1 - t0) * 1000.0,
+                "audio_sec": sum(s.duration for s in segments),
+                "segments": len(segments),
+                "frames": len(frames),
+                "lip_late_ms": lip_lateness(frames, segments, sora_main.OFFSET_MS / 1000.0, sora_main.TARGET_FPS),
+                "motion_offset_ms": motion_offsets(hotkeys, segments),
+            })
+    finally:
+        wall = _now() - wall0
+        if rt is not None:
+            asyncio.run_coroutine_threadsafe(rt.aclose(), loop).result(timeout=10)
+            loop.call_soon_threadsafe(loop.stop)
+        else:
+            shutdown_audio_output()
+            shutdown_vts_session()
+            agent.memory.close()
+        vv.close(); vts.close(); chat.close()
+
+    audio = sum(r["audio_sec"] for r in results)
+    return {
+        "config": {"turns": turns, "runtime": runtime, "stream": stream, "vv_query_ms": vv_query_ms, "vv_synth_ms": vv_synth_ms,
+                   "vv_rtf": vv_rtf, "chat_first_ms": chat_first_ms, "chat_token_ms": chat_token_ms,
+                   "vts_latency_ms": vts_latency_ms},
+        "ttfa_ms": summarize([r["ttfa_ms"] for r in results if r["ttfa_ms"] is not None]),
+        "first_token_ms": summarize([r["first_token_ms"] for r in results if r["first_token_ms"] is not None]),
+        "first_synthesis_ms": summarize([r["first_synthesis_ms"] for r in results if r["first_synthesis_ms"] is not None]),
+        "lip_late_ms": summarize([x for r in results for x in r["lip_late_ms"]]),
+        "motion_offset_ms": summarize([x for r in results for x in r["motion_offset_ms"]]),
+        "throughput": {
+            "wall_sec": wall, "audio_sec": audio,
+            "turns_per_min": len(results) / wall * 60.0 if wall > 0 else 0.0,
+            "audio_per_wall": audio / wall if wall > 0 else 0.0,
+            "frames_per_audio_sec": sum(r["frames"] for r in results) / audio if audio > 0 else 0.0,
+        },
+        "turns": [{k: v for k, v in r.items() if k not in ("lip_late_ms", "motion_offset_ms")} for r in results],
+    }
+
+def print_report(report: dict):
+    c = report["config"]
+    print(f"ℹ️ {c['turns']}ターン / {c['runtime']} / {'ストリーミング' if c['stream'] else '一括'} / VOICEVOX query {c['vv_query_ms']:.0f}ms "
+          f"synth {c['vv_synth_ms']:.0f}ms+{c['vv_rtf']:.2f}×音声長 / chat 初回 {c['chat_first_ms']:.0f}ms "
+          f"断片 {c['chat_token_ms']:.0f}ms / VTS {c['vts_latency_ms']:.0f}ms")
+    labels = [("ttfa_ms", "最初の音まで（TTFA）"), ("first_token_ms", "最初の応答断片まで"),
+              ("first_synthesis_ms", "最初の合成完了まで"), ("lip_late_ms", "口パクフレームの遅れ"),
+              ("motion_offset_ms", "冒頭モーションのずれ")]
+    for key, label in labels:
+        s = report[key]
+        if s is None:
+            print(f"  {'-':>8}  {label}（データなし）")
+            continue
+        print(f"  p50 {s['p50']:8.1f}ms  p95 {s['p95']:8.1f}ms  max {s['max']:8.1f}ms  (n={s['n']:>5})  {label}")
+    tp = report["throughput"]
+    print(f"  スループット: {tp['turns_per_min']:.1f} ターン/分  音声 {tp['audio_sec']:.1f}秒 / 経過 {tp['wall_sec']:.1f}秒"
+          f"（×{tp['audio_per_wall']:.2f}）  注入 {tp['frames_per_audio_sec']:.1f} フレーム/音声秒")
+
+def load_script(path: str):
+    """1行「ユーザー入力<TAB>返答」。タブが無ければ返答だけ（入力は固定文）"""
+    script = []
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            user, _, reply = line.partition("\t")
+            script.append((user, reply) if reply else ("お話しして", user))
+    return script
+
+def main():
+    parser = argparse.ArgumentParser(description="ソラ 端から端までの遅延計測（VOICEVOX/VTS/ChatGPT をローカルの代役で）")
+    parser.add_argument("--turns", type=int, default=8, help="会話ターン数")
+    parser.add_argument("--script", default=None, help="台本（1行「入力<TAB>返答」）")
+    parser.add_argument("--runtime", choices=RUNTIMES, default="async",
+                        help="計測する実行系（async: 既定の AsyncSoraRuntime / threaded: 従来のスレッド版）")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="一括生成の経路を計測する")
+    parser.add_argument("--vv-query-ms", type=float, default=30.0, help="audio_query の遅延")
+    parser.add_argument("--vv-synth-ms", type=float, default=60.0, help="合成の固定遅延")
+    parser.add_argument("--vv-rtf", type=float, default=0.1, help="音声1秒あたりの合成時間（秒）")
+    parser.add_argument("--chat-first-ms", type=float, default=300.0, help="最初の応答断片までの遅延")
+    parser.add_argument("--chat-token-ms", type=float, default=25.0, help="応答断片の間隔")
+    parser.add_argument("--vts-latency-ms", type=float, default=0.0, help="VTS の応答遅延")
+    parser.add_argument("--real-emotion", action="store_true", help="感情分類に本物のモデルを使う")
+    parser.add_argument("--work-dir", default=None, help="ログ・記憶の置き場所（既定: 一時フォルダ）")
+    parser.add_argument("--json", default=None, help="結果をJSONで書き出すパス")
+    args = parser.parse_args()
+
+    script = load_script(args.script) if args.script else DEFAULT_SCRIPT
+    if not script:
+        print("🛑 台本が空です")
+        sys.exit(1)
+    report = run(script, turns=max(1, args.turns), stream=args.stream, work_dir=args.work_dir,
+                 vv_query_ms=args.vv_query_ms, vv_synth_ms=args.vv_synth_ms, vv_rtf=args.vv_rtf,
+                 chat_first_ms=args.chat_first_ms, chat_token_ms=args.chat_token_ms,
+                 vts_latency_ms=args.vts_latency_ms, real_emotion=args.real_emotion, runtime=args.runtime)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果を保存しました: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -3,19 +3,26 @@ import time
 import os
 import csv
 import threading
-import requests
-import simpleaudio as sa
-import soundfile as sf
+import queue
 import json
 import numpy as np
-import asyncio
-import websockets
 from openai import OpenAI
 from datetime import datetime
 
-from emotion_model import classify_emotion
+from emotion_model import get_emotion_service, warmup as warmup_emotion_model
 from config import OPENAI_API_KEY, VOICEVOX_PORT, DEFAULT_SPEAKER_ID, LOG_FILE_PATH, VOICE_OUTPUT_PATH
-from vts_lipsync import VTSLipsync  # SoraMouthProxy優先＋Form任意対応
+from emotion_trend import get_trend_index
+from message_journal import MessageJournal
+from context_window import ContextWindow, openai_summarizer
+from long_memory import LongTermMemory, recall_message
+from auto_talk import AutoTalkPrefetcher, PreparedTalk
+from voicevox_client import get_voicevox_client
+from audio_buffer import AudioClip, SAVE_WAV
+from cue_scheduler import CueScheduler
+from audio_output import get_audio_output, cancel_audio_output, shutdown_audio_output
+import sora_trace as trace
+from kana_timeline import estimate_vowel_timeline
+from vts_lipsync import VTSLipsync, get_vts_session, shutdown_vts_session, vowel_amp_form, select_keyframes  # SoraMouthProxy優先＋Form任意対応
 
 MEMORY_PATH = "log/messages_memory.json"
 
@@ -25,17 +32,25 @@ ATTACK      = 0.45  # 開く速さ（大きいほど素早く開く）
 RELEASE     = 0.25  # 閉じる速さ（小さすぎると残留）
 NOISE_GATE  = 0.02  # これ未満は0扱い
 TARGET_FPS  = 60    # 送信フレームレート
+ESTIMATE_AMP = 0.6  # テキストからの見積もり（音声解析前）で使う母音区間の開き
+LIP_AMP_INPUTS  = ["SoraMouthProxy", "MouthOpen", "PlusMouthOpen", "VoiceVolume"]
+LIP_FORM_INPUTS = ["SoraMouthFormProxy", "MouthForm", "MouthShape"]
+
+# ===== ストリーミング発話 =====
+# 1 にすると応答を文単位で区切り、生成中に合成・再生を始める
+STREAM_REPLY = os.environ.get("SORA_STREAM_REPLY", "0") == "1"
+SENTENCE_DELIMS = "。！？"
+SENTENCE_TRAIL  = "。！？!?」』）)…"  # 句点に続けて同じ文に含める文字
+
+# ===== 割り込み（発話中の入力） =====
+INTERRUPT_MARK   = "…（中断）"  # 割り込まれた応答の末尾に付けて履歴に残す
+AUTO_TALK_PROMPT = "何か話しかけてください"
 
 emotion_score_map = {"positive": 1, "neutral": 0, "negative": -1}
 # 女声スタイル（ご主人様指定）
 style_map = {"positive": 58, "neutral": 58, "negative": 60}
 
 # ===== VTSモーション（Hotkey送信用の軽量クライアント） =====
-VTS_WS_URL = os.environ.get("VTS_WS_URL", "ws://127.0.0.1:8001")
-VTS_TOKEN_PATH = os.environ.get("VTS_TOKEN_PATH", "vts_token.txt")
-PLUGIN_NAME = os.environ.get("VTS_PLUGIN_NAME", "SoraMotion")
-DEVELOPER   = os.environ.get("VTS_DEVELOPER",  "SoraDev")
-
 # Hotkey名（VTS側で同名のHotkeyを作成してね）
 HOTKEY_MAP = {
     "joy": "SoraJoy",
@@ -46,87 +61,21 @@ HOTKEY_MAP = {
 }
 
 class VTSMotionClient:
-    def __init__(self):
-        self.ws = None
-        self._req_id = 0
-        self._authed = False
-        self._loop = asyncio.new_event_loop()
-        self._th = threading.Thread(target=self._loop.run_forever, daemon=True)
-        self._th.start()
-
-    def _run(self, coro, timeout: float = 10.0):
-        fut = asyncio.run_coroutine_threadsafe(coro, self._loop)
-        return fut.result(timeout=timeout)
-
-    async def _send(self, message_type: str, data=None):
-        self._req_id += 1
-        payload = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "messageType": message_type,
-            "requestID": str(self._req_id)
-        }
-        if data is not None:
-            payload["data"] = data
-        await self.ws.send(json.dumps(payload))
-        resp = json.loads(await self.ws.recv())
-        return resp
-
-    async def _authenticate(self):
-        token = None
-        if os.path.exists(VTS_TOKEN_PATH):
-            token = open(VTS_TOKEN_PATH, "r", encoding="utf-8").read().strip()
-        if token:
-            r = await self._send("AuthenticationRequest", {
-                "pluginName": PLUGIN_NAME, "pluginDeveloper": DEVELOPER,
-                "authenticationToken": token
-            })
-            if r.get("data", {}).get("authenticated", False):
-                self._authed = True
-                return
-        # 初回発行
-        r = await self._send("AuthenticationTokenRequest", {
-            "pluginName": PLUGIN_NAME, "pluginDeveloper": DEVELOPER
-        })
-        token = r.get("data", {}).get("authenticationToken")
-        r = await self._send("AuthenticationRequest", {
-            "pluginName": PLUGIN_NAME, "pluginDeveloper": DEVELOPER,
-            "authenticationToken": token
-        })
-        if not r.get("data", {}).get("authenticated", False):
-            raise RuntimeError("VTS auth failed")
-        with open(VTS_TOKEN_PATH, "w", encoding="utf-8") as f:
-            f.write(token)
-        self._authed = True
+    """Hotkey送信用。接続はプロセス共有のVTSセッションを使う（close() でも切断しない）"""
+    def __init__(self, session=None):
+        self._session = session or get_vts_session()
 
     def connect(self):
-        async def _c():
-            self.ws = await websockets.connect(VTS_WS_URL, max_size=1<<20, ping_interval=15, ping_timeout=20)
-            try:
-                await self._send("APIStateRequest")
-            except Exception:
-                pass
-            await self._authenticate()
-        self._run(_c())
+        self._session.connect()
 
     def trigger_hotkey(self, hotkey_name: str):
-        async def _t():
-            await self._send("HotkeyTriggerRequest", {"hotkeyID": hotkey_name})
         try:
-            self._run(_t(), timeout=2.0)
+            self._session.trigger_hotkey(hotkey_name, timeout=2.0)
         except Exception:
             pass
 
     def close(self):
-        async def _x():
-            if self.ws:
-                await self.ws.close()
-        try: self._run(_x(), timeout=3.0)
-        except Exception: pass
-        try:
-            self._loop.call_soon_threadsafe(self._loop.stop)
-            self._th.join(timeout=2.0)
-        except Exception: pass
+        pass
 
 # ===== Persona / 会話メモリ =====
 def get_initial_persona(extra_note=""):
@@ -138,68 +87,88 @@ def get_initial_persona(extra_note=""):
 以上のルールに基づき、ご主人様の意図を汲み、簡潔に丁寧に応答してください。"""
     }
 
-def get_recent_emotion_note():
-    if not os.path.exists(LOG_FILE_PATH):
-        return ""
-    records = []
-    try:
-        with open(LOG_FILE_PATH, encoding='utf-8') as f:
-            for line in f:
-                parts = [p.strip() for p in line.strip().split(",")]
-                if len(parts) == 4:
-                    emotion = parts[3]
-                    score = emotion_score_map.get(emotion, 0)
-                    records.append(score)
-        if not records:
-            return ""
-        recent_avg = sum(records[-20:]) / min(len(records), 20)
-        if recent_avg > 0.3:
-            return "最近の傾向は前向きです。返答は少し明るめに。"
-        elif recent_avg < -0.3:
-            return "最近の傾向は落ち込み気味です。返答は少し優しめに。"
-        else:
-            return ""
-    except:
+def get_recent_emotion_note(log_path=LOG_FILE_PATH):
+    if not os.path.exists(log_path):
         return ""
-
-def save_messages(messages, path=MEMORY_PATH):
     try:
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
+        recent_avg = get_trend_index(log_path).recent_average()
     except Exception as e:
-        print(f"🛑 メモリ保存エラー: {e}")
+        trace.event("swallowed_error", kind="recent_emotion_note", error=repr(e))
+        return ""
+    if recent_avg is None:
+        return ""
+    if recent_avg > 0.3:
+        return "最近の傾向は前向きです。返答は少し明るめに。"
+    elif recent_avg < -0.3:
+        return "最近の傾向は落ち込み気味です。返答は少し優しめに。"
+    else:
+        return ""
 
-def load_messages(path=MEMORY_PATH):
-    if not os.path.exists(path):
-        return []
-    try:
-        with open(path, encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"🛑 メモリ読み込みエラー: {e}")
-        return []
+# ===== トークンストリーム→文分割 =====
+def iter_sentences(deltas, delims: str = SENTENCE_DELIMS):
+    """
+    テキスト断片のイテラブルを受け取り、句点（。！？）で区切った文を順に返す。
+    「！？」や閉じ括弧など句点に続く文字は同じ文に含める。
+    """
+    buf = ""
+    for delta in deltas:
+        ready, buf = split_ready_sentences(buf + delta, delims)
+        yield from ready
+    rest = buf.strip()
+    if rest:
+        yield rest
+
+def split_ready_sentences(buf: str, delims: str = SENTENCE_DELIMS):
+    """確定した文のリストと、まだ続きを待つ残りを返す"""
+    ready = []
+    while True:
+        cut = _find_sentence_end(buf, delims)
+        if cut < 0:
+            return ready, buf
+        sentence, buf = buf[:cut].strip(), buf[cut:]
+        if sentence:
+            ready.append(sentence)
+
+def _find_sentence_end(buf: str, delims: str) -> int:
+    # 句点の後に続く文字が来るまで確定しない（「！」の直後に「？」が来る場合など）
+    for i, ch in enumerate(buf):
+        if ch in delims:
+            j = i + 1
+            while j < len(buf) and buf[j] in SENTENCE_TRAIL:
+                j += 1
+            return j if j < len(buf) else -1
+    return -1
+
+def _segment_path(out_path: str, index: int) -> str:
+    root, ext = os.path.splitext(out_path)
+    return f"{root}_{index:02d}{ext or '.wav'}"
+
+def spoken_text(parts) -> str:
+    """
+    parts: [(文, Segment), ...]（再生に積んだ順）。実際に鳴ったところまでの文字列を返す。
+    途中で止まっていれば、鳴った割合で切り詰めて INTERRUPT_MARK を付ける。
+    """
+    out = []
+    for text, seg in parts:
+        frac = seg.played_fraction
+        if frac >= 1.0:
+            out.append(text)
+            continue
+        out.append(text[:int(len(text) * frac)])
+        return "".join(out) + INTERRUPT_MARK
+    return "".join(out)
 
 # ===== VOICEVOX TTS（クエリJSONも返す） =====
-def voicevox_tts(port: int, text: str, style_id: int, out_path: str):
-    query = requests.post(
-        f"http://127.0.0.1:{port}/audio_query",
-        params={"text": text, "speaker": style_id},
-        timeout=10
-    )
-    query.raise_for_status()
-    synthesis = requests.post(
-        f"http://127.0.0.1:{port}/synthesis",
-        params={"speaker": style_id},
-        headers={"Content-Type": "application/json"},
-        data=query.text,
-        timeout=15
-    )
-    synthesis.raise_for_status()
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "wb") as f:
-        f.write(synthesis.content)
-    return out_path, query.text
+def voicevox_clip(port: int, text: str, style_id: int, query_params=None, archive_path=None):
+    """
+    ディスクを経由せずに合成する。返り値: (AudioClip, audio_query_json)
+    archive_path を渡すとデバッグ/保存用にWAVも書き出す。
+    """
+    wav_bytes, aq_text = get_voicevox_client(port).tts(text, style_id, query_params)
+    clip = AudioClip.from_wav_bytes(wav_bytes)
+    if archive_path:
+        clip.save(archive_path)
+    return clip, aq_text
 
 # ===== 母音タイムラインの構築（audio_query） =====
 def build_vowel_timeline(aq_text: str):
@@ -270,231 +239,547 @@ def build_motion_cues(text: str, emotion: str, total_duration: float):
             last = t
     return compact
 
-# ===== RMS + 母音タイムラインで送信（再生同期・確実クローズ） =====
-def _run_vts_lipsync_thread(vts: VTSLipsync, wav_path: str, aq_json: str,
-                            start_event: threading.Event, stop_event: threading.Event):
-    import traceback
-    try:
-        vts.connect()
-        vts.send_vowel("x", 0.0)  # 初期閉口
-
-        timeline = build_vowel_timeline(aq_json)
-        seg_idx = 0
-
-        # 再生開始を待ってオフセット補正
-        start_event.wait()
-        time.sleep(OFFSET_MS / 1000.0)
-
-        with sf.SoundFile(wav_path, mode="r") as f:
-            sr = int(f.samplerate or 24000)
-            hop = max(1, sr // TARGET_FPS)
-
-            ref = 0.02
-            smooth = 0.0
-            frames_read = 0
-
-            t0 = time.perf_counter()
-            n = 0
-            while not stop_event.is_set():
-                target = t0 + n / TARGET_FPS
-                now = time.perf_counter()
-                if target > now:
-                    time.sleep(target - now)
-
-                data = f.read(hop, dtype="float32", always_2d=True)
-                if data.size == 0:
-                    break
-                frames_read += data.shape[0]
-                t_sec = frames_read / sr
-
-                mono = data.mean(axis=1)
-                peak = float(np.max(np.abs(mono))) if mono.size else 0.0
-
-                ref = max(ref * 0.995, peak * 0.7, 0.02)
-                x = min(peak / ref, 1.5)
-                x = x ** 0.5
-                if x < NOISE_GATE:
-                    x = 0.0
-
-                while seg_idx+1 < len(timeline) and t_sec >= timeline[seg_idx][1]:
-                    seg_idx += 1
-                tag = timeline[seg_idx][2] if timeline else "a"
-
-                if tag in {"cl","pau"}:
-                    x = 0.0
-
-                alpha = ATTACK if x > smooth else RELEASE
-                smooth = (1 - alpha) * smooth + alpha * x
-                amp = max(0.0, min(smooth, 1.0))
-
-                vts.send_vowel(tag if tag in {"a","i","u","e","o"} else "x", amp)
-                n += 1
-
-        vts.send_vowel("x", 0.0)
-
-    except Exception as e:
-        print("🛑 VTSリップシンクスレッドエラー:", e)
+# ===== 口パクトラックの事前計算（NumPy） =====
+def timeline_arrays(timeline):
+    """
+    build_vowel_timeline の結果を配列化する。
+    返り値: (ends, tags)  ends: float64[n] 各区間の終了秒 / tags: str[n]
+    """
+    if not timeline:
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype="<U3")
+    ends = np.fromiter((seg[1] for seg in timeline), dtype=np.float64, count=len(timeline))
+    tags = np.array([seg[2] for seg in timeline], dtype="<U3")
+    return ends, tags
+
+def _smooth_attack_release(x: np.ndarray, attack: float = ATTACK, release: float = RELEASE) -> np.ndarray:
+    # 開閉で係数が変わる再帰フィルタ。1発話につき一度だけ回す
+    out = np.empty(len(x), dtype=np.float64)
+    smooth = 0.0
+    for i, v in enumerate(x.tolist()):
+        alpha = attack if v > smooth else release
+        smooth = (1 - alpha) * smooth + alpha * v
+        out[i] = smooth
+    return out
+
+def compute_lipsync_track(samples: np.ndarray, sr: int, timeline, fps: int = TARGET_FPS):
+    """
+    音声全体から口パク用トラックを先に計算する。
+    samples: (フレーム数,) または (フレーム数, ch)。float は -1..1、int16 などの整数PCMはそのまま渡してよい
+    返り値: (t, amp, vowel)  t: 各フレームの音声内時刻[秒] / amp: 0..1 / vowel: 'a'|'i'|'u'|'e'|'o'|'x'
+    """
+    mono = samples.mean(axis=1) if samples.ndim == 2 else samples
+    mono = np.asarray(mono, dtype=np.float32)
+    if samples.dtype.kind == "i":
+        mono /= float(np.iinfo(samples.dtype).max + 1)
+    hop = max(1, sr // fps)
+    n = -(-len(mono) // hop)
+    if n == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype="<U1")
+
+    # フレームごとのピーク（末尾はゼロ詰め：|x|の最大値には影響しない）
+    padded = np.zeros(n * hop, dtype=np.float32)
+    padded[:len(mono)] = mono
+    peak = np.abs(padded.reshape(n, hop)).max(axis=1).astype(np.float64)
+    t = np.minimum(np.arange(1, n + 1) * hop, len(mono)) / sr
+
+    # 適応リファレンス ref[k] = max(ref[k-1]*0.995, peak*0.7, 0.02) を対数領域の累積maxで解く
+    k = np.arange(n)
+    decay = np.log(0.995)
+    floor = np.maximum(peak * 0.7, 0.02)
+    ref = np.exp(np.maximum.accumulate(np.log(floor) - k * decay) + k * decay)
+
+    x = np.sqrt(np.minimum(peak / ref, 1.5))
+    x[x < NOISE_GATE] = 0.0
+
+    closed, vowel = _frame_vowels(t, timeline)
+    x[closed] = 0.0
+
+    amp = np.clip(_smooth_attack_release(x), 0.0, 1.0)
+    return t, amp, vowel
+
+def _frame_vowels(t: np.ndarray, timeline):
+    """各フレーム時刻の (閉口区間か, 母音)。timeline が空なら閉口なし・全部 'a'"""
+    ends, tags = timeline_arrays(timeline)
+    if not len(tags):
+        return np.zeros(len(t), dtype=bool), np.full(len(t), "a", dtype="<U1")
+    idx = np.minimum(np.searchsorted(ends, t, side="right"), len(tags) - 1)
+    tag = tags[idx]
+    vowel = np.where(np.isin(tag, ("a", "i", "u", "e", "o")), tag, "x")
+    return (tag == "cl") | (tag == "pau"), vowel
+
+def estimate_performance(text, emotion, timeline, duration: float, fps: int = TARGET_FPS):
+    """
+    音声を解析せずに作る演技。返り値: (amps, vowels, cues)（prepare_performance と同じ形）
+    timeline は合成と並行して作っておいた estimate_vowel_timeline の結果で、duration（実際の音声長）に伸縮する。
+    口の開きは母音区間で ESTIMATE_AMP の一定値。音声を解析した結果が出るまでのつなぎに使う。
+    """
+    total = timeline[-1][1] if timeline else 0.0
+    if total > 0 and duration > 0:
+        k = duration / total
+        timeline = [(start * k, end * k, tag) for start, end, tag in timeline]
+    t = np.arange(1, int(np.ceil(duration * fps)) + 1) / fps
+    closed, vowel = _frame_vowels(t, timeline)
+    x = np.where(closed, 0.0, ESTIMATE_AMP) if timeline else np.zeros(len(t))
+    amp = np.clip(_smooth_attack_release(x), 0.0, 1.0)
+    return amp.tolist(), vowel.tolist(), build_motion_cues(text, emotion, duration)
+
+# ===== 口パク＋モーションを1本の時計に載せる =====
+def prepare_performance(text, clip: AudioClip, aq_json, emotion):
+    """
+    再生前に必要なものを全部計算する。返り値: (amps, vowels, cues)
+    aq_json が無い・壊れているときはテキストから母音タイムラインを見積もる（音声長に合わせて伸縮）。
+    """
+    timeline = None
+    if aq_json:
         try:
-            vts.send_vowel("x", 0.0)
-        except Exception:
-            pass
+            timeline = build_vowel_timeline(aq_json)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"🛑 audio_query解析エラー（テキストから見積もります）: {e}")
+    if not timeline:
+        timeline = estimate_vowel_timeline(text, clip.duration)
+    _, amps, vowels = compute_lipsync_track(clip.pcm, clip.sample_rate, timeline)
+    total_dur = timeline[-1][1] if timeline else clip.duration
+    cues = build_motion_cues(text, emotion, total_dur)
+    return amps.tolist(), vowels.tolist(), cues
+
+def lip_events(lip: VTSLipsync, amps, vowels, close_mouth=True):
+    """口パクのキューを [(秒, fn, args)] で返す（schedule_performance と、見積もりからの差し替え用）"""
+    # 口パクは OFFSET_MS だけ遅らせる（再生と口のズレ補正）。古いフレームは間引いてよい
+    # 変化の小さいフレームは積まない（閉口中・開きが一定の区間はキーフレームだけ送る）
+    lip_offset = OFFSET_MS / 1000.0
+    frames = [vowel_amp_form(vowel, amp) for vowel, amp in zip(vowels, amps)]
+    times = [n / TARGET_FPS for n in range(len(frames))]
+    events = [(lip_offset + times[n], lip.send_frame, frames[n])
+              for n in select_keyframes(times, [a for a, _ in frames], [f for _, f in frames])]
+    if close_mouth:  # 続けて次の文が鳴る場合は閉じない（文の継ぎ目で口が一瞬閉じるのを防ぐ）
+        events.append((lip_offset + len(amps) / TARGET_FPS, lip.send_vowel, ("x", 0.0)))
+    return events
+
+def schedule_performance(sched: CueScheduler, lip: VTSLipsync, session, amps, vowels, cues, close_mouth=True):
+    for t, fn, args in lip_events(lip, amps, vowels, close_mouth):
+        sched.schedule(t, fn, *args, key="lip")
+    for t, hotkey in cues:
+        sched.schedule(t, session.post_hotkey, hotkey)
+
+def _observe_ttfa(parts, t0, kind):
+    # ターン開始から最初の音が鳴るまで（鳴らなかったターンは数えない）
+    if parts and parts[0][1].start_time is not None and not parts[0][1].cancelled:
+        trace.observe("ttfa", parts[0][1].start_time - t0, kind=kind)
 
 # ===== 会話エージェント =====
 class SoraEmotionAgent:
-    def __init__(self, api_key, speaker_id, log_path, output_path, port):
+    def __init__(self, api_key, speaker_id, log_path, output_path, port, memory_dir=None):
+        """
+        memory_dir: 会話ジャーナル・要約・長期記憶の置き場所（既定は MEMORY_PATH のあるフォルダ）。
+        サーバーモードではセッションごとに分ける。
+        """
         self.client = OpenAI(api_key=api_key)
         self.speaker_id = speaker_id
         self.log_path = log_path
         self.output_path = output_path
         self.port = port
-        self.messages = load_messages()
-        if not self.messages:
-            self.messages = [get_initial_persona(get_recent_emotion_note())]
         self.last_input_time = time.time()
         self.auto_talk_interval = 600
         self.max_history = 50
+        self.stream_reply = STREAM_REPLY
+        # 会話の版（_record ごとに進む）。自動発話の先読みが今の会話に合っているかの判定に使う
+        self.conv_version = 0
+        self.prefetch = AutoTalkPrefetcher(self)
+        # 進行中のターン（スレッド）と、その中断フラグ
+        self._turn = None
+        self._turn_cancel = threading.Event()
+        self._turn_lock = threading.Lock()
+        # 全履歴は追記ジャーナルに残し、メモリ上は trim_messages の窓だけ持つ
+        if memory_dir is None:
+            self.journal = MessageJournal(os.path.dirname(MEMORY_PATH), legacy_path=MEMORY_PATH)
+            self.memory = LongTermMemory()
+        else:
+            self.journal = MessageJournal(memory_dir)
+            self.memory = LongTermMemory(os.path.join(memory_dir, "memory"))
+        # 窓はトークン予算で決め、あふれた発言は要約に畳み込む
+        self.context = ContextWindow(
+            summarize=openai_summarizer(self.client),
+            summary_path=os.path.join(self.journal.root, "context_summary.json"),
+        )
+        self.messages = self.journal.load()
+        # 窓から外れた過去の往復も引けるように、全履歴のベクトル索引を持つ（空なら全履歴から作る）
+        threading.Thread(target=self.memory.backfill, args=(self.journal.iter_history(),),
+                         name="MemoryBackfill", daemon=True).start()
+        if not self.messages:
+            self.messages = []
+            self._record(get_initial_persona(get_recent_emotion_note(log_path)))
+        if self.trim_messages():
+            self.journal.snapshot(self.messages)
 
     def trim_messages(self):
-        if len(self.messages) > self.max_history:
-            self.messages = [self.messages[0]] + self.messages[-(self.max_history - 1):]
+        """予算からあふれた発言を要約に回す。返り値: 外した発言"""
+        self.messages, evicted = self.context.fit(self.messages, max_messages=self.max_history)
+        self.context.fold(evicted)
+        return evicted
+
+    def prompt_messages(self):
+        """ChatGPT に送る会話（システムプロンプト＋要約＋関連する過去の往復＋予算内の直近の発言）"""
+        query = next((m.get("content") or "" for m in reversed(self.messages) if m.get("role") == "user"), "")
+        hits = self.memory.search(query, exclude={m.get("content") for m in self.messages})
+        recall = recall_message(hits)
+        return self.context.prompt(self.messages, extra=[recall] if recall else None)
+
+    def _record(self, message):
+        self.conv_version += 1
+        prev = self.messages[-1] if self.messages else None
+        if message.get("role") == "assistant" and prev and prev.get("role") == "user":
+            self.memory.add(prev.get("content") or "", message.get("content") or "")
+        self.messages.append(message)
+        evicted = self.trim_messages()
+        # 外した発言は要約に回したので、次回起動時に読み直さないようスナップショットも進める
+        self.journal.append(message, window=self.messages, snapshot=bool(evicted))
+
+    def _record_interrupted(self, parts):
+        """割り込まれた応答を話せたところまで記録する（まだ何も再生に積んでいなければ記録しない）"""
+        if parts:
+            self._record({"role": "assistant", "content": spoken_text(parts)})
 
     def classify_emotion(self, text):
-        return classify_emotion(text)
+        return get_emotion_service().classify(text)
 
     def save_log(self, text, emotion):
         now = datetime.now()
         os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        trend = get_trend_index(self.log_path)  # 追記前に読み込む（新しい行を作り直しで二重に数えない）
         with open(self.log_path, mode='a', encoding='utf-8', newline='') as f:
             csv.writer(f, quoting=csv.QUOTE_ALL).writerow(
                 [now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), text, emotion]
             )
+        trend.add(emotion)
 
     # --- ChatGPT API応答生成 ---
     def _chat(self, messages):
-        try:
-            # openai>=1.x
-            return self.client.chat_completions.create(
-                model="gpt-4o",
-                messages=messages,
-                temperature=0.9,
-                max_tokens=150
-            )
-        except AttributeError:
-            # 旧SDK
-            return self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                temperature=0.9,
-                max_tokens=150
-            )
+        with trace.span("chat", kind="complete", messages=len(messages)):
+            try:
+                # openai>=1.x
+                return self.client.chat_completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    temperature=0.9,
+                    max_tokens=150
+                )
+            except AttributeError:
+                # 旧SDK
+                return self.client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    temperature=0.9,
+                    max_tokens=150
+                )
+
+    # --- ChatGPT API応答生成（ストリーミング：テキスト断片を順に返す） ---
+    def _chat_stream(self, messages):
+        kwargs = dict(model="gpt-4o", messages=messages, temperature=0.9, max_tokens=150, stream=True)
+        t0 = time.perf_counter()
+        first = True
+        with trace.span("chat", kind="stream", messages=len(messages)):
+            try:
+                stream = self.client.chat_completions.create(**kwargs)
+            except AttributeError:
+                stream = self.client.chat.completions.create(**kwargs)
+            for chunk in stream:
+                try:
+                    delta = chunk.choices[0].delta.content
+                except Exception:
+                    delta = None
+                if delta:
+                    if first:
+                        trace.observe("chat_first_token", time.perf_counter() - t0, kind="stream")
+                        first = False
+                    yield delta
 
     # --- TTS & 再生 & VTS口パク + モーション ---
-    def speak(self, text, style_id=None):
+    def speak(self, text, style_id=None, emotion=None, parts=None):
         if style_id is None:
             style_id = self.speaker_id
         try:
-            wav_path, aq_json = voicevox_tts(self.port, text, style_id, self.output_path)
-
-            # 口パクスレッド
-            vts_lip = VTSLipsync(
-                preferred_inputs=["SoraMouthProxy", "MouthOpen", "PlusMouthOpen", "VoiceVolume"],
-                preferred_form_inputs=["SoraMouthFormProxy", "MouthForm", "MouthShape"],
-            )
-            start = threading.Event()
-            stop  = threading.Event()
-            th_lip = threading.Thread(
-                target=_run_vts_lipsync_thread,
-                args=(vts_lip, wav_path, aq_json, start, stop),
-                daemon=True
-            )
-            th_lip.start()
-
-            # モーションスレッド
-            # 総時間推定
-            tl = build_vowel_timeline(aq_json)
-            total_dur = (tl[-1][1] if tl else 0.0)
-            cues = build_motion_cues(text, self.classify_emotion(text), total_dur)
-
-            def _motion_thread(start_evt, stop_evt, cues_list):
-                vm = VTSMotionClient()
-                try:
-                    vm.connect()
-                    start_evt.wait()
-                    t0 = time.perf_counter()
-                    i = 0
-                    while not stop_evt.is_set() and i < len(cues_list):
-                        now = time.perf_counter() - t0
-                        t_target, hotkey = cues_list[i]
-                        if now + 0.01 >= t_target:
-                            vm.trigger_hotkey(hotkey)
-                            i += 1
-                        else:
-                            time.sleep(0.01)
-                finally:
-                    vm.close()
-
-            th_motion = threading.Thread(
-                target=_motion_thread,
-                args=(start, stop, cues),
-                daemon=True
-            )
-            th_motion.start()
-
-            # 再生開始
-            wave_obj = sa.WaveObject.from_wave_file(wav_path)
-            play = wave_obj.play()
-            start.set()
-            play.wait_done()
-
-            # 終了処理
-            stop.set()
-            th_lip.join()
-            th_motion.join()
-            vts_lip.close()
-
+            clip, aq_json = voicevox_clip(self.port, text, style_id,
+                                          archive_path=self.output_path if SAVE_WAV else None)
+            self._perform(text, clip, aq_json, emotion, parts=parts)
         except Exception as e:
             print(f"🛑 VOICEVOX/VTSエラー: {e}")
 
+    # --- 合成済み音声の再生＋口パク＋モーション ---
+    def _perform(self, text, clip, aq_json, emotion=None, wait=True, parts=None, performance=None, estimate=None):
+        """
+        音声を出力エンジンに積み、その区間が実際に鳴り始めた時刻を原点に口パク/モーションを流す。
+        wait=False なら積んだ時点で戻る（続く文を隙間なく積めるように）。返り値はキュー実行スレッド。
+        parts を渡すと (text, Segment) を追記する（割り込み時にどこまで話したかを求める用）。
+        performance: 計算済みの prepare_performance の結果（先読み済みの自動発話など）
+        estimate: 合成と並行して作った estimate_vowel_timeline の結果。あれば見積もりの演技ですぐ積み、
+                  音声の解析が終わったら口パクだけ差し替える（解析を再生開始の前に待たない）
+        """
+        refine = False
+        if performance is None:
+            if emotion is None:
+                emotion = self.classify_emotion(text)
+            if estimate is not None:
+                performance = estimate_performance(text, emotion, estimate, clip.duration)
+                refine = True
+            else:
+                performance = prepare_performance(text, clip, aq_json, emotion)
+        amps, vowels, cues = performance
+
+        vts_lip = VTSLipsync(preferred_inputs=LIP_AMP_INPUTS, preferred_form_inputs=LIP_FORM_INPUTS)
+        try:
+            vts_lip.connect()
+            vts_lip.send_vowel("x", 0.0)  # 初期閉口
+        except Exception as e:
+            print(f"🛑 VTS接続エラー: {e}")
+            trace.event("vts_connect_failed", error=repr(e))
+
+        # 口パクとモーションを同じ時計（区間の再生開始が原点）で発火する
+        sched = CueScheduler()
+        schedule_performance(sched, vts_lip, get_vts_session(), amps, vowels, cues, close_mouth=wait)
+        t_enqueue = time.perf_counter()
+        seg = get_audio_output(clip.sample_rate, clip.channels).enqueue(clip.pcm)
+        seg.on_cancel(sched.stop)
+        if parts is not None:
+            parts.append((text, seg))
+
+        def _refine():
+            try:
+                with trace.span("lipsync_refine"):
+                    amps, vowels, _ = prepare_performance(text, clip, aq_json, emotion)
+                sched.replace("lip", lip_events(vts_lip, amps, vowels, close_mouth=wait))
+            except Exception as e:
+                print(f"🛑 口パク解析エラー（見積もりのまま続けます）: {e}")
+
+        if refine:
+            threading.Thread(target=_refine, name="LipsyncRefine", daemon=True).start()
+
+        def _run_cues():
+            seg.started.wait()
+            if seg.cancelled:
+                return
+            trace.observe("playback_start", seg.start_time - t_enqueue)
+            sched.anchor(seg.start_time)
+            sched.run()
+            sched.report("perform")
+
+        th_cue = threading.Thread(target=_run_cues, name="CueScheduler", daemon=True)
+        th_cue.start()
+        if wait:
+            seg.done.wait()
+            th_cue.join()
+            vts_lip.close()
+        return th_cue
+
     # --- ユーザー入力→応答→発話 ---
-    def generate_and_speak(self, user_input=None):
+    def generate_and_speak(self, user_input=None, cancel=None, prepared=None):
+        """
+        cancel: 割り込み用の threading.Event。立ったら合成・再生をやめ、
+        話せたところまでを INTERRUPT_MARK 付きで履歴に残す（応答生成中なら応答は捨てる）。
+        prepared: 先読み済みの自動発話（PreparedTalk）。あれば生成・合成を飛ばしてすぐ再生する。
+        """
+        cancel = cancel or threading.Event()
+        t0 = time.perf_counter()
         if user_input:
-            self.messages.append({"role": "user", "content": user_input})
-            self.trim_messages()
-        resp = self._chat(self.messages)
-        try:
-            reply = resp.choices[0].message.content.strip()
-        except Exception:
-            reply = resp.choices[0].message["content"].strip()
+            self._record({"role": "user", "content": user_input})
+        if prepared is not None:
+            reply, emotion = prepared.reply, prepared.emotion
+        elif self.stream_reply:
+            self._generate_and_speak_stream(cancel, t0)
+            return
+        else:
+            resp = self._chat(self.prompt_messages())
+            try:
+                reply = resp.choices[0].message.content.strip()
+            except Exception:
+                reply = resp.choices[0].message["content"].strip()
+            if cancel.is_set():
+                return
+            emotion = self.classify_emotion(reply)
 
-        self.messages.append({"role": "assistant", "content": reply})
-        self.trim_messages()
         print(f"🗣 ソラ：{reply}")
 
-        emotion = self.classify_emotion(reply)
         self.save_log(reply, emotion)
         style_id = style_map.get(emotion, self.speaker_id)
 
-        self.speak(reply, style_id=style_id)
-        save_messages(self.messages)
+        parts = []
+        if cancel.is_set():
+            pass
+        elif prepared is not None:
+            try:
+                self._perform(reply, prepared.clip, prepared.aq_json, emotion,
+                              parts=parts, performance=prepared.performance)
+            except Exception as e:
+                print(f"🛑 VOICEVOX/VTSエラー: {e}")
+        else:
+            self.speak(reply, style_id=style_id, emotion=emotion, parts=parts)
+        _observe_ttfa(parts, t0, "prepared" if prepared is not None else "complete")
+        # 再生後に記録する（割り込まれたら話せたところまで）
+        if cancel.is_set():
+            self._record_interrupted(parts)
+        else:
+            self._record({"role": "assistant", "content": reply})
+
+    # --- ストリーミング：生成→文分割→合成→再生を並行させる ---
+    def _generate_and_speak_stream(self, cancel, t0=None):
+        text_q = queue.Queue()
+        seg_q  = queue.Queue()
+        parts = []
+
+        def _synth_worker():
+            # 合成は VoicevoxClient のプールで同時に走らせ、再生側は投入順に結果を待つ
+            client = get_voicevox_client(self.port)
+            style_id = None
+            i = 0
+            while True:
+                sentence = text_q.get()
+                if sentence is None:
+                    break
+                if cancel.is_set():
+                    continue
+                # 声色は最初の文で決めて応答全体で固定する
+                emotion = self.classify_emotion(sentence)
+                if style_id is None:
+                    style_id = style_map.get(emotion, self.speaker_id)
+                fut = client.submit(sentence, style_id)
+                # 合成を待つ間にテキストから母音タイムラインを見積もっておく（口パクを解析待ちにしない）
+                seg_q.put((sentence, fut, emotion, i, estimate_vowel_timeline(sentence)))
+                i += 1
+            seg_q.put(None)
+
+        def _play_worker():
+            # 合成できた文から出力エンジンへ積む。前の文が鳴っている間に次が積まれるので継ぎ目が空かない
+            cue_threads = []
+            while True:
+                item = seg_q.get()
+                if item is None:
+                    break
+                sentence, fut, emotion, i, estimate = item
+                if cancel.is_set():
+                    fut.cancel()
+                    continue
+                try:
+                    wav_bytes, aq_json = fut.result()
+                    clip = AudioClip.from_wav_bytes(wav_bytes)
+                    if SAVE_WAV:
+                        clip.save(_segment_path(self.output_path, i))
+                    if not cancel.is_set():
+                        cue_threads.append(self._perform(sentence, clip, aq_json, emotion,
+                                                         wait=False, parts=parts, estimate=estimate))
+                except Exception as e:
+                    print(f"🛑 VOICEVOX/再生エラー: {e}")
+            for th in cue_threads:
+                th.join()
+            # 割り込まれていない場合は最後の文まで鳴り終えてから記録する
+            for _, seg in parts:
+                seg.done.wait()
+            VTSLipsync(preferred_inputs=LIP_AMP_INPUTS, preferred_form_inputs=LIP_FORM_INPUTS).close()
+
+        th_synth = threading.Thread(target=_synth_worker, daemon=True)
+        th_play  = threading.Thread(target=_play_worker, daemon=True)
+        th_synth.start()
+        th_play.start()
+
+        sentences = []
+        try:
+            for sentence in iter_sentences(self._chat_stream(self.prompt_messages())):
+                if cancel.is_set():
+                    break  # 生成ストリームを打ち切る
+                print(f"🗣 ソラ：{sentence}")
+                sentences.append(sentence)
+                text_q.put(sentence)
+        finally:
+            text_q.put(None)
+
+        reply = "".join(sentences)
+        if reply:
+            self.save_log(reply, self.classify_emotion(reply))
+
+        th_synth.join()
+        th_play.join()
+        if t0 is not None:
+            _observe_ttfa(parts, t0, "stream")
+        if cancel.is_set():
+            self._record_interrupted(parts)
+        elif sentences:
+            self._record({"role": "assistant", "content": reply})
+
+    # --- 割り込み ---
+    def interrupt(self):
+        """進行中のターンを止める：生成・合成を打ち切り、再生を止める（口は各ターンの終了処理で閉じる）"""
+        turn = self._turn
+        if turn is None or not turn.is_alive():
+            return
+        print("ℹ️ 割り込み：発話を中断します")
+        self._turn_cancel.set()
+        cancel_audio_output()
+
+    def _start_turn(self, user_input, prepared=None):
+        """進行中のターンがあれば割り込んで止め、新しいターンをスレッドで始める"""
+        with self._turn_lock:
+            self.interrupt()
+            if self._turn is not None:
+                self._turn.join()  # 中断分の記録を済ませてから次の入力を記録する
+            self._turn_cancel = threading.Event()
+            self._turn = threading.Thread(target=self.generate_and_speak,
+                                          args=(user_input, self._turn_cancel, prepared), daemon=True)
+            self._turn.start()
+            return self._turn
+
+    # --- 自動発話 ---
+    def prepare_auto_talk(self, version):
+        """
+        自動発話を先に作っておく（生成→感情→合成→口パク/モーション計算）。履歴には記録しない。
+        """
+        messages = self.prompt_messages() + [{"role": "user", "content": AUTO_TALK_PROMPT}]
+        resp = self._chat(messages)
+        try:
+            reply = resp.choices[0].message.content.strip()
+        except Exception:
+            reply = resp.choices[0].message["content"].strip()
+        emotion = self.classify_emotion(reply)
+        style_id = style_map.get(emotion, self.speaker_id)
+        clip, aq_json = voicevox_clip(self.port, reply, style_id)
+        performance = prepare_performance(reply, clip, aq_json, emotion)
+        return PreparedTalk(version, reply, emotion, style_id, clip, aq_json, performance)
 
     def auto_talker(self):
         while True:
-            if time.time() - self.last_input_time > self.auto_talk_interval:
+            idle = time.time() - self.last_input_time
+            if idle > self.auto_talk_interval:
                 print("🕐 自動発話タイミング")
-                self.generate_and_speak("何か話しかけてください")
+                self._start_turn(AUTO_TALK_PROMPT, prepared=self.prefetch.take()).join()
                 self.last_input_time = time.time()
+            elif idle > self.auto_talk_interval - self.prefetch.lead and not self._turn_busy():
+                self.prefetch.start()  # 無言の間に次の自動発話を用意しておく
             time.sleep(5)
 
+    def _turn_busy(self):
+        return self._turn is not None and self._turn.is_alive()
+
+    def run_async(self):
+        """asyncio 実行系（sora_runtime）で動かす"""
+        import sora_runtime
+        sora_runtime.run(self)
+
     def run(self):
         print("🟢 ソラAI会話 起動中（終了するには exit）")
+        trace.start()
+        warmup_emotion_model(background=True)  # 入力待ちの間にモデルを読み込む
         threading.Thread(target=self.auto_talker, daemon=True).start()
+        # 発話中も入力を受け付け、入力があれば話している途中でも次のターンへ移る
         while True:
             user_input = input("👤 ご主人様：")
             if user_input.strip().lower() in {"exit", "quit"}:
                 print("🟡 会話終了します。")
+                self.interrupt()
+                shutdown_vts_session()
+                shutdown_audio_output()
+                self.memory.close()
+                self.journal.close()
+                trace.shutdown()
                 break
             self.last_input_time = time.time()
-            self.generate_and_speak(user_input)
+            self._start_turn(user_input)
 
 if __name__ == "__main__":
     agent = SoraEmotionAgent(
@@ -504,4 +789,8 @@ if __name__ == "__main__":
         output_path=VOICE_OUTPUT_PATH,
         port=VOICEVOX_PORT
     )
-    agent.run()
\ No newline at end of file
+    # SORA_LEGACY_RUNTIME=1 で従来のスレッド版
+    if os.environ.get("SORA_LEGACY_RUNTIME", "0") == "1":
+        agent.run()
+    else:
+        agent.run_async()
\ No newline at end of file
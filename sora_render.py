@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# sora_render.py — 台本（セリフの列）をオフラインで一括レンダリングする
+#   VOICEVOX で合成 → 口パク（build_vowel_timeline＋振幅の平滑化）とモーション（build_motion_cues）を計算し、
+#   1本のWAVと、時刻付きトラック（口の開き/Form・Hotkey）のJSONを書き出す。VTS接続も実時間待ちもしない。
+#   書き出したトラックは track_replay.py で VTS に流す。
+
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import soundfile as sf
+
+from config import VOICEVOX_PORT, DEFAULT_SPEAKER_ID
+from sora_main import OFFSET_MS, TARGET_FPS, style_map, prepare_performance
+from voicevox_client import get_voicevox_client
+from audio_buffer import AudioClip
+from emotion_model import get_emotion_service
+from vts_lipsync import VOWEL_GAIN, VOWEL_FORM
+
+TRACK_VERSION = 1
+GAP_SEC = 0.4  # セリフ間の無音（秒）
+
+def load_script(path: str):
+    """
+    1行1セリフ。空行と # で始まる行は飛ばす。
+    { で始まる行は JSON として読み、{"text": ..., "emotion": ..., "style_id": ...} を指定できる。
+    """
+    items = []
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            items.append(json.loads(line) if line.startswith("{") else {"text": line})
+    return items
+
+def frames_from_performance(amps, vowels):
+    """口パク列（基本の開き＋母音）を、実際に送る (開き, Form) の配列にする（VTSLipsync.send_vowel と同じ変換）"""
+    amps = np.asarray(amps, dtype=np.float64)
+    gain = np.array([VOWEL_GAIN.get((v or "x").lower(), 1.0) for v in vowels])
+    form = np.array([VOWEL_FORM.get((v or "x").lower(), 0.0) for v in vowels])
+    return np.clip(amps * gain, 0.0, 1.0), form
+
+def render(items, out_dir: str, port: int = VOICEVOX_PORT, speaker_id: int = DEFAULT_SPEAKER_ID,
+           gap: float = GAP_SEC, name: str = "render"):
+    """
+    返り値: トラック（dict）。<out_dir>/<name>.wav と <name>.track.json を書く。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    texts = [it["text"] for it in items]
+
+    # 感情は指定が無いものだけまとめて分類（マイクロバッチ）
+    missing = [i for i, it in enumerate(items) if not it.get("emotion")]
+    emotions = [it.get("emotion") for it in items]
+    if missing:
+        for i, label in zip(missing, get_emotion_service().classify_many([texts[i] for i in missing])):
+            emotions[i] = label
+    # style_id=0 も有効な話者なので None のときだけ感情から決める
+    styles = [it.get("style_id") if it.get("style_id") is not None else style_map.get(e, speaker_id)
+              for it, e in zip(items, emotions)]
+
+    # 合成は VOICEVOX の同時数まで並列（TTSキャッシュに当たれば合成しない）
+    results = get_voicevox_client(port).tts_batch(list(zip(texts, styles)))
+
+    lip_offset = OFFSET_MS / 1000.0
+    pcm_parts, lines = [], []
+    frame_t, frame_amp, frame_form, cues = [], [], [], []
+    sr = channels = None
+    cursor = 0.0
+    for text, emotion, style_id, (wav_bytes, aq_json) in zip(texts, emotions, styles, results):
+        clip = AudioClip.from_wav_bytes(wav_bytes)
+        if sr is None:
+            sr, channels = clip.sample_rate, clip.channels
+        elif (clip.sample_rate, clip.channels) != (sr, channels):
+            raise ValueError(f"音声形式がそろっていません: {clip.sample_rate}Hz/{clip.channels}ch")
+        amps, vowels, line_cues = prepare_performance(text, clip, aq_json, emotion)
+        amp, form = frames_from_performance(amps, vowels)
+        n = len(amp)
+        frame_t.append(cursor + lip_offset + np.arange(n + 1) / TARGET_FPS)
+        frame_amp.append(np.append(amp, 0.0))  # 末尾で口を閉じる
+        frame_form.append(np.append(form, 0.0))
+        cues += [[round(cursor + t, 4), hotkey] for t, hotkey in line_cues]
+        lines.append({"text": text, "emotion": emotion, "style_id": style_id,
+                      "start": round(cursor, 4), "end": round(cursor + clip.duration, 4)})
+        pcm_parts.append(clip.pcm)
+        silence = int(round(gap * sr))
+        if silence:
+            pcm_parts.append(np.zeros((silence, channels), dtype=np.int16))
+        cursor += clip.duration + silence / sr
+
+    audio_name = f"{name}.wav"
+    pcm = np.concatenate(pcm_parts) if pcm_parts else np.zeros((0, 1), dtype=np.int16)
+    sf.write(os.path.join(out_dir, audio_name), pcm, sr or 24000, format="WAV", subtype="PCM_16")
+
+    t = np.concatenate(frame_t) if frame_t else np.zeros(0)
+    track = {
+        "version": TRACK_VERSION,
+        "audio": audio_name,
+        "sample_rate": sr,
+        "duration": round(cursor, 4),
+        "fps": TARGET_FPS,
+        "frames": {
+            "t": np.round(t, 4).tolist(),
+            "amp": np.round(np.concatenate(frame_amp), 4).tolist() if frame_amp else [],
+            "form": np.round(np.concatenate(frame_form), 4).tolist() if frame_form else [],
+        },
+        "cues": sorted(cues),
+        "lines": lines,
+    }
+    with open(os.path.join(out_dir, f"{name}.track.json"), "w", encoding="utf-8") as f:
+        json.dump(track, f, ensure_ascii=False)
+    return track
+
+def main():
+    parser = argparse.ArgumentParser(description="ソラ 台本オフラインレンダラ（音声＋口パク/モーショントラック）")
+    parser.add_argument("script", help="台本ファイル（1行1セリフ、または JSON 行）")
+    parser.add_argument("--out", default="render", help="出力フォルダ")
+    parser.add_argument("--name", default=None, help="出力ファイル名（既定: 台本のファイル名）")
+    parser.add_argument("--gap", type=float, default=GAP_SEC, help="セリフ間の無音（秒）")
+    parser.add_argument("--speaker", type=int, default=DEFAULT_SPEAKER_ID, help="既定の話者スタイルID")
+    parser.add_argument("--port", type=int, default=VOICEVOX_PORT, help="VOICEVOX のポート")
+    args = parser.parse_args()
+
+    name = args.name or os.path.splitext(os.path.basename(args.script))[0]
+    try:
+        items = load_script(args.script)
+    except Exception as e:
+        print(f"🛑 台本読み込みエラー: {e}")
+        sys.exit(1)
+    if not items:
+        print("🛑 台本にセリフがありません")
+        sys.exit(1)
+    try:
+        track = render(items, args.out, port=args.port, speaker_id=args.speaker, gap=args.gap, name=name)
+    except Exception as e:
+        print(f"🛑 レンダリングエラー: {e}")
+        sys.exit(2)
+    print(f"🟢 {len(items)}行 / {track['duration']:.1f}秒 → {os.path.join(args.out, name)}.wav / .track.json")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+# sora_runtime.py — SoraEmotionAgent を1本のasyncioループで動かす実行系
+#   チャット/TTS/VTS はループ上、推論・再生・ファイルI/O・標準入力は上限付きExecutorへ逃がす。
+#   口パク・モーションは CueScheduler、自動発話は入力で起こされるタイマー（ポーリングなし）。
+#   発話中も入力を受け付け、新しい入力は進行中のターン（生成・合成・再生）を取り消して割り込む。
+
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import AsyncOpenAI
+
+from sora_main import (
+    LIP_AMP_INPUTS, LIP_FORM_INPUTS, AUTO_TALK_PROMPT, style_map,
+    prepare_performance, estimate_performance, schedule_performance, lip_events,
+    split_ready_sentences, _segment_path, _observe_ttfa,
+)
+from cue_scheduler import CueScheduler
+from kana_timeline import estimate_vowel_timeline
+from voicevox_client import get_voicevox_client
+from audio_buffer import AudioClip, SAVE_WAV
+from audio_output import get_audio_output, cancel_audio_output, shutdown_audio_output
+from emotion_model import warmup as warmup_emotion_model
+from vts_lipsync import VTSLipsync, get_vts_session, shutdown_vts_session
+import sora_trace as trace
+
+async def chat_sentences(aclient, messages):
+    """ストリーミング応答を文単位で返す（サーバーモードと共用）"""
+    t0 = time.perf_counter()
+    first = True
+    with trace.span("chat", kind="stream_async", messages=len(messages)):
+        stream = await aclient.chat.completions.create(
+            model="gpt-4o", messages=messages, temperature=0.9, max_tokens=150, stream=True
+        )
+        buf = ""
+        async for chunk in stream:
+            try:
+                delta = chunk.choices[0].delta.content
+            except Exception:
+                delta = None
+            if delta:
+                if first:
+                    trace.observe("chat_first_token", time.perf_counter() - t0, kind="stream_async")
+                    first = False
+                ready, buf = split_ready_sentences(buf + delta)
+                for sentence in ready:
+                    yield sentence
+        rest = buf.strip()
+        if rest:
+            yield rest
+
+class AsyncSoraRuntime:
+    """
+    SoraEmotionAgent の状態（会話・ログ・設定）はそのまま使い、実行だけを非同期化する。
+    1ターンずつ _turn_lock で直列化し、ストリーミング時は生成・合成・再生の各段を重ねる。
+    ターンはタスクとして走らせ、次の入力が来たら interrupt() で取り消す。
+    """
+    def __init__(self, agent):
+        self.agent = agent
+        self.aclient = AsyncOpenAI(api_key=agent.client.api_key)
+        self.voicevox = get_voicevox_client(agent.port)
+        self._infer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sora-infer")
+        self._play_pool  = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sora-play")
+        self._io_pool    = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sora-io")
+        self._input_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sora-input")
+        self._turn_lock = None
+        self._turn_task = None
+        self._input_seen = None
+        self.loop = None
+        self.vts = None
+
+    def _offload(self, pool, fn, *args):
+        return self.loop.run_in_executor(pool, fn, *args)
+
+    # --- チャット ---
+    async def _chat(self, messages) -> str:
+        with trace.span("chat", kind="complete_async", messages=len(messages)):
+            resp = await self.aclient.chat.completions.create(
+                model="gpt-4o", messages=messages, temperature=0.9, max_tokens=150
+            )
+        return resp.choices[0].message.content.strip()
+
+    def _chat_sentences(self, messages):
+        return chat_sentences(self.aclient, messages)
+
+    async def prompt(self):
+        # 長期記憶の検索（クエリの埋め込み）があるのでループの外で組み立てる
+        return await self._offload(self._infer_pool, self.agent.prompt_messages)
+
+    async def classify(self, text) -> str:
+        return await self._offload(self._infer_pool, self.agent.classify_emotion, text)
+
+    # --- 合成・再生 ---
+    async def synthesize(self, text, style_id, archive_path=None):
+        wav_bytes, aq_json = await self.voicevox.atts(text, style_id)
+        clip = await self._offload(self._io_pool, AudioClip.from_wav_bytes, wav_bytes)
+        if SAVE_WAV and archive_path:
+            await self._offload(self._io_pool, clip.save, archive_path)
+        return clip, aq_json
+
+    async def perform(self, text, clip, aq_json, emotion=None, wait=True, parts=None, performance=None,
+                      estimate=None):
+        """
+        音声を出力エンジンに積む。wait=False なら積んだ時点で戻り、キュー実行タスクを返す。
+        parts を渡すと (text, Segment) を追記する（割り込み時にどこまで話したかを求める用）。
+        performance: 計算済みの prepare_performance の結果（先読み済みの自動発話など）
+        estimate: 合成と並行して作った estimate_vowel_timeline の結果。あれば見積もりの演技ですぐ積み、
+                  音声の解析が終わったら口パクだけ差し替える
+        """
+        refine = False
+        if performance is None:
+            if emotion is None:
+                emotion = await self.classify(text)
+            if estimate is not None:
+                performance = estimate_performance(text, emotion, estimate, clip.duration)
+                refine = True
+            else:
+                performance = await self._offload(
+                    self._io_pool, prepare_performance, text, clip, aq_json, emotion)
+        amps, vowels, cues = performance
+        lip = VTSLipsync(preferred_inputs=LIP_AMP_INPUTS, preferred_form_inputs=LIP_FORM_INPUTS)
+        try:
+            await self.vts.aconnect()
+        except Exception as e:
+            print(f"🛑 VTS接続エラー: {e}")
+            trace.event("vts_connect_failed", error=repr(e))
+
+        # 原点は出力エンジンが返す実際の鳴り始め（perf_counter 基準）なので、スケジューラも同じ時計にする
+        sched = CueScheduler()
+        schedule_performance(sched, lip, self.vts, amps, vowels, cues, close_mouth=wait)
+        t_enqueue = time.perf_counter()
+        seg = await self._offload(
+            self._play_pool, lambda: get_audio_output(clip.sample_rate, clip.channels).enqueue(clip.pcm))
+        seg.on_cancel(sched.stop)
+        if parts is not None:
+            parts.append((text, seg))
+        if refine:
+            asyncio.ensure_future(self._refine_lipsync(sched, lip, text, clip, aq_json, emotion, wait))
+        cue_task = asyncio.ensure_future(self._run_cues(sched, seg, t_enqueue))
+        if not wait:
+            return cue_task
+        try:
+            await cue_task
+            await asyncio.to_thread(seg.done.wait)
+        finally:
+            await self._close_mouth()
+        return cue_task
+
+    async def _refine_lipsync(self, sched, lip, text, clip, aq_json, emotion, close_mouth):
+        # 見積もりで積んだ口パクを、音声を解析した結果に差し替える（モーションはそのまま）
+        try:
+            with trace.span("lipsync_refine"):
+                amps, vowels, _ = await self._offload(
+                    self._io_pool, prepare_performance, text, clip, aq_json, emotion)
+            sched.replace("lip", lip_events(lip, amps, vowels, close_mouth))
+        except Exception as e:
+            print(f"🛑 口パク解析エラー（見積もりのまま続けます）: {e}")
+
+    async def _run_cues(self, sched, seg, t_enqueue):
+        await asyncio.to_thread(seg.started.wait)
+        if seg.cancelled:
+            return
+        trace.observe("playback_start", seg.start_time - t_enqueue)
+        sched.anchor(seg.start_time)
+        try:
+            await sched.arun()
+        finally:
+            sched.report("perform")
+
+    async def _close_mouth(self):
+        try:
+            await self.vts.asend_amp_and_form(0.0, 0.0)
+        except Exception:
+            pass
+
+    async def speak(self, text, style_id=None, emotion=None, parts=None):
+        if style_id is None:
+            style_id = self.agent.speaker_id
+        try:
+            clip, aq_json = await self.synthesize(text, style_id, self.agent.output_path)
+            await self.perform(text, clip, aq_json, emotion, parts=parts)
+        except Exception as e:
+            print(f"🛑 VOICEVOX/VTSエラー: {e}")
+
+    # --- 1ターン ---
+    async def turn(self, user_input=None, prepared=None):
+        """prepared: 先読み済みの自動発話（PreparedTalk）。あれば生成・合成を飛ばしてすぐ再生する"""
+        async with self._turn_lock:
+            agent = self.agent
+            t0 = time.perf_counter()
+            if user_input:
+                agent._record({"role": "user", "content": user_input})
+            if prepared is None and agent.stream_reply:
+                await self._turn_stream(t0)
+                return
+            reply = prepared.reply if prepared is not None else await self._chat(await self.prompt())
+            print(f"🗣 ソラ：{reply}")
+            parts = []
+            try:
+                emotion = prepared.emotion if prepared is not None else await self.classify(reply)
+                await self._offload(self._io_pool, agent.save_log, reply, emotion)
+                if prepared is not None:
+                    await self.perform(reply, prepared.clip, prepared.aq_json, emotion,
+                                       parts=parts, performance=prepared.performance)
+                else:
+                    await self.speak(reply, style_id=style_map.get(emotion, agent.speaker_id),
+                                     emotion=emotion, parts=parts)
+            except asyncio.CancelledError:
+                # 割り込まれた：話せたところまでを記録する
+                _observe_ttfa(parts, t0, "complete")
+                agent._record_interrupted(parts)
+                raise
+            _observe_ttfa(parts, t0, "prepared" if prepared is not None else "complete")
+            agent._record({"role": "assistant", "content": reply})
+
+    async def _turn_stream(self, t0=None):
+        agent = self.agent
+        text_q = asyncio.Queue()
+        parts = []  # 出力エンジンに積んだ (文, Segment)
+        # 合成は文ごとにタスク化して同時に走らせ（上限は VoicevoxClient 側）、再生は順番どおりに待つ
+        seg_q  = asyncio.Queue(maxsize=self.voicevox.max_parallel)
+
+        async def _synth_one(sentence, style_id, emotion, i):
+            # 合成を待つ間にテキストから母音タイムラインを見積もっておく（口パクを解析待ちにしない）
+            estimate = self._offload(self._io_pool, estimate_vowel_timeline, sentence)
+            clip, aq_json = await self.synthesize(sentence, style_id, _segment_path(agent.output_path, i))
+            return sentence, clip, aq_json, emotion, await estimate
+
+        async def _synth_stage():
+            style_id = None
+            i = 0
+            while True:
+                sentence = await text_q.get()
+                if sentence is None:
+                    break
+                emotion = await self.classify(sentence)
+                if style_id is None:
+                    style_id = style_map.get(emotion, agent.speaker_id)
+                await seg_q.put(asyncio.ensure_future(_synth_one(sentence, style_id, emotion, i)))
+                i += 1
+            await seg_q.put(None)
+
+        async def _play_stage():
+            # 合成できた文から順に出力エンジンへ積む（前の文の再生中に次を積むので継ぎ目が空かない）
+            cue_tasks = []
+            pending = None
+            try:
+                while True:
+                    pending = await seg_q.get()
+                    if pending is None:
+                        break
+                    try:
+                        sentence, clip, aq_json, emotion, estimate = await pending
+                        cue_tasks.append(await self.perform(sentence, clip, aq_json, emotion, wait=False,
+                                                            parts=parts, estimate=estimate))
+                    except Exception as e:
+                        print(f"🛑 VOICEVOX/再生エラー: {e}")
+                await asyncio.gather(*cue_tasks, return_exceptions=True)
+                # 最後の文が鳴り終えるまで待ってから口を閉じる
+                for _, seg in parts:
+                    await asyncio.to_thread(seg.done.wait)
+            finally:
+                if pending is not None:
+                    pending.cancel()
+                while not seg_q.empty():
+                    task = seg_q.get_nowait()
+                    if task is not None:
+                        task.cancel()
+                await self._close_mouth()
+
+        stages = [asyncio.ensure_future(_synth_stage()), asyncio.ensure_future(_play_stage())]
+        sentences = []
+        try:
+            try:
+                async for sentence in self._chat_sentences(await self.prompt()):
+                    print(f"🗣 ソラ：{sentence}")
+                    sentences.append(sentence)
+                    await text_q.put(sentence)
+            finally:
+                await text_q.put(None)  # 生成が失敗・取り消しで終わっても合成段を止める
+
+            reply = "".join(sentences)
+            if reply:
+                emotion = await self.classify(reply)
+                await self._offload(self._io_pool, agent.save_log, reply, emotion)
+            await asyncio.gather(*stages)
+        except asyncio.CancelledError:
+            # 割り込まれた：生成ストリームと合成・再生段を止め、話せたところまでを記録する
+            for stage in stages:
+                stage.cancel()
+            if t0 is not None:
+                _observe_ttfa(parts, t0, "stream")
+            agent._record_interrupted(parts)
+            raise
+        except Exception:
+            # 生成・合成の失敗：鳴らしかけの音声と各段を止め（口は再生段が閉じる）、話せたところまでを記録する
+            cancel_audio_output()
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            if t0 is not None:
+                _observe_ttfa(parts, t0, "stream")
+            agent._record_interrupted(parts)
+            raise
+        if t0 is not None:
+            _observe_ttfa(parts, t0, "stream")
+        if reply:
+            agent._record({"role": "assistant", "content": reply})
+
+    # --- 割り込み ---
+    async def interrupt(self):
+        """進行中のターンを取り消す：生成・合成を止め、再生を止めて口を閉じる"""
+        task = self._turn_task
+        if task is None or task.done():
+            return
+        print("ℹ️ 割り込み：発話を中断します")
+        cancel_audio_output()  # 先に止めて、鳴った位置を Segment に残す
+        task.cancel()
+        await asyncio.wait([task])
+        cancel_audio_output()  # 取り消し中に積まれた分も止める
+        await self._close_mouth()
+
+    async def start_turn(self, user_input, prepared=None):
+        """進行中のターンがあれば割り込んでから、新しいターンをタスクとして始める"""
+        await self.interrupt()
+        self._turn_task = asyncio.ensure_future(self.turn(user_input, prepared))
+        return self._turn_task
+
+    # --- 入力と自動発話 ---
+    def _touch(self):
+        self.agent.last_input_time = time.time()
+        self._input_seen.set()
+
+    async def _auto_talker(self):
+        agent = self.agent
+        prefetch = agent.prefetch
+        while True:
+            remaining = agent.last_input_time + agent.auto_talk_interval - time.time()
+            if remaining > 0:
+                # 先読みの開始時刻（期限の lead 秒前）か期限まで眠る。入力があれば起きて計算し直す
+                until_prefetch = remaining - prefetch.lead
+                busy = self._turn_task is not None and not self._turn_task.done()
+                if prefetch.enabled and until_prefetch <= 0 and not busy:
+                    prefetch.start()  # 無言の間に次の自動発話を用意しておく（別スレッド）
+                wake = until_prefetch if prefetch.enabled and until_prefetch > 0 else remaining
+                if busy:
+                    wake = min(wake, 1.0)  # ターンが終わったら先読みを始められるように
+                self._input_seen.clear()
+                try:
+                    await asyncio.wait_for(self._input_seen.wait(), timeout=wake)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            print("🕐 自動発話タイミング")
+            # 入力で割り込まれてもここでは例外にしない（asyncio.wait は取り消しを送出しない）
+            await asyncio.wait([await self.start_turn(AUTO_TALK_PROMPT, prefetch.take())])
+            agent.last_input_time = time.time()
+
+    async def _input_loop(self):
+        while True:
+            user_input = await self._offload(self._input_pool, input, "👤 ご主人様：")
+            if user_input.strip().lower() in {"exit", "quit"}:
+                print("🟡 会話終了します。")
+                await self.interrupt()
+                return
+            self._touch()
+            await self.start_turn(user_input)
+
+    async def start(self):
+        """ループ上の準備（入力ループを回さずに turn() だけ使う呼び出し側、計測ハーネスなどもこれを呼ぶ）"""
+        self.loop = asyncio.get_running_loop()
+        self._turn_lock = asyncio.Lock()
+        self._input_seen = asyncio.Event()
+        # VTSセッションもこのループ上で動かす
+        self.vts = get_vts_session(LIP_AMP_INPUTS, LIP_FORM_INPUTS, loop=self.loop)
+        warmup_emotion_model(background=True)  # 入力待ちの間にモデルを読み込む
+        trace.start()
+
+    async def aclose(self):
+        try:
+            await self.vts.aclose()
+        except Exception:
+            pass
+        shutdown_vts_session()
+        shutdown_audio_output()
+        self.agent.memory.close()
+        self.agent.journal.close()
+        await self.voicevox.aclose()
+        for pool in (self._infer_pool, self._play_pool, self._io_pool):
+            pool.shutdown(wait=False)
+        # input() 待ちのスレッドは終われないので待たない
+        self._input_pool.shutdown(wait=False, cancel_futures=True)
+        trace.shutdown()
+
+    async def main(self):
+        await self.start()
+        print("🟢 ソラAI会話 起動中（終了するには exit）")
+        talker = asyncio.ensure_future(self._auto_talker())
+        try:
+            await self._input_loop()
+        finally:
+            talker.cancel()
+            await self.aclose()
+
+def run(agent):
+    asyncio.run(AsyncSoraRuntime(agent).main())
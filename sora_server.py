@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+# sora_server.py — 複数セッションを1プロセスで受け持つサーバーモード（WebSocket）
+#   ws://<host>:<port>/sessions/<session_id> に {"type": "say", "text": ...} を送ると、
+#   文ごとに sentence → audio（WAV＋口パク列＋モーション）を返し、最後に done を返す。
+#   会話ジャーナル・要約・長期記憶・感情ログはセッションごと、感情分類・埋め込み・VOICEVOX・TTSキャッシュは共有。
+#   合成はセッション間ラウンドロビンで VOICEVOX の同時数に割り当て、1セッションが占有しないようにする。
+
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import websockets
+from openai import AsyncOpenAI
+
+from config import OPENAI_API_KEY, VOICEVOX_PORT, DEFAULT_SPEAKER_ID
+from sora_main import SoraEmotionAgent, OFFSET_MS, TARGET_FPS, INTERRUPT_MARK, style_map, prepare_performance
+from sora_runtime import chat_sentences
+from voicevox_client import get_voicevox_client
+from audio_buffer import AudioClip
+from emotion_model import warmup as warmup_emotion_model
+import sora_trace as trace
+
+SERVER_HOST   = os.environ.get("SORA_SERVER_HOST", "127.0.0.1")
+SERVER_PORT   = int(os.environ.get("SORA_SERVER_PORT", "8765"))
+SESSIONS_DIR  = os.environ.get("SORA_SESSIONS_DIR", "log/sessions")
+MAX_SESSIONS  = int(os.environ.get("SORA_SERVER_MAX_SESSIONS", "64"))
+SESSION_IDLE  = float(os.environ.get("SORA_SERVER_SESSION_IDLE", "600"))  # 接続が無くなってから閉じるまで（秒）
+RATE_PER_MIN  = float(os.environ.get("SORA_SERVER_RATE", "20"))          # セッションごとの発話数/分
+RATE_BURST    = int(os.environ.get("SORA_SERVER_BURST", "5"))
+INFER_WORKERS = int(os.environ.get("SORA_SERVER_INFER_WORKERS", "4"))     # 分類/口パク計算/ファイルI/O用
+
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class RateLimiter:
+    """トークンバケット（rate_per_min で補充、burst まで貯まる）"""
+    def __init__(self, rate_per_min: float = RATE_PER_MIN, burst: int = RATE_BURST):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.t = time.monotonic()
+
+    def acquire(self) -> float:
+        """取れたら 0、取れなければ次に取れるまでの秒数を返す"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+        self.t = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+class FairScheduler:
+    """
+    セッションごとの待ち行列をラウンドロビンで回し、同時実行を slots 件に抑える。
+    run(key, coro_fn, *args) は順番が来たら coro_fn(*args) を実行して結果を返す（呼び出し側が取り消せば捨てる）。
+    """
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        self._queues = OrderedDict()  # key -> deque[(future, coro_fn, args)]
+        self._running = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def run(self, key, coro_fn, *args):
+        fut = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append((fut, coro_fn, args))
+        self._pump()
+        return await fut
+
+    def _next(self):
+        while self._queues:
+            key, q = self._queues.popitem(last=False)
+            while q:
+                job = q.popleft()
+                if not job[0].cancelled():
+                    if q:
+                        self._queues[key] = q  # 残りは列の最後に回す
+                    return job
+        return None
+
+    def _pump(self):
+        while self._running < self.slots:
+            job = self._next()
+            if job is None:
+                return
+            fut, coro_fn, args = job
+            self._running += 1
+            task = asyncio.ensure_future(coro_fn(*args))
+            task.add_done_callback(lambda t, fut=fut: self._done(t, fut))
+
+    def _done(self, task, fut):
+        self._running -= 1
+        if not fut.done():
+            if task.cancelled():
+                fut.cancel()
+            elif task.exception() is not None:
+                fut.set_exception(task.exception())
+            else:
+                fut.set_result(task.result())
+        self._pump()
+
+class ServerSession:
+    """1セッション：専用の SoraEmotionAgent（ジャーナル・要約・長期記憶・感情ログ）＋レート制限"""
+    def __init__(self, session_id: str, root: str = SESSIONS_DIR):
+        self.session_id = session_id
+        self.root = os.path.join(root, session_id)
+        self.agent = SoraEmotionAgent(
+            api_key=OPENAI_API_KEY,
+            speaker_id=DEFAULT_SPEAKER_ID,
+            log_path=os.path.join(self.root, "emotion_log.csv"),
+            output_path=os.path.join(self.root, "voice.wav"),
+            port=VOICEVOX_PORT,
+            memory_dir=self.root,
+        )
+        self.limiter = RateLimiter()
+        self.lock = asyncio.Lock()  # 1セッション内のターンは順番に
+        self.connections = 0
+        self.last_active = time.monotonic()
+
+    def close(self):
+        self.agent.memory.close()
+        self.agent.journal.close()
+
+class SoraServer:
+    def __init__(self, host: str = SERVER_HOST, port: int = SERVER_PORT):
+        self.host = host
+        self.port = port
+        self.aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        self.voicevox = get_voicevox_client(VOICEVOX_PORT)
+        self.synth = FairScheduler(self.voicevox.max_parallel)
+        self.sessions = {}
+        self._opening = {}  # session_id→作成中の Future（同じIDの同時接続は1つの作成を待ち合わせる）
+        self._closing = {}  # session_id→片付け中の Future（閉じ終わるまで同じフォルダを開かない）
+        self._pool = ThreadPoolExecutor(max_workers=INFER_WORKERS, thread_name_prefix="sora-server")
+        self.loop = None
+
+    def _offload(self, fn, *args):
+        return self.loop.run_in_executor(self._pool, fn, *args)
+
+    # --- セッション ---
+    async def open_session(self, session_id: str) -> ServerSession:
+        while session_id not in self.sessions:
+            pending = self._opening.get(session_id)
+            if pending is None:
+                closing = self._closing.get(session_id)
+                if closing is not None:
+                    await asyncio.shield(closing)
+                    continue
+                if len(self.sessions) + len(self._opening) >= MAX_SESSIONS:
+                    raise RuntimeError("too many sessions")
+                # ジャーナル・要約・索引の読み込みがあるのでループの外で作る
+                pending = self._opening[session_id] = self._offload(ServerSession, session_id)
+                pending.add_done_callback(lambda fut, sid=session_id: self._session_opened(sid, fut))
+            await asyncio.shield(pending)
+        session = self.sessions[session_id]
+        session.connections += 1
+        session.last_active = time.monotonic()
+        return session
+
+    def _session_opened(self, session_id: str, fut):
+        # 待っている接続より先に登録する（接続が取り消されても作ったセッションは失わない）
+        del self._opening[session_id]
+        if not fut.cancelled() and fut.exception() is None:
+            self.sessions[session_id] = fut.result()
+
+    async def _janitor(self):
+        # 接続が無いまま SESSION_IDLE 秒たったセッションを閉じる
+        while True:
+            await asyncio.sleep(min(60.0, SESSION_IDLE))
+            now = time.monotonic()
+            for sid, session in list(self.sessions.items()):
+                if session.connections == 0 and now - session.last_active > SESSION_IDLE and not session.lock.locked():
+                    del self.sessions[sid]
+                    closing = self._closing[sid] = self._offload(session.close)
+                    try:
+                        await closing
+                    finally:
+                        del self._closing[sid]
+                    print(f"ℹ️ セッション {sid} を閉じました（無操作）")
+
+    # --- 1ターン ---
+    async def _synthesize(self, text, style_id):
+        wav_bytes, aq_json = await self.voicevox.atts(text, style_id)
+        return wav_bytes, aq_json
+
+    async def _render(self, session, index, sentence, style_id, emotion):
+        wav_bytes, aq_json = await self.synth.run(session.session_id, self._synthesize, sentence, style_id)
+        clip = await self._offload(AudioClip.from_wav_bytes, wav_bytes)
+        amps, vowels, cues = await self._offload(prepare_performance, sentence, clip, aq_json, emotion)
+        return {
+            "type": "audio", "index": index, "text": sentence,
+            "sample_rate": clip.sample_rate, "duration": clip.duration,
+            "wav": base64.b64encode(wav_bytes).decode("ascii"),
+            "lipsync": {"fps": TARGET_FPS, "offset_ms": OFFSET_MS, "amps": amps, "vowels": vowels},
+            "cues": [[t, hotkey] for t, hotkey in cues],
+        }
+
+    async def turn(self, session: ServerSession, ws, text: str):
+        agent = session.agent
+        agent._record({"role": "user", "content": text})
+        messages = await self._offload(agent.prompt_messages)
+        out_q = asyncio.Queue()
+
+        async def _sender():
+            # 合成は並行、送信は文の順番どおり
+            while True:
+                task = await out_q.get()
+                if task is None:
+                    return
+                try:
+                    await ws.send(json.dumps(await task, ensure_ascii=False))
+                except Exception as e:
+                    if isinstance(e, websockets.ConnectionClosed):
+                        raise
+                    await ws.send(json.dumps({"type": "error", "error": f"synthesis failed: {e}"}))
+
+        sender = asyncio.ensure_future(_sender())
+        sentences = []
+        style_id = None
+        try:
+            async for sentence in chat_sentences(self.aclient, messages):
+                emotion = await self._offload(agent.classify_emotion, sentence)
+                if style_id is None:
+                    style_id = style_map.get(emotion, agent.speaker_id)  # 声色は最初の文で決める
+                index = len(sentences)
+                sentences.append(sentence)
+                await ws.send(json.dumps({"type": "sentence", "index": index, "text": sentence,
+                                          "emotion": emotion}, ensure_ascii=False))
+                await out_q.put(asyncio.ensure_future(self._render(session, index, sentence, style_id, emotion)))
+            await out_q.put(None)
+            await sender
+        except BaseException:
+            # 生成失敗・切断・取り消し：送信と積んだ合成を止め、送れたところまでを中断として記録する
+            sender.cancel()
+            pending = [sender]
+            while not out_q.empty():
+                task = out_q.get_nowait()
+                if task is not None:
+                    task.cancel()
+                    pending.append(task)
+            await asyncio.gather(*pending, return_exceptions=True)
+            if sentences:
+                agent._record({"role": "assistant", "content": "".join(sentences) + INTERRUPT_MARK})
+            raise
+        reply = "".join(sentences)
+        if reply:
+            agent._record({"role": "assistant", "content": reply})
+        emotion = await self._offload(agent.classify_emotion, reply) if reply else "neutral"
+        if reply:
+            await self._offload(agent.save_log, reply, emotion)
+        await ws.send(json.dumps({"type": "done", "reply": reply, "emotion": emotion}, ensure_ascii=False))
+
+    # --- 接続 ---
+    async def handler(self, ws):
+        path = getattr(getattr(ws, "request", None), "path", None) or getattr(ws, "path", "/")
+        m = re.match(r"^/sessions/([^/?]+)", path)
+        if not m or not SESSION_ID_RE.match(m.group(1)):
+            await ws.close(code=4404, reason="use /sessions/<session_id>")
+            return
+        try:
+            session = await self.open_session(m.group(1))
+        except RuntimeError as e:
+            await ws.close(code=4429, reason=str(e))
+            return
+        except Exception as e:
+            print(f"🛑 [{m.group(1)}] セッション開始エラー: {e}")
+            await ws.close(code=1011, reason="session init failed")
+            return
+        try:
+            async for raw in ws:
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    await ws.send(json.dumps({"type": "error", "error": "invalid json"}))
+                    continue
+                session.last_active = time.monotonic()
+                if msg.get("type") == "history":
+                    await ws.send(json.dumps({"type": "history", "messages": session.agent.messages[1:]},
+                                             ensure_ascii=False))
+                    continue
+                text = (msg.get("text") or "").strip()
+                if msg.get("type") != "say" or not text:
+                    await ws.send(json.dumps({"type": "error", "error": "expected {type: say, text}"}))
+                    continue
+                retry_after = session.limiter.acquire()
+                if retry_after > 0:
+                    await ws.send(json.dumps({"type": "error", "error": "rate_limited",
+                                              "retry_after": round(retry_after, 2)}))
+                    continue
+                async with session.lock:
+                    try:
+                        await self.turn(session, ws, text)
+                    except websockets.ConnectionClosed:
+                        raise
+                    except Exception as e:
+                        print(f"🛑 [{session.session_id}] ターン処理エラー: {e}")
+                        await ws.send(json.dumps({"type": "error", "error": str(e)}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            session.connections -= 1
+            session.last_active = time.monotonic()
+
+    def process_request(self, connection, request):
+        # WebSocket 以外の簡単なHTTP（死活監視・状態）
+        if request.path == "/healthz":
+            return connection.respond(HTTPStatus.OK, "ok\n")
+        if request.path == "/stats":
+            body = json.dumps({
+                "sessions": len(self.sessions),
+                "connections": sum(s.connections for s in self.sessions.values()),
+                "synth_queued": self.synth.queued,
+                "synth_running": self.synth._running,
+            })
+            return connection.respond(HTTPStatus.OK, body + "\n")
+        if request.path == "/metrics" and trace.ENABLED:
+            # Prometheus のスクレイプ用（SORA_TRACE_PATH / SORA_METRICS_PORT を指定したときだけ）
+            response = connection.respond(HTTPStatus.OK, trace.get_tracer().render_metrics())
+            del response.headers["Content-Type"]
+            response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+            return response
+        return None
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        warmup_emotion_model(background=True)
+        trace.start()
+        janitor = asyncio.ensure_future(self._janitor())
+        try:
+            async with websockets.serve(self.handler, self.host, self.port,
+                                        process_request=self.process_request, max_size=2 ** 20):
+                print(f"🟢 ソラサーバー起動 ws://{self.host}:{self.port}/sessions/<id>")
+                await asyncio.Future()
+        finally:
+            janitor.cancel()
+            for session in self.sessions.values():
+                session.close()
+            await self.voicevox.aclose()
+            self._pool.shutdown(wait=False)
+            trace.shutdown()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(SoraServer().main())
+    except KeyboardInterrupt:
+        print("🟡 サーバーを停止します。")
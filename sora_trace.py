@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# sora_trace.py — 発話パイプラインの段ごとの遅延トレース（JSONL）と Prometheus 形式のメトリクス
+#   SORA_TRACE_PATH を指定すると区間（span）を1行1件のJSONで追記し、SORA_METRICS_PORT を指定すると
+#   http://127.0.0.1:<port>/metrics でカウンタ・ヒストグラムを返す。どちらも無ければ何もしない（ほぼ無コスト）。
+#   使い方: with span("synthesis", chars=len(text)): ...   /   observe("cue_late", late, key="lip")   /   count("vts_frame_dropped")
+
+import os
+import json
+import time
+import queue
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+TRACE_PATH   = os.environ.get("SORA_TRACE_PATH", "")              # 例: log/trace.jsonl
+METRICS_PORT = int(os.environ.get("SORA_METRICS_PORT", "0"))      # 例: 9464
+METRICS_HOST = os.environ.get("SORA_METRICS_HOST", "127.0.0.1")
+ENABLED = bool(TRACE_PATH or METRICS_PORT)
+
+# ヒストグラムの境界（秒）。口パクの遅れ（ms単位）から応答生成（秒単位）まで1本で受ける
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(attrs: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in attrs.items()))
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+class _Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def add(self, v: float):
+        self.counts[bisect.bisect_left(BUCKETS, v)] += 1
+        self.total += v
+        self.n += 1
+
+class Tracer:
+    """
+    メトリクス（スレッド安全）とトレースの書き出し。トレースは専用スレッドがまとめて追記するので、
+    計測する側はキューに積むだけで待たない。
+    """
+    def __init__(self, trace_path: str = TRACE_PATH, metrics_port: int = METRICS_PORT):
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self._hist: Dict[Tuple[str, Labels], _Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._q: Optional[queue.Queue] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+        if trace_path:
+            os.makedirs(os.path.dirname(trace_path) or ".", exist_ok=True)
+            self._q = queue.Queue()
+            threading.Thread(target=self._writer, name="TraceWriter", daemon=True).start()
+        if metrics_port:
+            self._start_server(metrics_port)
+
+    # --- 記録 ---
+    def observe(self, name: str, seconds: float, labels: Labels = ()):
+        with self._lock:
+            h = self._hist.get((name, labels))
+            if h is None:
+                h = self._hist[(name, labels)] = _Histogram()
+            h.add(seconds)
+
+    def count(self, name: str, n: float = 1, labels: Labels = ()):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + n
+
+    def record(self, rec: dict):
+        if self._q is not None:
+            self._q.put(rec)
+
+    def _writer(self):
+        while True:
+            batch = [self._q.get()]
+            while True:
+                try:
+                    batch.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch))
+            except Exception as e:
+                print(f"🛑 トレース書き込みエラー: {e}")
+
+    def flush(self, timeout: float = 2.0):
+        """積まれたトレースが書き終わるのを待つ（終了時用）"""
+        deadline = time.monotonic() + timeout
+        while self._q is not None and not self._q.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # --- 出力 ---
+    def render_metrics(self) -> str:
+        """Prometheus のテキスト形式"""
+        with self._lock:
+            hist = {k: (list(h.counts), h.total, h.n) for k, h in self._hist.items()}
+            counters = dict(self._counters)
+        lines = []
+        if hist:
+            lines += ["# HELP sora_stage_seconds Latency of each pipeline stage.",
+                      "# TYPE sora_stage_seconds histogram"]
+            for (name, labels), (counts, total, n) in sorted(hist.items()):
+                labels = (("stage", name),) + labels
+                acc = 0
+                for le, c in zip(BUCKETS, counts):
+                    acc += c
+                    lines.append(f"sora_stage_seconds_bucket{_fmt_labels(labels, ('le', repr(le)))} {acc}")
+                lines.append(f"sora_stage_seconds_bucket{_fmt_labels(labels, ('le', '+Inf'))} {n}")
+                lines.append(f"sora_stage_seconds_sum{_fmt_labels(labels)} {total:.6f}")
+                lines.append(f"sora_stage_seconds_count{_fmt_labels(labels)} {n}")
+        typed = set()
+        for (name, labels), v in sorted(counters.items()):
+            metric = f"sora_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_fmt_labels(labels)} {v:g}")
+        return "\n".join(lines) + "\n"
+
+    def _start_server(self, port: int):
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.render_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            self._server = ThreadingHTTPServer((METRICS_HOST, port), Handler)
+        except OSError as e:
+            print(f"🛑 メトリクス用ポートを開けません（{port}）: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        print(f"ℹ️ メトリクス: http://{METRICS_HOST}:{port}/metrics")
+
+    def close(self):
+        self.flush()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+def get_tracer() -> Tracer:
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+# ===== 計測する側のAPI（無効時は何もしない） =====
+class _Span:
+    __slots__ = ("name", "attrs", "t0")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """区間の途中で分かった属性を足す（件数・キャッシュ命中など）"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        dur = time.perf_counter() - self.t0
+        tracer = get_tracer()
+        labels = _labels({k: v for k, v in self.attrs.items() if k in LABEL_KEYS})
+        tracer.observe(self.name, dur, labels)
+        rec = {"ts": time.time() - dur, "span": self.name, "dur_ms": round(dur * 1000.0, 3),
+               "thread": threading.current_thread().name}
+        if self.attrs:
+            rec.update(self.attrs)
+        if exc_type is not None:
+            rec["error"] = exc_type.__name__
+            tracer.count("stage_errors", labels=(("stage", self.name),) + labels)
+        tracer.record(rec)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopSpan()
+
+# メトリクスのラベルにする属性（それ以外はトレースにだけ書く。値の種類が増えすぎないものだけ）
+LABEL_KEYS = ("key", "kind", "cached", "backend")
+
+def span(name: str, **attrs):
+    """with span("audio_query"): ... で区間の所要時間を記録する"""
+    if not ENABLED:
+        return _NOOP
+    return _Span(name, attrs)
+
+def observe(name: str, seconds: float, **attrs):
+    """外で測った所要時間を記録する（口パクフレームの遅れなど）。トレースには書かない"""
+    if ENABLED:
+        get_tracer().observe(name, seconds, _labels(attrs))
+
+def count(name: str, n: float = 1, **attrs):
+    if ENABLED:
+        get_tracer().count(name, n, _labels(attrs))
+
+def event(name: str, **attrs):
+    """その時点の出来事をトレースに書き、件数を数える（握りつぶしていたエラーなど）"""
+    if not ENABLED:
+        return
+    tracer = get_tracer()
+    tracer.count(name, labels=_labels({k: v for k, v in attrs.items() if k in LABEL_KEYS}))
+    tracer.record(dict({"ts": time.time(), "event": name, "thread": threading.current_thread().name}, **attrs))
+
+def start():
+    """有効なら起動時にメトリクスサーバーとトレース書き出しを立ち上げる（初回の計測でも自動で立ち上がる）"""
+    if ENABLED:
+        get_tracer()
+
+def shutdown():
+    global _tracer
+    with _tracer_lock:
+        tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
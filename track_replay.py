@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# track_replay.py — sora_render.py が書き出したトラックを VTS に流す（音声と同じ時計で。行ごとの計算はしない）
+
+import os
+import sys
+import json
+import argparse
+
+from sora_main import LIP_AMP_INPUTS, LIP_FORM_INPUTS
+from cue_scheduler import CueScheduler
+from audio_buffer import AudioClip
+from audio_output import get_audio_output, shutdown_audio_output
+from vts_lipsync import get_vts_session, shutdown_vts_session, select_keyframes
+
+def load_track(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        track = json.load(f)
+    if track.get("version") != 1:
+        raise ValueError(f"未対応のトラック形式: version={track.get('version')}")
+    return track
+
+def replay(track_path: str, audio: bool = True, start: float = 0.0):
+    """
+    トラックの口パク/Hotkey を CueScheduler に積み、音声の鳴り始めを原点に発火する。
+    audio=False なら音声を鳴らさず今を原点にする。start 秒より前のイベントは飛ばす。
+    """
+    track = load_track(track_path)
+    session = get_vts_session(LIP_AMP_INPUTS, LIP_FORM_INPUTS)
+    try:
+        session.connect()
+    except Exception as e:
+        print(f"🛑 VTS接続エラー: {e}")
+
+    sched = CueScheduler()
+    frames = track["frames"]
+    for n in select_keyframes(frames["t"], frames["amp"], frames["form"]):
+        t = frames["t"][n]
+        if t >= start:
+            sched.schedule(t - start, session.post_amp_and_form, frames["amp"][n], frames["form"][n], key="lip")
+    for t, hotkey in track["cues"]:
+        if t >= start:
+            sched.schedule(t - start, session.post_hotkey, hotkey)
+
+    if audio:
+        with open(os.path.join(os.path.dirname(track_path), track["audio"]), "rb") as f:
+            clip = AudioClip.from_wav_bytes(f.read())
+        skip = int(start * clip.sample_rate)
+        seg = get_audio_output(clip.sample_rate, clip.channels).enqueue(clip.pcm[skip:])
+        seg.on_cancel(sched.stop)
+        seg.started.wait()
+        sched.anchor(seg.start_time)
+        sched.run()
+        seg.done.wait()
+    else:
+        sched.anchor()
+        sched.run()
+    sched.report("replay")
+    try:
+        session.send_amp_and_form(0.0, 0.0, timeout=2.0)
+    except Exception:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="ソラ レンダリング済みトラックの再生（VTSへ送出）")
+    parser.add_argument("track", help="<name>.track.json")
+    parser.add_argument("--no-audio", dest="audio", action="store_false", help="音声を鳴らさず口パク/モーションだけ送る")
+    parser.add_argument("--start", type=float, default=0.0, help="再生開始位置（秒）")
+    args = parser.parse_args()
+    try:
+        replay(args.track, audio=args.audio, start=max(0.0, args.start))
+    except KeyboardInterrupt:
+        print("🟡 再生を中断します。")
+    except Exception as e:
+        print(f"🛑 再生エラー: {e}")
+        sys.exit(1)
+    finally:
+        shutdown_audio_output()
+        shutdown_vts_session()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# tts_cache.py — 合成結果（WAV＋audio_query JSON）のディスクキャッシュ / 内容アドレス / LRU退避
+
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+CACHE_DIR      = os.environ.get("SORA_TTS_CACHE_DIR", os.path.join("cache", "tts"))
+CACHE_ENABLED  = os.environ.get("SORA_TTS_CACHE", "1") == "1"
+CACHE_MAX_MB   = float(os.environ.get("SORA_TTS_CACHE_MB", "512"))
+CACHE_MAX_DAYS = float(os.environ.get("SORA_TTS_CACHE_DAYS", "30"))  # 作成からの日数（使っても延びない）
+
+def make_key(text: str, style_id: int, engine_version: str, query_params: Optional[dict] = None) -> str:
+    """(テキスト, スタイル, エンジン版, クエリ調整) から決まるキー"""
+    src = json.dumps(
+        {"text": text, "style": int(style_id), "engine": engine_version, "params": query_params or {}},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(src.encode("utf-8")).hexdigest()
+
+class TTSCache:
+    """
+    <key>.wav と <key>.json を1組として保存する。スレッド安全（ロック中はファイルI/Oをしない）。
+    書き込みは一時ファイル→os.replace なので、別プロセスと同じディレクトリを共有しても壊れない。
+    有効期限（SORA_TTS_CACHE_DAYS）は作成からの日数。読み出しではファイルに触れないので、
+    よく使う項目も期限が来れば作り直す。LRU 順はプロセス内で持ち、起動時は作成順から始める。
+    """
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = int(CACHE_MAX_MB * 1024 * 1024),
+                 max_age_sec: float = CACHE_MAX_DAYS * 86400):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()  # key→(バイト数, 作成時刻)（古い順）
+        self._total = 0
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        return os.path.join(self.root, key + ".wav"), os.path.join(self.root, key + ".json")
+
+    def _scan(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            if not name.endswith(".wav"):
+                continue
+            key = name[:-4]
+            wav, aq = self._paths(key)
+            try:
+                st = os.stat(wav)
+                size = st.st_size + os.path.getsize(aq)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, key, size))
+        stale = []
+        for mtime, key, size in sorted(entries):
+            if self.max_age_sec and now - mtime > self.max_age_sec:
+                stale.append(key)
+                continue
+            self._index[key] = (size, mtime)
+            self._total += size
+        self._remove_files(stale + self._evict())
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.max_age_sec) and time.time() - created > self.max_age_sec
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """ヒット時は (wav_bytes, audio_query_json) を返す"""
+        wav, aq = self._paths(key)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and self._expired(entry[1]):
+                self._forget(key)
+                stale = True
+            else:
+                stale = False
+            if entry is None or stale:
+                self.misses += 1
+        if entry is None:
+            return None
+        if stale:
+            self._remove_files([key])
+            return None
+        try:
+            with open(wav, "rb") as f:
+                wav_bytes = f.read()
+            with open(aq, encoding="utf-8") as f:
+                aq_json = f.read()
+        except OSError:
+            with self._lock:
+                if self._index.get(key) == entry:  # 読んでいる間に put で差し替わっていなければ捨てる
+                    self._forget(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+            self.hits += 1
+        return wav_bytes, aq_json
+
+    def put(self, key: str, wav_bytes: bytes, aq_json: str):
+        wav, aq = self._paths(key)
+        data = aq_json.encode("utf-8")
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # JSON を先に置き、WAV の出現をもって完成とみなす（_scan は .wav を起点に読む）
+            for path, payload in ((aq, data), (wav, wav_bytes)):
+                with open(path + tmp_suffix, "wb") as f:
+                    f.write(payload)
+                os.replace(path + tmp_suffix, path)
+        except OSError as e:
+            print(f"🛑 TTSキャッシュ書き込みエラー: {e}")
+            return
+        with self._lock:
+            self._forget(key)
+            self._index[key] = (len(wav_bytes) + len(data), time.time())
+            self._total += self._index[key][0]
+            evicted = self._evict()
+        self._remove_files(evicted)
+
+    def _forget(self, key: str):
+        """索引から外す（ロック中に呼ぶ。ファイルは _remove_files でロックの外で消す）"""
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._total -= entry[0]
+
+    def _evict(self) -> list:
+        """容量超過分を古い順に索引から外し、外したキーを返す（ロック中に呼ぶ）"""
+        evicted = []
+        while self._index and self._total > self.max_bytes:
+            key = next(iter(self._index))
+            self._forget(key)
+            evicted.append(key)
+        return evicted
+
+    def _remove_files(self, keys):
+        for key in keys:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._index), "bytes": self._total}
+
+_cache: Optional[TTSCache] = None
+_cache_lock = threading.Lock()
+
+def get_tts_cache() -> Optional[TTSCache]:
+    """プロセス共有のキャッシュ（SORA_TTS_CACHE=0 なら None）"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache()
+        return _cache
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# voicevox_client.py — VOICEVOX エンジンのクライアント（keep-alive接続プール / 再試行 / 同時合成）
+
+import os, json, time, asyncio, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import httpx
+
+import sora_trace as trace
+from tts_cache import get_tts_cache, make_key
+
+QUERY_TIMEOUT     = float(os.environ.get("VOICEVOX_QUERY_TIMEOUT", "10"))
+SYNTHESIS_TIMEOUT = float(os.environ.get("VOICEVOX_SYNTHESIS_TIMEOUT", "15"))
+RETRIES           = int(os.environ.get("VOICEVOX_RETRIES", "2"))        # 失敗時の再試行回数
+RETRY_BACKOFF     = float(os.environ.get("VOICEVOX_RETRY_BACKOFF", "0.2"))
+MAX_PARALLEL      = int(os.environ.get("VOICEVOX_MAX_PARALLEL", "2"))   # 同時に投げる合成の上限
+
+# (テキスト, スタイルID) または (テキスト, スタイルID, クエリ調整)
+TTSItem = Tuple
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.TransportError):
+        return True
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code >= 500
+
+class VoicevoxClient:
+    """
+    同期版は httpx.Client、非同期版は httpx.AsyncClient（最初に使ったループに結び付く）で接続を使い回す。
+    tts() は TTSキャッシュを先に見て、無ければ audio_query→synthesis を行う。
+    tts_batch()/atts_batch() は max_parallel 件まで同時に合成し、入力順で返す。
+    """
+    def __init__(self, port: int, host: str = "127.0.0.1", max_parallel: int = MAX_PARALLEL,
+                 retries: int = RETRIES, query_timeout: float = QUERY_TIMEOUT,
+                 synthesis_timeout: float = SYNTHESIS_TIMEOUT, use_cache: bool = True):
+        self.base_url = f"http://{host}:{port}"
+        self.max_parallel = max(1, max_parallel)
+        self.retries = retries
+        self.query_timeout = query_timeout
+        self.synthesis_timeout = synthesis_timeout
+        self.cache = get_tts_cache() if use_cache else None
+        limits = httpx.Limits(max_connections=self.max_parallel * 2, max_keepalive_connections=self.max_parallel * 2)
+        self._limits = limits
+        self._client = httpx.Client(base_url=self.base_url, limits=limits)
+        self._aclient: Optional[httpx.AsyncClient] = None
+        self._asem: Optional[asyncio.Semaphore] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    # --- 同期 ---
+    def _post(self, path: str, timeout: float, **kw) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            try:
+                r = self._client.post(path, timeout=timeout, **kw)
+                r.raise_for_status()
+                return r
+            except Exception as e:
+                if attempt >= self.retries or not _retryable(e):
+                    raise
+                time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    def version(self) -> str:
+        # キャッシュキー用。取得できなかった場合は覚えずに次回また問い合わせる
+        if self._version is None:
+            try:
+                r = self._client.get("/version", timeout=3)
+                r.raise_for_status()
+                self._version = r.text.strip().strip('"')
+            except Exception:
+                return "unknown"
+        return self._version
+
+    def audio_query(self, text: str, style_id: int, query_params: Optional[dict] = None) -> str:
+        with trace.span("audio_query", chars=len(text)):
+            r = self._post("/audio_query", self.query_timeout, params={"text": text, "speaker": style_id})
+        return _apply_params(r.text, query_params)
+
+    def synthesis(self, aq_text: str, style_id: int) -> bytes:
+        with trace.span("synthesis", style=style_id):
+            r = self._post("/synthesis", self.synthesis_timeout, params={"speaker": style_id},
+                           headers={"Content-Type": "application/json"}, content=aq_text.encode("utf-8"))
+        return r.content
+
+    def _cache_key(self, text, style_id, query_params):
+        return make_key(text, style_id, self.version(), query_params) if self.cache is not None else None
+
+    def tts(self, text: str, style_id: int, query_params: Optional[dict] = None) -> Tuple[bytes, str]:
+        """返り値: (wav_bytes, audio_query_json)"""
+        key = self._cache_key(text, style_id, query_params)
+        if key is not None:
+            hit = self.cache.get(key)
+            trace.count("tts_cache", kind="hit" if hit is not None else "miss")
+            if hit is not None:
+                return hit
+        aq_text = self.audio_query(text, style_id, query_params)
+        wav = self.synthesis(aq_text, style_id)
+        if key is not None:
+            self.cache.put(key, wav, aq_text)
+        return wav, aq_text
+
+    def submit(self, text: str, style_id: int, query_params: Optional[dict] = None) -> Future:
+        """tts() を合成用スレッドプールへ投げる（同時実行は max_parallel まで）"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="voicevox")
+        return self._pool.submit(self.tts, text, style_id, query_params)
+
+    def tts_batch(self, items: Sequence[TTSItem]) -> List[Tuple[bytes, str]]:
+        futures = [self.submit(*it) for it in items]
+        return [f.result() for f in futures]
+
+    # --- 非同期 ---
+    def _async_client(self) -> httpx.AsyncClient:
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(base_url=self.base_url, limits=self._limits)
+            self._asem = asyncio.Semaphore(self.max_parallel)
+        return self._aclient
+
+    async def _apost(self, path: str, timeout: float, **kw) -> httpx.Response:
+        client = self._async_client()
+        for attempt in range(self.retries + 1):
+            try:
+                r = await client.post(path, timeout=timeout, **kw)
+                r.raise_for_status()
+                return r
+            except Exception as e:
+                if attempt >= self.retries or not _retryable(e):
+                    raise
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    async def aversion(self) -> str:
+        if self._version is None:
+            try:
+                r = await self._async_client().get("/version", timeout=3)
+                r.raise_for_status()
+                self._version = r.text.strip().strip('"')
+            except Exception:
+                return "unknown"
+        return self._version
+
+    async def atts(self, text: str, style_id: int, query_params: Optional[dict] = None) -> Tuple[bytes, str]:
+        key = None
+        if self.cache is not None:
+            key = make_key(text, style_id, await self.aversion(), query_params)
+            hit = await asyncio.to_thread(self.cache.get, key)
+            trace.count("tts_cache", kind="hit" if hit is not None else "miss")
+            if hit is not None:
+                return hit
+        self._async_client()
+        async with self._asem:
+            with trace.span("audio_query", chars=len(text)):
+                r = await self._apost("/audio_query", self.query_timeout, params={"text": text, "speaker": style_id})
+            aq_text = _apply_params(r.text, query_params)
+            with trace.span("synthesis", style=style_id):
+                r = await self._apost("/synthesis", self.synthesis_timeout, params={"speaker": style_id},
+                                      headers={"Content-Type": "application/json"}, content=aq_text.encode("utf-8"))
+        if key is not None:
+            await asyncio.to_thread(self.cache.put, key, r.content, aq_text)
+        return r.content, aq_text
+
+    async def atts_batch(self, items: Sequence[TTSItem]) -> List[Tuple[bytes, str]]:
+        return list(await asyncio.gather(*(self.atts(*it) for it in items)))
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    def close(self):
+        self._client.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+def _apply_params(aq_text: str, query_params: Optional[dict]) -> str:
+    if not query_params:
+        return aq_text
+    aq = json.loads(aq_text)
+    aq.update(query_params)
+    return json.dumps(aq, ensure_ascii=False)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_voicevox_client(port: int) -> VoicevoxClient:
+    """ポートごとのプロセス共有クライアント"""
+    with _clients_lock:
+        client = _clients.get(port)
+        if client is None:
+            client = _clients[port] = VoicevoxClient(port)
+        return client
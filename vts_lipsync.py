@@ -1,26 +1,37 @@
 # -*- coding: utf-8 -*-
-# vts_lipsync.py — SoraMouthProxy優先 / 入力注入 / 専用asyncループ / 任意Form対応
+# vts_lipsync.py — SoraMouthProxy優先 / 入力注入 / 共有セッション / 任意Form対応
 
-import os, json, re, asyncio, threading
+import os, json, asyncio, threading, time
 from typing import Optional, List, Dict
 import websockets
 
+import sora_trace as trace
+
 API_NAME = "VTubeStudioPublicAPI"
 API_VERSION = "1.0"
 VTS_WS_URL = os.environ.get("VTS_WS_URL", "ws://127.0.0.1:8001")
 TOKEN_PATH = os.environ.get("VTS_TOKEN_PATH", "vts_token.txt")
 PLUGIN_NAME = os.environ.get("VTS_PLUGIN_NAME", "SoraLipSync")
 DEVELOPER  = os.environ.get("VTS_DEVELOPER",  "SoraDev")
+HEALTH_INTERVAL = float(os.environ.get("VTS_HEALTH_INTERVAL", "10"))  # 死活監視の間隔（秒）
+BACKOFF_MAX     = float(os.environ.get("VTS_BACKOFF_MAX", "10"))      # 再接続バックオフ上限（秒）
+REQUEST_TIMEOUT = float(os.environ.get("VTS_REQUEST_TIMEOUT", "5"))   # 応答待ちの上限（秒）
+MAX_INFLIGHT_FRAMES = int(os.environ.get("VTS_MAX_INFLIGHT", "4"))    # 応答未着の注入フレーム上限
+FRAME_STALE_SEC = 1.0           # これより古い未応答フレームは諦める
+WRITE_BUFFER_LIMIT = 64 * 1024  # 送信バッファがこれを超えたら詰まりとみなす
+FRAME_DELTA  = float(os.environ.get("VTS_FRAME_DELTA", "0.02"))  # これ以下の変化しかないパラメータは送らない
+KEYFRAME_SEC = float(os.environ.get("VTS_KEYFRAME_SEC", "0.5"))  # 変化が無くてもこの間隔で送り直す（VTSは約1秒注入が途切れると制御を手放す）
 
-_VOWEL_LATIN = re.compile(r"[aiueoAIUEO]")
-
-def text_to_vowel_stream(text: str) -> List[str]:
-    vlist = _VOWEL_LATIN.findall(text)
-    if vlist:
-        return [v.lower() for v in vlist]
-    return ["a"] * max(1, min(len(text), 60))
+class VTSDisconnected(RuntimeError):
+    pass
 
 class _VTSClient:
+    """
+    パイプライン型のVTSクライアント。受信は単一のリーダータスクが requestID→Future に振り分ける。
+    注入フレームは応答を待たずに送り、未応答が溜まったら最新フレームだけ残して古いものは捨てる。
+    同じループ周回で届いたフレームは1回の注入にまとめ、前回送った値から FRAME_DELTA 以下しか
+    変わっていないパラメータは送らない（KEYFRAME_SEC ごとに全パラメータを送り直す）。
+    """
     def __init__(
         self,
         preferred_inputs: Optional[List[str]] = None,
@@ -29,6 +40,19 @@ class _VTSClient:
         self.ws: Optional[websockets.WebSocketClientProtocol] = None
         self._req_id = 0
         self._authed = False
+        self._reader: Optional[asyncio.Task] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        # 注入フレーム（応答を待たない）：requestID→送信時刻、詰まり時に保留する最新フレーム
+        self._frames_inflight: Dict[str, float] = {}
+        self._latest_frame: Optional[Dict[str, float]] = None
+        # 差分送信：同じ周回で届いた値の束、最後に送った値とその時刻
+        self._batch: Dict[str, float] = {}
+        self._batch_scheduled = False
+        self._last_sent: Dict[str, float] = {}
+        self._last_sent_at = 0.0
+        self.stats = {"frames_sent": 0, "frames_dropped": 0, "frames_suppressed": 0,
+                      "frame_errors": 0, "frame_timeouts": 0}
+        self.last_error: Optional[str] = None
         # 口の開き（必須）
         self.amp_input: Optional[str] = None
         # 口の形（任意）
@@ -42,25 +66,70 @@ class _VTSClient:
             "SoraMouthFormProxy", "MouthForm", "MouthShape"
         ]
 
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None and self._authed
+
     async def connect(self):
-        self.ws = await websockets.connect(
-            VTS_WS_URL, max_size=1<<20, ping_interval=15, ping_timeout=20
-        )
+        with trace.span("vts_connect"):
+            self.ws = await websockets.connect(
+                VTS_WS_URL, max_size=1<<20, ping_interval=15, ping_timeout=20
+            )
+        self._reader = asyncio.ensure_future(self._read_loop(self.ws))
         try:
             await self._send("APIStateRequest")
         except Exception:
             pass
-        await self._authenticate()
-        await self._detect_inputs()
+        with trace.span("vts_auth"):
+            await self._authenticate()
+        # 入力検出は初回のみ（再接続時はキャッシュを使う）
+        if not self.amp_input:
+            await self._detect_inputs()
 
     async def close(self):
-        if self.ws:
-            await self.ws.close()
-            self.ws = None
+        ws, self.ws = self.ws, None
+        self._authed = False
+        self._last_sent, self._last_sent_at = {}, 0.0  # 張り直したら VTS 側は値を覚えていない
+        if ws:
+            try:
+                await ws.close()
+            except Exception:
+                pass
+        if self._reader:
+            self._reader.cancel()
+            self._reader = None
 
-    async def _send(self, message_type: str, data: Optional[dict]=None) -> dict:
-        if not self.ws:
-            raise RuntimeError("WebSocket not connected")
+    async def _read_loop(self, ws):
+        try:
+            async for raw in ws:
+                try:
+                    resp = json.loads(raw)
+                except ValueError:
+                    continue
+                rid = str(resp.get("requestID", ""))
+                fut = self._pending.pop(rid, None)
+                if fut is not None:
+                    if not fut.done():
+                        fut.set_result(resp)
+                    continue
+                t_sent = self._frames_inflight.pop(rid, None)
+                if t_sent is not None:
+                    trace.observe("vts_frame_rtt", time.monotonic() - t_sent)
+                    self._check_frame_error(resp)
+                    self._flush_latest_frame()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self.ws is ws:
+                self.ws = None
+                self._authed = False
+            self._frames_inflight.clear()
+            pending, self._pending = self._pending, {}
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(VTSDisconnected("VTS connection closed"))
+
+    def _make_payload(self, message_type: str, data: Optional[dict]=None) -> dict:
         self._req_id += 1
         payload = {
             "apiName": API_NAME, "apiVersion": API_VERSION,
@@ -68,8 +137,28 @@ class _VTSClient:
         }
         if data is not None:
             payload["data"] = data
-        await self.ws.send(json.dumps(payload))
-        resp = json.loads(await self.ws.recv())
+        return payload
+
+    async def _roundtrip(self, payload: dict) -> dict:
+        if not self.ws:
+            raise VTSDisconnected("WebSocket not connected")
+        rid = payload["requestID"]
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        try:
+            try:
+                await self.ws.send(json.dumps(payload))
+            except websockets.ConnectionClosed as e:
+                raise VTSDisconnected(str(e)) from e
+            return await asyncio.wait_for(fut, timeout=REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(rid, None)
+
+    async def _send(self, message_type: str, data: Optional[dict]=None) -> dict:
+        if not self.ws:
+            raise VTSDisconnected("WebSocket not connected")
+        payload = self._make_payload(message_type, data)
+        resp = await self._roundtrip(payload)
         d = resp.get("data", {})
         if isinstance(d, dict) and d.get("errorID"):
             if d.get("errorID")==8 and message_type not in (
@@ -77,8 +166,7 @@ class _VTSClient:
             ):
                 if not self._authed:
                     await self._authenticate()
-                    await self.ws.send(json.dumps(payload))
-                    resp = json.loads(await self.ws.recv())
+                    resp = await self._roundtrip(payload)
                     d = resp.get("data", {})
                     if isinstance(d, dict) and d.get("errorID"):
                         raise RuntimeError(f"VTS error {d.get('errorID')}: {d.get('message')}")
@@ -86,6 +174,106 @@ class _VTSClient:
             raise RuntimeError(f"VTS error {d.get('errorID')}: {d.get('message')}")
         return resp
 
+    # --- 注入フレーム（ループスレッド上で呼ぶ・応答を待たない） ---
+    def post_frame(self, values: Dict[str, float]):
+        # 同じ周回で届いた値（開き・Form・その他のパラメータ）は束ねて1回で送る
+        self._batch.update((pid, float(v)) for pid, v in values.items() if pid is not None)
+        if not self._batch_scheduled:
+            self._batch_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush_batch)
+
+    def _flush_batch(self):
+        values, self._batch = self._batch, {}
+        self._batch_scheduled = False
+        if not self.connected:
+            self.stats["frames_dropped"] += 1
+            trace.count("vts_frames", kind="dropped")
+            return
+        values = self._changed_values(values)
+        if values:
+            self._submit_frame(values)
+
+    def _changed_values(self, values: Dict[str, float]) -> Dict[str, float]:
+        """前回送った値から変わったものだけ返す。キーフレーム時刻を過ぎていれば全パラメータを返す"""
+        now = time.monotonic()
+        if now - self._last_sent_at >= KEYFRAME_SEC:
+            values = {**self._last_sent, **values}
+        else:
+            last = self._last_sent
+            values = {pid: v for pid, v in values.items()
+                      if pid not in last or abs(v - last[pid]) > FRAME_DELTA}
+            if not values:
+                self.stats["frames_suppressed"] += 1
+                trace.count("vts_frames", kind="suppressed")
+                return values
+        self._last_sent.update(values)
+        self._last_sent_at = now
+        return values
+
+    def _submit_frame(self, values: Dict[str, float]):
+        now = time.monotonic()
+        for rid, t_sent in list(self._frames_inflight.items()):
+            if now - t_sent > FRAME_STALE_SEC:
+                del self._frames_inflight[rid]
+                self.stats["frame_timeouts"] += 1
+                trace.count("vts_frames", kind="timeout")
+        if len(self._frames_inflight) >= MAX_INFLIGHT_FRAMES or self._write_backlog() > WRITE_BUFFER_LIMIT:
+            # 詰まっている：保留は1件だけ。差分フレームなので古い保留分の値は新しい値の下に重ねて残す
+            if self._latest_frame is not None:
+                self.stats["frames_dropped"] += 1
+                trace.count("vts_frames", kind="dropped")
+                values = {**self._latest_frame, **values}
+            self._latest_frame = values
+            return
+        self._emit_frame(values)
+
+    def _flush_latest_frame(self):
+        if self._latest_frame is not None and self.connected:
+            values, self._latest_frame = self._latest_frame, None
+            self._emit_frame(values)
+
+    def _emit_frame(self, values: Dict[str, float]):
+        params = [{"id": pid, "value": float(val)} for pid, val in values.items() if pid is not None]
+        if not params:
+            return
+        payload = self._make_payload("InjectParameterDataRequest", {
+            "parameterValues": params,
+            "faceFound": True,
+            "mode": "set",
+        })
+        self._frames_inflight[payload["requestID"]] = time.monotonic()
+        self.stats["frames_sent"] += 1
+        trace.count("vts_frames", kind="sent")
+        task = asyncio.ensure_future(self.ws.send(json.dumps(payload)))
+        task.add_done_callback(self._on_frame_sent)
+
+    def _on_frame_sent(self, task: asyncio.Task):
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            self._record_frame_error(f"send failed: {e}")
+
+    def _check_frame_error(self, resp: dict):
+        d = resp.get("data", {})
+        if isinstance(d, dict) and d.get("errorID"):
+            self._record_frame_error(f"VTS error {d.get('errorID')}: {d.get('message')}")
+
+    def _record_frame_error(self, msg: str):
+        self.stats["frame_errors"] += 1
+        trace.count("vts_frames", kind="error")
+        self.last_error = msg
+        n = self.stats["frame_errors"]
+        if n == 1 or n % 100 == 0:  # 毎フレームは出さない
+            print(f"🛑 [VTS] 注入エラー（累計{n}件）: {msg}")
+
+    def _write_backlog(self) -> int:
+        transport = getattr(self.ws, "transport", None)
+        try:
+            return transport.get_write_buffer_size() if transport else 0
+        except Exception:
+            return 0
+
     async def _authenticate(self):
         token = None
         if os.path.exists(TOKEN_PATH):
@@ -156,68 +344,268 @@ class _VTSClient:
             "faceFound": True,
             "mode": "set",
         })
+        self._last_sent.update((p["id"], p["value"]) for p in params)
+        self._last_sent_at = time.monotonic()
 
     async def send_amplitude(self, a: float):
         a = max(0.0, min(float(a), 1.0))
         await self.send_values({self.amp_input: a})
 
-    async def send_amp_and_form(self, a: float, form: Optional[float]):
+    def _amp_form_values(self, a: float, form: Optional[float]) -> Dict[str, float]:
         a = max(0.0, min(float(a), 1.0))
         vals = {self.amp_input: a}
         if form is not None and self.form_input:
             # Formは -1.0〜+1.0 を想定
             f = max(-1.0, min(float(form), 1.0))
             vals[self.form_input] = f
-        await self.send_values(vals)
+        return vals
 
-class VTSLipsync:
+    async def send_amp_and_form(self, a: float, form: Optional[float]):
+        # 確実に届けたい送信（閉口など）。保留中の古いフレームが後から上書きしないよう捨てる
+        self._latest_frame = None
+        await self.send_values(self._amp_form_values(a, form))
+
+    def post_amp_and_form(self, a: float, form: Optional[float]):
+        self.post_frame(self._amp_form_values(a, form))
+
+    async def trigger_hotkey(self, hotkey_name: str):
+        with trace.span("vts_hotkey", hotkey=hotkey_name):
+            await self._send("HotkeyTriggerRequest", {"hotkeyID": hotkey_name})
+
+class VTSSession:
     """
-    同期API（スレッド安全）。開きと任意のFormを送出する。
-    send_vowel(vowel, base_amp) で母音に応じたゲイン＆Formを自動適用。
+    プロセス共有のVTS接続（口パク・Hotkey共用、スレッド安全）。
+    認証と入力検出は初回のみ行い、切断時はバックオフ付きで再接続、定期的に死活監視する。
+    loop を渡すとそのイベントループ上で動き（専用スレッドを作らない）、a〜 の非同期APIを使う。
     """
     def __init__(
         self,
         preferred_inputs: Optional[List[str]] = None,
         preferred_form_inputs: Optional[List[str]] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
     ):
-        self._client = _VTSClient(
+        self.client = _VTSClient(
             preferred_inputs=preferred_inputs,
             preferred_form_inputs=preferred_form_inputs
         )
-        # 開きゲイン（母音ごと）
-        self._vowel_gain = {"a":1.00, "i":0.70, "u":0.85, "e":0.90, "o":0.95, "x":0.00}
-        # 任意Form（母音→形：-1..+1）。入力が無ければ自動的に送らない。
-        self._vowel_form = {"a": 0.00, "i": -0.60, "u": -0.30, "e": +0.30, "o": +0.60, "x": 0.00}
-
-        self._loop = asyncio.new_event_loop()
-        self._loop_thread = threading.Thread(
-            target=self._loop.run_forever, name="VTSLipsyncLoop", daemon=True
-        )
-        self._loop_thread.start()
+        self._conn_lock: Optional[asyncio.Lock] = None
+        self._wanted = False      # 一度でも接続要求があれば死活監視で再接続する
+        self._backoff = 0.0
+        self._next_retry = 0.0
+
+        self._loop_thread: Optional[threading.Thread] = None
+        if loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(
+                target=self._loop.run_forever, name="VTSSessionLoop", daemon=True
+            )
+            self._loop_thread.start()
+        else:
+            self._loop = loop
+        self._health = asyncio.run_coroutine_threadsafe(self._health_loop(), self._loop)
 
     def _run(self, coro, timeout: float = 10.0):
         fut = asyncio.run_coroutine_threadsafe(coro, self._loop)
         return fut.result(timeout=timeout)
 
-    def connect(self):
-        self._run(self._client.connect())
+    @property
+    def connected(self) -> bool:
+        return self.client.connected
+
+    async def _ensure(self):
+        if self._conn_lock is None:
+            self._conn_lock = asyncio.Lock()
+        async with self._conn_lock:
+            if self.client.connected:
+                return
+            # 連続失敗中は待機時間が過ぎるまで即座に諦める（再接続の嵐を防ぐ）
+            if time.monotonic() < self._next_retry:
+                raise RuntimeError("VTS reconnect backoff")
+            try:
+                await self.client.connect()
+            except Exception:
+                await self.client.close()
+                self._backoff = min(max(self._backoff * 2, 0.5), BACKOFF_MAX)
+                self._next_retry = time.monotonic() + self._backoff
+                raise
+            self._backoff = 0.0
+            self._next_retry = 0.0
+
+    async def _call(self, fn, *args):
+        await self._ensure()
+        try:
+            return await fn(*args)
+        except (websockets.ConnectionClosed, VTSDisconnected):
+            # 途中で切れた場合は一度だけ張り直して再送
+            await self._ensure()
+            return await fn(*args)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            if not self._wanted:
+                continue
+            try:
+                if self.client.connected:
+                    await asyncio.wait_for(self.client._send("APIStateRequest"), timeout=3.0)
+                else:
+                    await self._ensure()
+            except Exception:
+                await self.client.close()
+
+    def connect(self, timeout: float = 10.0):
+        self._wanted = True
+        self._run(self._ensure(), timeout=timeout)
+
+    def send_amp_and_form(self, a: float, form: Optional[float], timeout: float = 2.0):
+        self._run(self._call(self.client.send_amp_and_form, a, form), timeout=timeout)
+
+    def post_amp_and_form(self, a: float, form: Optional[float]):
+        """ノンブロッキング送信（応答を待たない。詰まったら古いフレームは捨てる）"""
+        self._loop.call_soon_threadsafe(self.client.post_amp_and_form, a, form)
+
+    def post_values(self, values: Dict[str, float]):
+        """任意の入力パラメータをノンブロッキングで送る（同じ周回の口パクフレームと1回の注入にまとめる）"""
+        self._loop.call_soon_threadsafe(self.client.post_frame, dict(values))
+
+    def post_hotkey(self, hotkey_name: str):
+        """ノンブロッキングでHotkeyを送る（結果は待たない）"""
+        def _go():
+            task = asyncio.ensure_future(self._call(self.client.trigger_hotkey, hotkey_name))
+            task.add_done_callback(_swallow)
+        def _swallow(t: asyncio.Task):
+            # 結果は待たないが、握りつぶした失敗はトレースに残す
+            if not t.cancelled() and t.exception() is not None:
+                trace.event("swallowed_error", kind="post_hotkey", hotkey=hotkey_name, error=repr(t.exception()))
+        self._loop.call_soon_threadsafe(_go)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return dict(self.client.stats)
+
+    def trigger_hotkey(self, hotkey_name: str, timeout: float = 2.0):
+        self._run(self._call(self.client.trigger_hotkey, hotkey_name), timeout=timeout)
+
+    # --- 非同期API（どのループから呼んでもセッションのループ上で実行する） ---
+    async def _acall(self, coro):
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    async def aconnect(self):
+        self._wanted = True
+        await self._acall(self._ensure())
+
+    async def asend_amp_and_form(self, a: float, form: Optional[float]):
+        await self._acall(self._call(self.client.send_amp_and_form, a, form))
+
+    async def atrigger_hotkey(self, hotkey_name: str):
+        await self._acall(self._call(self.client.trigger_hotkey, hotkey_name))
+
+    async def aclose(self):
+        self._wanted = False
+        self._health.cancel()
+        try: await self._acall(self.client.send_amplitude(0.0))
+        except Exception: pass
+        await self._acall(self.client.close())
 
     def close(self):
-        try: self._run(self._client.send_amplitude(0.0), timeout=2.0)
+        self._wanted = False
+        try: self._health.cancel()
+        except Exception: pass
+        if self._loop_thread is None:
+            # 借りたループは止めない。閉じる処理だけ予約する（aclose() 済みなら何もしない）
+            try: self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.client.close()))
+            except Exception: pass
+            return
+        try: self._run(self.client.send_amplitude(0.0), timeout=2.0)
         except Exception: pass
-        try: self._run(self._client.close(), timeout=3.0)
+        try: self._run(self.client.close(), timeout=3.0)
         except Exception: pass
         try:
             self._loop.call_soon_threadsafe(self._loop.stop)
             self._loop_thread.join(timeout=2.0)
         except Exception: pass
 
+_session: Optional[VTSSession] = None
+_session_lock = threading.Lock()
+
+def get_vts_session(
+    preferred_inputs: Optional[List[str]] = None,
+    preferred_form_inputs: Optional[List[str]] = None,
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+) -> VTSSession:
+    """プロセス共有セッションを返す（入力候補・ループは最初の呼び出しのものを使う）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = VTSSession(preferred_inputs, preferred_form_inputs, loop=loop)
+        return _session
+
+def shutdown_vts_session():
+    global _session
+    with _session_lock:
+        sess, _session = _session, None
+    if sess:
+        sess.close()
+
+# 母音ごとの開きゲインと Form（-1..+1）。send_vowel とオフラインレンダラで共用
+VOWEL_GAIN = {"a": 1.00, "i": 0.70, "u": 0.85, "e": 0.90, "o": 0.95, "x": 0.00}
+VOWEL_FORM = {"a": 0.00, "i": -0.60, "u": -0.30, "e": +0.30, "o": +0.60, "x": 0.00}
+
+def vowel_amp_form(vowel: str, base_amp: float):
+    """母音と基本の開きから、実際に送る (開き 0..1, Form) を返す"""
+    v = (vowel or "x").lower()
+    a = max(0.0, min(base_amp * VOWEL_GAIN.get(v, 1.0), 1.0))
+    return a, VOWEL_FORM.get(v, 0.0)
+
+def select_keyframes(times, amps, forms, delta: float = FRAME_DELTA, keyframe_sec: float = KEYFRAME_SEC) -> List[int]:
+    """
+    口パク列から実際に送るフレームの番号を選ぶ（送信レートを変化の速さに合わせる）。
+    前に選んだフレームから開き/Form が delta を超えて変わったか、keyframe_sec 経ったフレームだけ残す。
+    口が閉じたまま・開いたままの区間は keyframe_sec ごとの1枚になり、速く動く区間は元のレートのまま。最後のフレームは必ず残す。
+    """
+    keep: List[int] = []
+    last_t = last_a = last_f = None
+    for n, (t, a, f) in enumerate(zip(times, amps, forms)):
+        if (last_t is None or abs(a - last_a) > delta or abs(f - last_f) > delta
+                or t - last_t >= keyframe_sec):
+            keep.append(n)
+            last_t, last_a, last_f = t, a, f
+    n_last = min(len(times), len(amps), len(forms)) - 1
+    if keep and keep[-1] != n_last:
+        keep.append(n_last)
+    return keep
+
+class VTSLipsync:
+    """
+    同期API（スレッド安全）。開きと任意のFormを送出する。
+    send_vowel(vowel, base_amp) で母音に応じたゲイン＆Formを自動適用。
+    接続はプロセス共有の VTSSession を使い、close() でも切断しない。
+    """
+    def __init__(
+        self,
+        preferred_inputs: Optional[List[str]] = None,
+        preferred_form_inputs: Optional[List[str]] = None,
+    ):
+        self._session = get_vts_session(preferred_inputs, preferred_form_inputs)
+        # 母音ごとのゲイン/Form は VOWEL_GAIN / VOWEL_FORM。Form入力が無ければ自動的に送らない。
+
+    def connect(self):
+        self._session.connect()
+
+    def close(self):
+        # 口を閉じるだけ。共有セッションは shutdown_vts_session() で閉じる
+        try: self._session.send_amp_and_form(0.0, 0.0, timeout=2.0)
+        except Exception: pass
+
     def send_vowel(self, vowel: str, base_amp: float):
-        v = (vowel or "x").lower()
-        gain = self._vowel_gain.get(v, 1.0)
-        form = self._vowel_form.get(v, 0.0)
-        a = max(0.0, min(base_amp * gain, 1.0))
+        self.send_frame(*vowel_amp_form(vowel, base_amp))
+
+    def send_frame(self, a: float, form: Optional[float]):
+        """変換済みの (開き, Form) を送る"""
         try:
-            self._run(self._client.send_amp_and_form(a, form), timeout=2.0)
-        except Exception:
+            self._session.post_amp_and_form(a, form)
+        except Exception as e:
+            trace.event("swallowed_error", kind="send_frame", error=repr(e))
             return  # クローズ中などは無視